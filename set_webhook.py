@@ -14,7 +14,8 @@ if not BOT_TOKEN or not WEBHOOK_URL:
 set_webhook_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
 get_webhook_info_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo"
 
-# response = requests.get(set_webhook_url, params={"url": WEBHOOK_URL})
+# Only message updates are handled; asking for just those keeps the rest from being sent at all
+# response = requests.get(set_webhook_url, params={"url": WEBHOOK_URL, "allowed_updates": '["message"]'})
 # print(response.json())
 
 print(f"Webhook set to: {WEBHOOK_URL}")
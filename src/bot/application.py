@@ -1,21 +1,59 @@
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
-from src.bot.handlers import start, help_command,check_alive, handle_text,unknown_command, error_handler, search_web, remove_background
-from src.config import BOT_TOKEN
-
-if BOT_TOKEN is None:
-    raise ValueError("BOT_TOKEN is not set in the environment.")
-
-application = (
-    ApplicationBuilder()
-    .token(BOT_TOKEN)
-    .build()
-)
-
-application.add_handler(CommandHandler("start", start))
-application.add_handler(CommandHandler("help", help_command))
-application.add_handler(CommandHandler("isalive", check_alive))
-application.add_handler(CommandHandler("search", search_web))
-application.add_handler(CommandHandler("removebg", remove_background))
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
-application.add_error_handler(error_handler)
\ No newline at end of file
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, TypeHandler, filters
+from src.bot.handlers import start, help_command,check_alive, handle_text,unknown_command, error_handler, search_web, remove_background, identify_image, broadcast_command, broadcast_status, broadcast_stop, broadcast_resume
+from src.bot.rate_limit import admission_check
+from src.bot.send_scheduler import send_scheduler
+from src.bot.state_store import BotContext
+from src.config import BOT_TOKEN, TELEGRAM_API_BASE_URL
+
+
+def build_application() -> Application:
+    if BOT_TOKEN is None:
+        raise ValueError("BOT_TOKEN is not set in the environment.")
+
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE_URL}/file/bot")
+        # Handlers read conversation state from the bounded store as context.state, not user_data
+        .context_types(ContextTypes(context=BotContext))
+        # Every outbound request goes through the flood-limit aware scheduler
+        .rate_limiter(send_scheduler)
+        .build()
+    )
+
+    # Admission control runs first (group -1) and stops updates that are over their limits
+    application.add_handler(TypeHandler(Update, admission_check), group=-1)
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("isalive", check_alive))
+    application.add_handler(CommandHandler("search", search_web))
+    application.add_handler(CommandHandler("removebg", remove_background))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status))
+    application.add_handler(CommandHandler("broadcast_stop", broadcast_stop))
+    application.add_handler(CommandHandler("broadcast_resume", broadcast_resume))
+    # Photos captioned with /removebg; any other photo is described by a vision model
+    application.add_handler(MessageHandler(filters.PHOTO & filters.CaptionRegex(r"^/removebg(@\w+)?(\s|$)"), remove_background))
+    application.add_handler(MessageHandler(filters.PHOTO, identify_image))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    application.add_error_handler(error_handler)
+    return application
+
+
+_application: Application | None = None
+
+
+def get_application() -> Application:
+    """
+    Returns this process's PTB Application, building it on first use.
+
+    It is built lazily (from the FastAPI lifespan) rather than at import, so a gunicorn
+    master that imports the app before forking does not create bot state its workers share.
+    """
+    global _application
+    if _application is None:
+        _application = build_application()
+    return _application
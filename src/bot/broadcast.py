@@ -0,0 +1,280 @@
+"""
+Broadcasts a message to every active user in the users collection.
+
+Users are streamed from MongoDB in _id order with a cursor, BROADCAST_BATCH_SIZE at a
+time, and sent to through the bot's pooled client and the send scheduler's bulk lane,
+so a broadcast runs at the allowed rate without delaying interactive replies. Progress
+is saved in the broadcasts collection as a checkpoint (the highest user id below which
+every user has been handled), so an interrupted broadcast resumes where it stopped.
+Users who blocked the bot are marked inactive and skipped from then on.
+
+Admins run it with /broadcast; from a shell:
+
+    python -m src.bot.broadcast "<b>News:</b> ..." --parse-mode HTML
+    python -m src.bot.broadcast --resume <broadcast id>
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from src.bot.send_scheduler import BULK
+from src.config import (
+    BOT_TOKEN,
+    TELEGRAM_API_BASE_URL,
+    BROADCAST_BATCH_SIZE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_REPORT_INTERVAL,
+    check_required,
+)
+from src.database.db import close_db_client, get_db_client
+
+logger = logging.getLogger(__name__)
+
+
+def _collection(name: str):
+    return get_db_client().get_database("telegram_bot_db").get_collection(name)
+
+
+class Broadcast:
+    def __init__(self, bot: Bot, broadcast_id: str, text: str, parse_mode: str | None = None):
+        self.bot = bot
+        self.id = broadcast_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.status = "pending"
+        self.checkpoint: int | None = None
+        self.total = 0
+        self.counts = {"sent": 0, "blocked": 0, "failed": 0}
+        # Users being sent to, in cursor order, with their outcome once finished. Counts
+        # only include users up to the checkpoint, so they stay right across a resume.
+        self._in_flight: "OrderedDict[int, str | None]" = OrderedDict()
+        self._handled = 0  # users handled by this run, for the rate
+        self._started = 0.0
+        self._stopping = False
+
+    @classmethod
+    async def create(cls, bot: Bot, text: str, parse_mode: str | None = None) -> "Broadcast":
+        broadcast = cls(bot, uuid.uuid4().hex[:12], text, parse_mode)
+        now = datetime.now(timezone.utc)
+        await _collection("broadcasts").insert_one({
+            "_id": broadcast.id,
+            "text": text,
+            "parse_mode": parse_mode,
+            "status": broadcast.status,
+            "created_at": now,
+            "updated_at": now,
+        })
+        return broadcast
+
+    @classmethod
+    async def load(cls, bot: Bot, broadcast_id: str) -> "Broadcast":
+        document = await _collection("broadcasts").find_one({"_id": broadcast_id})
+        if document is None:
+            raise ValueError(f"There is no broadcast with id '{broadcast_id}'.")
+        broadcast = cls(bot, document["_id"], document["text"], document.get("parse_mode"))
+        broadcast.checkpoint = document.get("checkpoint")
+        broadcast.counts.update(document.get("counts", {}))
+        return broadcast
+
+    def stop(self):
+        """Stops after the sends in flight; the broadcast can be resumed later."""
+        self._stopping = True
+
+    async def run(self) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"active": {"$ne": False}}
+        if self.checkpoint is not None:
+            query["_id"] = {"$gt": self.checkpoint}
+        self.total = sum(self.counts.values()) + await _collection("users").count_documents(query)
+        self.status = "running"
+        self._started = time.monotonic()
+        await self._save()
+        reporter = asyncio.create_task(self._report())
+        slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        sends: set[asyncio.Task] = set()
+        try:
+            cursor = _collection("users").find(query, {"_id": 1}).sort("_id", 1).batch_size(BROADCAST_BATCH_SIZE)
+            async for user in cursor:
+                if self._stopping:
+                    break
+                await slots.acquire()
+                self._in_flight[user["_id"]] = None
+                send = asyncio.create_task(self._deliver(user["_id"]))
+                sends.add(send)
+                send.add_done_callback(sends.discard)
+                send.add_done_callback(lambda _: slots.release())
+            await asyncio.gather(*sends)
+            self.status = "stopped" if self._stopping else "done"
+        except asyncio.CancelledError:
+            for send in sends:
+                send.cancel()
+            self.status = "stopped"
+            raise
+        except Exception:
+            self.status = "failed"
+            raise
+        finally:
+            reporter.cancel()
+            await self._save()
+            logger.info(f"Broadcast {self.id} {self.status}: {self.progress()}")
+        return self.progress()
+
+    async def _deliver(self, user_id: int):
+        outcome = "sent"
+        try:
+            await self.bot.send_message(user_id, self.text, parse_mode=self.parse_mode, rate_limit_args=BULK)
+        except Forbidden as e:
+            # Blocked the bot or deleted their account
+            outcome = await self._deactivate(user_id, e)
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                outcome = await self._deactivate(user_id, e)
+            else:
+                outcome = "failed"
+                logger.warning(f"Broadcast {self.id} could not send to user {user_id}: {e}")
+        except TelegramError as e:
+            outcome = "failed"
+            logger.warning(f"Broadcast {self.id} could not send to user {user_id}: {e}")
+        # Not reached when cancelled, so an interrupted send is repeated on resume
+        self._finish(user_id, outcome)
+
+    async def _deactivate(self, user_id: int, error: TelegramError) -> str:
+        try:
+            await _collection("users").update_one(
+                {"_id": user_id},
+                {"$set": {"active": False, "inactive_reason": error.message, "inactive_at": datetime.now(timezone.utc)}},
+            )
+        except Exception as e:
+            logger.error(f"Could not mark user {user_id} inactive: {e}")
+        return "blocked"
+
+    def _finish(self, user_id: int, outcome: str):
+        self._in_flight[user_id] = outcome
+        self._handled += 1
+        # Advance the checkpoint over the leading run of finished users
+        while self._in_flight and next(iter(self._in_flight.values())) is not None:
+            self.checkpoint, outcome = self._in_flight.popitem(last=False)
+            self.counts[outcome] += 1
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(BROADCAST_REPORT_INTERVAL)
+            await self._save()
+            logger.info(f"Broadcast {self.id}: {self.progress()}")
+
+    async def _save(self):
+        try:
+            await _collection("broadcasts").update_one(
+                {"_id": self.id},
+                {"$set": {
+                    "status": self.status,
+                    "checkpoint": self.checkpoint,
+                    "counts": self.counts,
+                    "updated_at": datetime.now(timezone.utc),
+                }},
+            )
+        except Exception as e:
+            logger.error(f"Could not save the checkpoint of broadcast {self.id}: {e}")
+
+    def progress(self) -> Dict[str, Any]:
+        done = sum(self.counts.values())
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        rate = self._handled / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.total - done)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "done": done,
+            **self.counts,
+            "rate_per_s": round(rate, 2),
+            "eta_s": round(remaining / rate) if rate > 0 and self.status == "running" else None,
+        }
+
+
+class Broadcaster:
+    """Runs one broadcast at a time in the background for the /broadcast command."""
+
+    def __init__(self):
+        self.current: Broadcast | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, broadcast: Broadcast, report_chat_id: int | None = None):
+        if self.running:
+            raise RuntimeError("A broadcast is already running.")
+        self.current = broadcast
+        self._task = asyncio.create_task(self._run(broadcast, report_chat_id))
+
+    async def _run(self, broadcast: Broadcast, report_chat_id: int | None):
+        try:
+            progress = await broadcast.run()
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast.id} failed: {e}", exc_info=True)
+            progress = broadcast.progress()
+        if report_chat_id is not None:
+            try:
+                await broadcast.bot.send_message(report_chat_id, f"Broadcast {broadcast.id} {progress['status']}: {progress}")
+            except Exception as e:
+                # The admin blocked the bot, or Telegram is unreachable: the progress is saved anyway
+                logger.error(f"Could not report broadcast {broadcast.id} to chat {report_chat_id}: {e}")
+
+    async def stop(self):
+        """Interrupts a running broadcast on shutdown; its checkpoint is saved for --resume."""
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any] | None:
+        return self.current.progress() if self.current else None
+
+
+broadcaster = Broadcaster()
+
+
+async def _main(args: argparse.Namespace):
+    from telegram.ext import ExtBot
+    from src.bot.send_scheduler import send_scheduler
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    check_required()
+    bot = ExtBot(
+        BOT_TOKEN,
+        base_url=f"{TELEGRAM_API_BASE_URL}/bot",
+        base_file_url=f"{TELEGRAM_API_BASE_URL}/file/bot",
+        rate_limiter=send_scheduler,
+    )
+    try:
+        async with bot:
+            if args.resume:
+                broadcast = await Broadcast.load(bot, args.resume)
+            else:
+                broadcast = await Broadcast.create(bot, args.text, args.parse_mode)
+            print(f"Broadcast {broadcast.id} started; resume with --resume {broadcast.id} if interrupted.")
+            print(await broadcast.run())
+    finally:
+        await close_db_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a message to every active user.")
+    parser.add_argument("text", nargs="?", help="the message to send")
+    parser.add_argument("--parse-mode", choices=["HTML", "MarkdownV2"], help="how Telegram formats the text")
+    parser.add_argument("--resume", metavar="ID", help="continue an interrupted broadcast")
+    args = parser.parse_args()
+    if not args.text and not args.resume:
+        parser.error("give the message text or --resume ID")
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print("Interrupted; the checkpoint has been saved.")
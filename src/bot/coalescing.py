@@ -0,0 +1,138 @@
+"""
+Per-chat coalescing of text messages.
+
+A user who sends several messages in quick succession gets one answer to all of them
+instead of a placeholder, a history fetch and an LLM call per message. The first message
+opens a request that waits COALESCE_WINDOW seconds before it is answered, and messages
+arriving in that window join it. A message arriving while the answer is being generated
+either cancels that call, HTTP request included, and is answered together with the
+cancelled messages in the same placeholder (COALESCE_CANCEL), or is answered after it.
+A cancel can land while the placeholder or a continuation message is being sent, so
+those sends are shielded and recorded on the request: the next request takes over the
+placeholder and deletes the continuations before it answers.
+
+Requests run as application tasks, so the handler returns straight away and the update
+worker of the chat can pick up the next message while the previous one is pending. At
+most UPDATE_WORKERS answers run at once, as many as the update workers would run, and a
+request waiting for its turn still takes in new messages.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Hashable, List
+
+from telegram import Message
+
+from src.config import COALESCE_WINDOW, COALESCE_CANCEL, UPDATE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+WAITING = "waiting"      # collecting messages; nothing sent upstream yet
+RUNNING = "running"      # the model is answering; may be cancelled
+FINISHING = "finishing"  # the reply is complete and being stored; never cancelled
+
+
+class CoalescedRequest:
+    """One LLM request for one or more consecutive messages of a chat."""
+
+    def __init__(self, messages: List[Message]):
+        self.messages = messages
+        self.state = WAITING
+        self.task: asyncio.Task | None = None
+        self._placeholder: asyncio.Future | None = None
+        # Sends of the messages a long answer continued in, and those of a cancelled
+        # answer this one replaces
+        self.continuations: List[asyncio.Future] = []
+        self.stale: List[asyncio.Future] = []
+
+    @property
+    def message(self) -> Message:
+        """The latest message, which the reply answers."""
+        return self.messages[-1]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(message.text for message in self.messages if message.text)
+
+    async def placeholder(self, text: str) -> Message:
+        """Replies with `text` to be edited into the answer, or returns the reply already sent."""
+        if self._placeholder is None:
+            self._placeholder = asyncio.ensure_future(self.message.reply_text(text))
+        # Shielded: a cancel mid-send leaves the reply to the request that cancelled this one
+        return await asyncio.shield(self._placeholder)
+
+    def finishing(self):
+        """Called by the answer once the reply is complete, before it is stored."""
+        self.state = FINISHING
+
+
+Answer = Callable[[CoalescedRequest], Awaitable[Any]]
+Spawn = Callable[[Coroutine], asyncio.Task]
+
+
+class ChatCoalescer:
+    def __init__(self):
+        # The newest request per chat
+        self._requests: Dict[Hashable, CoalescedRequest] = {}
+        self._slots = asyncio.Semaphore(UPDATE_WORKERS)
+        self.stats = {"messages": 0, "merged": 0, "cancelled": 0, "answered": 0, "failed": 0}
+
+    def submit(self, key: Hashable, message: Message, answer: Answer, spawn: Spawn = asyncio.create_task):
+        """Adds a message to the chat's waiting request, or opens a request answered by `answer`."""
+        self.stats["messages"] += 1
+        current = self._requests.get(key)
+        if current is not None and current.state == WAITING:
+            current.messages.append(message)
+            self.stats["merged"] += 1
+            return
+        request = CoalescedRequest([message])
+        if current is not None and current.state == RUNNING and COALESCE_CANCEL:
+            # The running answer is outdated: drop it and answer everything at once
+            current.task.cancel()
+            request.messages[:0] = current.messages
+            request._placeholder = current._placeholder
+            request.stale = current.continuations
+            self.stats["cancelled"] += 1
+            self.stats["merged"] += 1
+        previous = current.task if current is not None else None
+        self._requests[key] = request
+        request.task = spawn(self._run(key, request, previous, answer))
+
+    async def _run(self, key: Hashable, request: CoalescedRequest, previous: asyncio.Task | None, answer: Answer):
+        try:
+            if previous is not None:
+                # Replies go out in order: wait for the one before (or for it to unwind)
+                await asyncio.wait([previous])
+            await self._discard(request.stale)
+            await asyncio.sleep(COALESCE_WINDOW)
+            async with self._slots:
+                request.state = RUNNING
+                await answer(request)
+            self.stats["answered"] += 1
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            if self._requests.get(key) is request:
+                del self._requests[key]
+
+    async def _discard(self, sends: List[asyncio.Future]):
+        """Deletes the continuation messages of a cancelled answer."""
+        for send in sends:
+            try:
+                message = await send
+                await message.delete()
+            except Exception as e:
+                logger.warning(f"Could not delete a message of a cancelled answer: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        pending = list(self._requests.values())
+        return {
+            **self.stats,
+            "window_s": COALESCE_WINDOW,
+            "cancel": COALESCE_CANCEL,
+            "waiting": sum(request.state == WAITING for request in pending),
+            "running": sum(request.state != WAITING for request in pending),
+        }
+
+
+chat_coalescer = ChatCoalescer()
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+
+from src.config import (
+    CONTEXT_TOKEN_BUDGET,
+    MODEL_CONTEXT_BUDGETS,
+    CONTEXT_MAX_TURNS,
+    CONTEXT_KEEP_TURNS,
+    CONTEXT_SUMMARY_MIN_TURNS,
+    OPENROUTER_API_ENDPOINT,
+    RATE_LIMIT_COSTS,
+    SYSTEM_MESSAGE,
+    headers,
+)
+from src.database.chat_history_db import (
+    get_user_history,
+    get_user_summary,
+    get_turns_to_summarize,
+    load_user_summary,
+    save_user_summary,
+)
+from src.bot.rate_limit import admission
+from src.bot.utils import try_models
+
+logger = logging.getLogger(__name__)
+
+# Per-message overhead (role, separators) in the chat template
+MESSAGE_TOKENS = 4
+# Rough cost of an image part in a multimodal message
+IMAGE_TOKENS = 1000
+# Don't try to summarise the same user again within this many seconds
+SUMMARY_COOLDOWN = 60
+# Turns rolled into the summary per LLM call
+SUMMARY_BATCH_TURNS = 50
+
+SUMMARY_INSTRUCTION = (
+    "Summarise the conversation below between a user and a Telegram assistant in a few sentences. "
+    "Keep facts about the user, decisions made and questions that are still open. "
+    "Reply with the summary only."
+)
+
+
+
+class SummaryError(Exception):
+    """Raised when older turns could not be rolled into the user's summary."""
+
+
+_summary_tasks: Dict[int, asyncio.Task] = {}
+_last_summary: Dict[int, float] = {}
+
+
+def estimate_tokens(content: Any) -> int:
+    """
+    Cheap token estimate: about four UTF-8 bytes per token, which also gives
+    multi-byte scripts such as Burmese a higher count per character.
+    """
+    if isinstance(content, str):
+        return len(content.encode("utf-8")) // 4 + MESSAGE_TOKENS
+    tokens = MESSAGE_TOKENS
+    for part in content or []:
+        if part.get("type") == "text":
+            tokens += len(part.get("text", "").encode("utf-8")) // 4
+        else:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def budget_for(models: List[str]) -> int:
+    """Returns the prompt budget that fits every candidate model."""
+    if not models:
+        return CONTEXT_TOKEN_BUDGET
+    return min(MODEL_CONTEXT_BUDGETS.get(model, CONTEXT_TOKEN_BUDGET) for model in models)
+
+
+async def build_context(user_id: int, text: str, models: List[str]) -> List[Dict[str, Any]]:
+    """
+    Builds the messages for a chat completion: the system prompt, the stored summary
+    of older turns, as many of the turns after it as fit in the token budget, and the
+    new message.
+    """
+    history = await get_user_history(user_id, CONTEXT_MAX_TURNS)
+    summary = await get_user_summary(user_id)
+
+    messages = [SYSTEM_MESSAGE]
+    budget = budget_for(models) - estimate_tokens(SYSTEM_MESSAGE["content"]) - estimate_tokens(text)
+    if summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary['summary']}"}
+        messages.append(summary_message)
+        budget -= estimate_tokens(summary_message["content"])
+        # Turns up to covered_until are in the summary; every later one belongs in the prompt
+        history = [turn for turn in history if turn["timestamp"] > summary["covered_until"]]
+
+    # Pack the newest turns first, then restore chronological order
+    packed: List[Dict[str, Any]] = []
+    for turn in reversed(history):
+        cost = estimate_tokens(turn["content"])
+        if cost > budget:
+            break
+        budget -= cost
+        packed.append({"role": turn["role"], "content": turn["content"]})
+    packed.reverse()
+
+    if len(history) - len(packed) >= CONTEXT_SUMMARY_MIN_TURNS or len(history) >= CONTEXT_MAX_TURNS:
+        schedule_summary(user_id, models)
+
+    messages.extend(packed)
+    messages.append({"role": "user", "content": text})
+    return messages
+
+
+def schedule_summary(user_id: int, models: List[str]):
+    """Starts a background summary of the user's older turns unless one ran recently."""
+    now = time.monotonic()
+    if user_id in _summary_tasks or now - _last_summary.get(user_id, 0.0) < SUMMARY_COOLDOWN:
+        return
+    if len(_last_summary) > 10000:
+        _last_summary.clear()
+    _last_summary[user_id] = now
+    task = asyncio.create_task(_summarise_in_background(user_id, models))
+    _summary_tasks[user_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(user_id, None))
+
+
+async def stop_summaries():
+    """Cancels background summaries on shutdown, before the clients they use are closed."""
+    tasks = list(_summary_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _summarise_in_background(user_id: int, models: List[str]):
+    try:
+        await summarise_older_turns(user_id, models)
+    except Exception as e:
+        # The turns stay in place and are summarised on a later attempt
+        logger.error(f"Failed to summarise history for user {user_id}: {e}", exc_info=True)
+
+
+async def _summarise(turns: List[Dict[str, Any]], summary: Dict[str, Any] | None, models: List[str]) -> str | None:
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    if summary:
+        transcript = f"Earlier summary: {summary['summary']}\n\n{transcript}"
+    payload = {
+        "messages": [
+            {"role": "system", "content": SUMMARY_INSTRUCTION},
+            {"role": "user", "content": transcript},
+        ]
+    }
+    return await try_models(
+        models=models,
+        payload_base=payload,
+        headers=headers,
+        endpoint=OPENROUTER_API_ENDPOINT,
+    )
+
+
+async def summarise_older_turns(user_id: int, models: List[str], keep: int = CONTEXT_KEEP_TURNS) -> Dict[str, Any] | None:
+    """
+    Rolls the user's turns before the latest `keep` into their stored summary, oldest
+    first and SUMMARY_BATCH_TURNS at a time, until they are all covered. Each LLM call is
+    charged to the admission limiter and the rest is deferred when it is spent.
+
+    Returns the summary document as it stands afterwards (None if there is none yet).
+    Turns up to its covered_until are in the summary. Raises SummaryError if no model
+    produced a summary or it could not be stored.
+    """
+    summary = await load_user_summary(user_id)
+    while True:
+        covered_until = summary["covered_until"] if summary else None
+        turns = await get_turns_to_summarize(user_id, covered_until, keep, SUMMARY_BATCH_TURNS)
+        if len(turns) < CONTEXT_SUMMARY_MIN_TURNS:
+            return summary
+        if not await admission.admit_job(user_id, "openrouter", RATE_LIMIT_COSTS.get("summary", 1)):
+            logger.info(f"Deferring the history summary of user {user_id}: over its rate limit")
+            return summary
+        result = await _summarise(turns, summary, models)
+        if not result:
+            raise SummaryError(f"No model summarised {len(turns)} turns of user {user_id}")
+        saved = await save_user_summary(user_id, result, turns[-1]["timestamp"])
+        if saved is None:
+            raise SummaryError(f"Could not store the summary of user {user_id}")
+        summary = saved
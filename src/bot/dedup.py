@@ -0,0 +1,85 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from pymongo.errors import DuplicateKeyError
+
+from src.config import DEDUP_ENABLED, DEDUP_BACKEND, DEDUP_WINDOW, DEDUP_MAX_ENTRIES
+from src.database.db import get_db_client
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Drops webhook updates whose update_id was already seen within DEDUP_WINDOW seconds.
+
+    The in-memory set is insertion ordered, so expired ids are trimmed from the front
+    and it never holds more than DEDUP_MAX_ENTRIES ids. With DEDUP_BACKEND=mongo each
+    id is also claimed in a collection with a TTL index, so replicas share one view.
+    """
+
+    def __init__(self):
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+        self.stats = {"checked": 0, "duplicates": 0, "backend_errors": 0}
+
+    def _collection(self):
+        return get_db_client().get_database("telegram_bot_db").get_collection("processed_updates")
+
+    async def start(self):
+        if DEDUP_ENABLED and DEDUP_BACKEND == "mongo":
+            try:
+                await self._collection().create_index("seen_at", expireAfterSeconds=int(DEDUP_WINDOW))
+            except Exception as e:
+                logger.error(f"Could not create TTL index for update deduplication: {e}", exc_info=True)
+
+    def _trim(self, now: float):
+        cutoff = now - DEDUP_WINDOW
+        while self._seen:
+            update_id, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff and len(self._seen) < DEDUP_MAX_ENTRIES:
+                break
+            del self._seen[update_id]
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        """Records the update_id and returns True if it was seen before."""
+        if not DEDUP_ENABLED:
+            return False
+        self.stats["checked"] += 1
+        now = time.monotonic()
+        self._trim(now)
+        if update_id in self._seen:
+            self.stats["duplicates"] += 1
+            return True
+        self._seen[update_id] = now
+
+        if DEDUP_BACKEND == "mongo":
+            try:
+                await self._collection().insert_one({"_id": update_id, "seen_at": datetime.now(timezone.utc)})
+            except DuplicateKeyError:
+                # Another replica already took this update
+                self.stats["duplicates"] += 1
+                return True
+            except Exception as e:
+                # Fall back to the local view rather than dropping the update
+                self.stats["backend_errors"] += 1
+                logger.error(f"Deduplication backend error for update {update_id}: {e}")
+        return False
+
+    async def forget(self, update_id: int):
+        """Un-records an update that was not processed, so a redelivery is accepted."""
+        self._seen.pop(update_id, None)
+        if DEDUP_ENABLED and DEDUP_BACKEND == "mongo":
+            try:
+                await self._collection().delete_one({"_id": update_id})
+            except Exception as e:
+                self.stats["backend_errors"] += 1
+                logger.error(f"Deduplication backend error for update {update_id}: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "backend": DEDUP_BACKEND, "tracked": len(self._seen)}
+
+
+deduplicator = UpdateDeduplicator()
@@ -1,13 +1,25 @@
 import httpx
 import logging
-import io
 import asyncio
-from telegram import Update
+from contextlib import aclosing
+from telegram import InputFile, Update
+from telegram.error import RetryAfter
 from telegram.ext import ContextTypes
-from src.config import OPENROUTER_API_ENDPOINT, headers, LLM_MODELS, RBG_API_KEY, SYSTEM_MESSAGE
+from src.config import OPENROUTER_API_ENDPOINT, headers, LLM_MODELS, RBG_API_KEY, LLM_STREAMING, IMAGE_ENCODE_CHUNK, VISION_MODELS, ADMIN_USER_IDS, COALESCE_ENABLED
 from src.database.user_db import update_or_create_user
-from src.database.chat_history_db import get_user_history, add_message_to_history
-from src.bot.utils import encode_bytes_to_base64, try_models
+from src.database.chat_history_db import add_message_to_history, add_messages_to_history
+from src.bot.utils import try_models
+from src.bot.http_client import get_http_client
+from src.bot.streaming import StreamingReply, stream_models
+from src.bot.context_builder import build_context
+from src.bot.response_cache import response_cache, cache_key
+from src.bot.image_cache import image_cache, content_hash
+from src.bot.job_pool import image_jobs, in_pool
+from src.bot.state_store import BotContext
+from src.bot.metrics import span, timed_handler
+from src.bot.broadcast import Broadcast, broadcaster
+from src.bot.coalescing import CoalescedRequest, chat_coalescer
+from src.bot.image_pipeline import IMAGE_URL, BufferEstimate, download_photo, pick_photo, stream_json_with_image
 
 # Set up basic logging
 logging.basicConfig(
@@ -15,11 +27,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if update.message and user:
-        # Run the synchronous database call in a separate thread
-        await asyncio.to_thread(update_or_create_user, user)
+        await update_or_create_user(user)
 
         first_name = user.first_name
         await update.message.reply_text(
@@ -27,10 +39,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "\n\nYou can type /help to see what I can do!"
             )
 
+@timed_handler
 async def check_alive(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         await update.message.reply_text("Yes, I'm alive and ready to assist you! 🤖")    
 
+@timed_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         help_text = (
@@ -44,6 +58,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await update.message.reply_text(help_text)
 
+@timed_handler
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # The MessageHandler with filters.TEXT ensures message and message.text exist.
     user = update.effective_user
@@ -51,139 +66,267 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not user or not message or not message.text:
         return # Should not happen with correct filters, but good for safety
 
-    # Send a placeholder message that we can edit later
-    thinking_message = await message.reply_text("Thinking...")
+    if not COALESCE_ENABLED:
+        await answer_text(CoalescedRequest([message]))
+        return
+
+    # Quick follow-ups from the same user in the same chat are answered together
+    chat_coalescer.submit(
+        (message.chat_id, user.id),
+        message,
+        answer_text,
+        spawn=lambda coroutine: context.application.create_task(coroutine, update=update),
+    )
 
-    # 1. Fetch recent history from the database
-    user_history = await asyncio.to_thread(get_user_history, user.id)
+@timed_handler
+async def answer_text(request: CoalescedRequest):
+    message = request.message
+    user_id = message.from_user.id
+    text = request.text
 
-    # 2. Add system message and current user message
-    # Prepending the system message ensures the LLM follows instructions
-    user_history.insert(0, SYSTEM_MESSAGE)
-    user_history.append({"role": "user", "content": message.text})
+    # Send a placeholder message that we can edit later, unless a cancelled request left one
+    thinking_message = await request.placeholder("Thinking...")
 
-    # 3. Save the user's new message to the database in the background ("fire-and-forget").
-    # This allows us to call the LLM immediately without waiting for the database write.
-    asyncio.create_task(asyncio.to_thread(add_message_to_history, user.id, "user", message.text))
+    # 1. Build the prompt: system message, summary of older turns, as much recent
+    # history as fits in the token budget, and the current user message
+    user_history = await build_context(user_id, text, LLM_MODELS)
 
     payload = {"messages": user_history}
 
-    # Call the decoupled try_models function
-    result = await try_models(
-        models=LLM_MODELS,
-        payload_base=payload,
-        headers=headers,
-        endpoint=OPENROUTER_API_ENDPOINT,
-    )
+    async def generate() -> str | None:
+        if LLM_STREAMING:
+            # Show tokens as they arrive instead of waiting for the whole completion
+            reply = StreamingReply(thinking_message, request.continuations)
+            # Closed here, not by the garbage collector, when the answer is cancelled mid-stream
+            async with aclosing(stream_models(LLM_MODELS, payload, headers, OPENROUTER_API_ENDPOINT)) as deltas:
+                async for delta in deltas:
+                    await reply.append(delta)
+            return await reply.finish()
+        # Call the decoupled try_models function
+        result = await try_models(
+            models=LLM_MODELS,
+            payload_base=payload,
+            headers=headers,
+            endpoint=OPENROUTER_API_ENDPOINT,
+        )
+        if result:
+            with span("telegram_edit"):
+                await thinking_message.edit_text(result)
+        return result
+
+    # A prompt without earlier context (system message + this message) can be answered
+    # from the cache, and identical prompts asked at the same time share one LLM call
+    if len(user_history) == 2:
+        generated = False
+
+        async def compute() -> str | None:
+            nonlocal generated
+            generated = True
+            return await generate()
+
+        result = await response_cache.get_or_compute(cache_key(text, LLM_MODELS), compute)
+        if result and not generated:
+            # A cached answer, or one generated for another chat: send it whole
+            reply = StreamingReply(thinking_message, request.continuations)
+            await reply.append(result)
+            result = await reply.finish()
+    else:
+        result = await generate()
+
+    # From here on a newer message waits for this reply instead of cancelling it
+    request.finishing()
 
     if result:
-        # The assistant's response is no longer saved to the database.
-        await thinking_message.edit_text(result)
+        # 2. Save the user turn and the assistant's reply together in one batched write
+        await add_messages_to_history(user_id, [("user", text), ("assistant", result)])
     else:
-        # If all models failed, inform the user by editing the placeholder message.
+        # If all models failed, keep the user turn and inform the user by editing the placeholder message.
+        await add_message_to_history(user_id, "user", text)
         await thinking_message.edit_text(
             "I'm having trouble connecting to my brain right now. Please try again later."
         )
 
-async def identify_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_history = context.user_data.setdefault("history", []) if context.user_data is not None else []
-    if not update.message or not update.message.photo:
+@in_pool(image_jobs, "I'm busy with other images right now. Please send yours again in a minute.")
+@timed_handler
+async def identify_image(update: Update, context: BotContext):
+    user = update.effective_user
+    if not update.message or not update.message.photo or not user:
         if update.message:
             await update.message.reply_text("No photo found in the message.")
         return
 
+    photo = pick_photo(update.message.photo, "vision")
+    # A photo we have already described is answered without downloading it again
+    caption = image_cache.get_caption(image_cache.hash_for(photo.file_unique_id))
+    if caption:
+        await update.message.reply_text(caption)
+        return
+
     await update.message.reply_text("Identifying your image, please wait...")
 
-    # 1. Download image directly into memory to avoid disk I/O
-    photo_file = await update.message.photo[-1].get_file()
-    image_bytes = await photo_file.download_as_bytearray()
-
-    # 2. Encode the in-memory image using the utility function
-    base64_image = encode_bytes_to_base64(image_bytes)
-    data_url = f"data:image/jpeg;base64,{base64_image}"
-
-    user_history.append(
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "What's in this image? Describe only in brief."
-                },
-                {
-                    "type": "image_url", "image_url": {"url": data_url}
-                }
+    memory = BufferEstimate("vision")
+    try:
+        # 1. Download image directly into memory to avoid disk I/O
+        image = await download_photo(photo)
+        memory.hold(len(image))
+
+        # The same picture may arrive as a different Telegram file, so also check by content
+        # hashlib releases the GIL on large buffers, so hashing in a thread keeps the loop responsive
+        image_key = await asyncio.to_thread(content_hash, image)
+        image_cache.remember_hash(photo.file_unique_id, image_key)
+        caption = image_cache.get_caption(image_key)
+        if caption:
+            await update.message.reply_text(caption)
+            return
+
+        # 2. The image part is streamed into the request body; only the question is kept in history
+        question = "What's in this image? Describe only in brief."
+        user_history = await context.state.get(user.id)
+        await context.state.append(user.id, "user", question)
+
+        payload = {
+            "messages": user_history + [
+                {"role": "user", "content": [
+                    {"type": "text", "text": question},
+                    {"type": "image_url", "image_url": {"url": IMAGE_URL}},
+                ]}
             ]
         }
-    )
 
-    payload = {
-        # 3. Use a vision-capable model.
-        # You could enhance this to filter your MODEL_LIST for vision models.
-        "model": "mistralai/mistral-small-3.2-24b-instruct:free",
-        "messages": user_history
-    }
+        memory.hold(IMAGE_ENCODE_CHUNK * 4 // 3)
+        # 3. Use the declared vision-capable models. Sequential, so an image is only uploaded
+        # again when the previous model has failed
+        result = await try_models(
+            VISION_MODELS,
+            payload,
+            headers,
+            OPENROUTER_API_ENDPOINT,
+            strategy="sequential",
+            body=lambda model_payload: stream_json_with_image(model_payload, image),
+        )
+        if not result:
+            await context.state.pop(user.id)  # Drop the unanswered question
+            await update.message.reply_text("Sorry, I'm having trouble understanding images right now. Please try again later.")
+            return
+        image_cache.set_caption(image_key, result)
 
-    try:
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.post(OPENROUTER_API_ENDPOINT, headers=headers, json=payload, timeout=60)
-            # 4. Add proper error handling for bad API responses
-            response.raise_for_status()
-            
-            response_data = response.json()
-            result = response_data["choices"][0]["message"]["content"]
-
-        user_history.append({
-            "role": "assistant",
-            "content": [{"type": "text", "text": result}]
-        })
+        await context.state.append(user.id, "assistant", result)
         await update.message.reply_text(result)
-    except httpx.HTTPStatusError as e:
-        logger.error(f"API Error during image identification: {e.response.status_code} - {e.response.text}")
-        await update.message.reply_text("Sorry, I'm having trouble understanding images right now. Please try again later.")
     except Exception as e:
         logger.error(f"Unexpected error during image identification: {e}", exc_info=True)
         await update.message.reply_text("An unexpected error occurred while processing your image. Please try again.")
+    finally:
+        memory.finish()
+
+async def _from_admin(update: Update) -> bool:
+    """True for a message from an admin; anyone else is told the command does not exist."""
+    user = update.effective_user
+    if not update.message or not update.message.text:
+        return False
+    if not user or user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("This command is not supported yet :( ")
+        return False
+    return True
+
+async def _start_broadcast(update: Update, broadcast: Broadcast):
+    # The broadcast runs in the background; a summary is sent here when it finishes
+    broadcaster.start(broadcast, report_chat_id=update.message.chat_id)
+    await update.message.reply_text(f"Broadcast {broadcast.id} started. Check it with /broadcast_status")
+
+# The other actions are separate commands, so a message may start with any word
+@timed_handler
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _from_admin(update):
+        return
+    if not context.args:
+        await update.message.reply_text(
+            "Usage: /broadcast <message>. Also /broadcast_status, /broadcast_stop and /broadcast_resume <id>"
+        )
+        return
+    if broadcaster.running:
+        await update.message.reply_text(f"Broadcast {broadcaster.current.id} is still running. Check it with /broadcast_status")
+        return
 
+    # Everything after the command, with the admin's formatting kept as HTML
+    text = update.message.text_html.split(maxsplit=1)[1]
+    await _start_broadcast(update, await Broadcast.create(context.bot, text, "HTML"))
+
+@timed_handler
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _from_admin(update):
+        return
+    progress = broadcaster.snapshot()
+    await update.message.reply_text(str(progress) if progress else "No broadcast has run since the last restart.")
+
+@timed_handler
+async def broadcast_stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _from_admin(update):
+        return
+    if broadcaster.running:
+        broadcaster.current.stop()
+        await update.message.reply_text(f"Stopping broadcast {broadcaster.current.id}. Resume it with /broadcast_resume {broadcaster.current.id}")
+    else:
+        await update.message.reply_text("No broadcast is running.")
+
+@timed_handler
+async def broadcast_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await _from_admin(update):
+        return
+    if len(context.args or []) != 1:
+        await update.message.reply_text("Usage: /broadcast_resume <id>")
+        return
+    if broadcaster.running:
+        await update.message.reply_text(f"Broadcast {broadcaster.current.id} is still running. Check it with /broadcast_status")
+        return
+    try:
+        broadcast = await Broadcast.load(context.bot, context.args[0])
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    await _start_broadcast(update, broadcast)
+
+@timed_handler
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         await update.message.reply_text("This command is not supported yet :( ")
 
-async def search_web(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_history = context.user_data.setdefault("history", []) if context.user_data is not None else []
-    if not update.message or not context.args:
+@timed_handler
+async def search_web(update: Update, context: BotContext):
+    user = update.effective_user
+    if not update.message or not context.args or not user:
         if update.message:
             await update.message.reply_text("Please provide a search query after /search. For example: /search What is the capital of France?")
         return
 
     await update.message.reply_text("Searching the web, please wait...")
-    print(context.args)
     search_query = " ".join(context.args)
 
-    user_history.append({
-        "role": "user",
-        "content": [{"type": "text", "text": search_query}]
-    })
+    await context.state.append(user.id, "user", search_query)
 
+    # Search answers don't depend on the conversation, so the query alone is sent.
+    # That lets identical queries from different users share one cached answer.
     payload = {
         "plugins": [{ "id": "web" }],
-        "messages": user_history
+        "messages": [{"role": "user", "content": [{"type": "text", "text": search_query}]}]
     }
-    result = await try_models(
-        models=LLM_MODELS,
-        headers=headers,
-        payload_base=payload,
-        endpoint=OPENROUTER_API_ENDPOINT
-    )
+
+    async def search():
+        return await try_models(
+            models=LLM_MODELS,
+            headers=headers,
+            payload_base=payload,
+            endpoint=OPENROUTER_API_ENDPOINT
+        )
+
+    result = await response_cache.get_or_compute(cache_key(search_query, LLM_MODELS, ["web"]), search)
     if result:
-        user_history.append({
-            "role": "assistant",
-            "content": [{"type": "text", "text": result}]
-        })
+        await context.state.append(user.id, "assistant", result)
         await update.message.reply_text(result)
     else:
         await update.message.reply_text("No results found.")
 
+@in_pool(image_jobs, "I'm busy with other images right now. Please try again in a minute.")
+@timed_handler
 async def remove_background(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.effective_message
     if not message:
@@ -202,37 +345,70 @@ async def remove_background(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await message.reply_text("Please send this command as a caption to a photo, or reply to a photo with this command.")
         return
 
-    await message.reply_text("Removing background, please wait...")
-    photo_file = await photo_message.photo[-1].get_file()
-    image_bytes = await photo_file.download_as_bytearray()
-    image_stream = io.BytesIO(image_bytes)
+    photo = pick_photo(photo_message.photo, "removebg")
+    # The same Telegram file was processed before: resend our earlier result by file_id,
+    # skipping both the download and the remove.bg upload
+    cached_file_id = image_cache.get_file_id("removebg", image_cache.hash_for(photo.file_unique_id))
+    if cached_file_id:
+        await message.reply_photo(photo=cached_file_id)
+        return
 
+    await message.reply_text("Removing background, please wait...")
+    memory = BufferEstimate("removebg")
     try:
-        async with httpx.AsyncClient(timeout=60) as client:
+        image = await download_photo(photo)
+        memory.hold(len(image))
+        image_key = await asyncio.to_thread(content_hash, image)
+        image_cache.remember_hash(photo.file_unique_id, image_key)
+
+        cached_file_id = image_cache.get_file_id("removebg", image_key)
+        if cached_file_id:
+            await message.reply_photo(photo=cached_file_id)
+            return
+
+        sent = None
+        with image_cache.open_png(image_key) as png:
+            if png is not None:
+                # Processed before but never sent from this process: upload the PNG from the disk cache
+                sent = await message.reply_photo(photo=InputFile(png, filename="no-bg.png"))
+        if sent is None:
+            # The downloaded bytes object is handed to the multipart encoder as is, without a copy
+            client = get_http_client("removebg")
+            with span("removebg_upload"):
                 response = await client.post(
-                        "https://api.remove.bg/v1.0/removebg",
+                        "/v1.0/removebg",
                         headers={"X-Api-Key": RBG_API_KEY},
-                        files={"image_file": ("image.jpg", image_stream, "image/jpeg")},
-                        data={"size": "auto"}
+                        files={"image_file": ("image.jpg", image.obj, "image/jpeg")},
+                        data={"size": "auto"},
+                        timeout=60
                     )
-                response.raise_for_status() # Raise an exception for bad status codes
-                
-                # Send the image directly from memory without saving to a file
-                processed_image_stream = io.BytesIO(response.content)
-                await message.reply_photo(photo=processed_image_stream)
+            response.raise_for_status() # Raise an exception for bad status codes
+            memory.hold(len(response.content))
+            await image_cache.store_png(image_key, response.content)
+
+            # Send the image directly from memory without saving to a file
+            sent = await message.reply_photo(photo=response.content)
+
+        if sent.photo:
+            image_cache.set_file_id("removebg", image_key, sent.photo[-1].file_id)
     except httpx.HTTPStatusError as e:
         logger.error(f"Background removal API Error: {e.response.status_code} - {e.response.text}")
         await message.reply_text("Sorry, I couldn't remove the background from the image. Please try again later.")
     except Exception as e:
         logger.error(f"Unexpected error during background removal: {e}", exc_info=True)
         await message.reply_text("An unexpected error occurred while removing the background. Please try again.")
+    finally:
+        memory.finish()
 
 async def debug_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug("Debug handler triggered: %s", update)
 
 async def error_handler(update, context):
     logger.error("Exception while handling an update:", exc_info=context.error)
-    
+
+    # The send scheduler already retried; another message would only hit the flood limit again
+    if isinstance(context.error, RetryAfter):
+        return
     if update and update.effective_message:
         first_name = update.effective_user.first_name if update.effective_user else "there"
         await update.effective_message.reply_text(f"Hi {first_name}, it looks like something went wrong on our side. Please try again later!")
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+Background compaction of chat history.
+
+Every HISTORY_COMPACTION_INTERVAL seconds, users who wrote since the last pass and have
+more than HISTORY_MAX_TURNS stored turns get their older turns rolled into their summary
+(the same summary context_builder puts in the prompt). Then every turn the summary covers
+is deleted, except the newest HISTORY_MAX_TURNS. A turn is never deleted before it is in
+the summary: turns stay while summarising is deferred by the rate limiter, and a user
+whose summary fails is tried again on the next pass. Existing collections can be
+compacted once with
+
+    python -m src.bot.history_compaction
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+
+from src.bot.context_builder import summarise_older_turns
+from src.config import HISTORY_MAX_TURNS, HISTORY_COMPACTION_INTERVAL, LLM_MODELS, check_required
+from src.database.history_store import history_store
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryCompactor:
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self.stats = {"passes": 0, "users_compacted": 0, "turns_deleted": 0, "errors": 0}
+
+    def start(self):
+        if HISTORY_MAX_TURNS and HISTORY_COMPACTION_INTERVAL > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(HISTORY_COMPACTION_INTERVAL)
+            for user_id in history_store.take_written():
+                await self.compact_user(user_id)
+            self.stats["passes"] += 1
+
+    async def compact_user(self, user_id: int):
+        try:
+            if await history_store.count(user_id) <= HISTORY_MAX_TURNS:
+                return
+            # Summarise first, so the turns about to be deleted still inform the prompt
+            summary = await summarise_older_turns(user_id, LLM_MODELS)
+            deleted = 0
+            if summary is not None:
+                deleted = await history_store.prune(user_id, HISTORY_MAX_TURNS, summary["covered_until"])
+        except Exception as e:
+            self.stats["errors"] += 1
+            history_store.mark_written(user_id)
+            logger.error(f"Could not compact chat history for user {user_id}: {e}", exc_info=True)
+            return
+        if deleted:
+            self.stats["users_compacted"] += 1
+            self.stats["turns_deleted"] += deleted
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "running": self._task is not None, "pending_users": history_store.pending_compaction}
+
+
+history_compactor = HistoryCompactor()
+
+
+async def _compact_all():
+    from src.bot.http_client import http_clients
+    from src.database.db import close_db_client
+
+    check_required()
+    await http_clients.start()
+    try:
+        async for user_id in history_store.users_over(HISTORY_MAX_TURNS):
+            await history_compactor.compact_user(user_id)
+        print(history_compactor.snapshot())
+    finally:
+        await http_clients.aclose()
+        await close_db_client()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+    asyncio.run(_compact_all())
@@ -0,0 +1,183 @@
+import time
+import logging
+from typing import Any, Dict
+
+import httpx
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+# Upstream hosts the bot talks to. Each gets its own pooled client so that a burst
+# of remove.bg uploads can never exhaust the connections reserved for chat traffic.
+UPSTREAMS = {
+    "openrouter": "https://openrouter.ai",
+    "removebg": "https://api.remove.bg",
+}
+# Settings that point an upstream at another host (a proxy or a local stand-in)
+UPSTREAM_OVERRIDES = {
+    "removebg": "RBG_API_BASE",
+}
+
+
+def pool_limits(name: str) -> httpx.Limits:
+    """Connection limits for an upstream: the HTTP_MAX_* defaults or its own overrides."""
+    max_connections = config.HTTP_UPSTREAM_MAX_CONNECTIONS.get(name, config.HTTP_MAX_CONNECTIONS)
+    max_keepalive = config.HTTP_UPSTREAM_MAX_KEEPALIVE_CONNECTIONS.get(name, config.HTTP_MAX_KEEPALIVE_CONNECTIONS)
+    return httpx.Limits(
+        max_connections=max_connections,
+        # Idle connections kept beyond the pool size would never be used
+        max_keepalive_connections=min(max_keepalive, max_connections),
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+class PoolStats:
+    """Counters collected by MeteredTransport for a single upstream."""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        reused = self.requests - self.new_connections
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "in_flight": self.in_flight,
+            "reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+            "queue_wait_avg_ms": round(self.queue_wait_total / self.requests * 1000, 2) if self.requests else 0.0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 2),
+        }
+
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    """
+    An AsyncHTTPTransport that records pool-level metrics.
+
+    httpcore emits trace events while a request moves through the pool. The first
+    event we see is either a TCP connect (a new connection) or the request headers
+    being sent on an existing one, so the time until then is the pool queue wait.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.stats
+        started = time.perf_counter()
+        acquired = False
+
+        async def trace(event: str, info: Dict[str, Any]):
+            nonlocal acquired
+            if acquired:
+                return
+            if event == "connection.connect_tcp.started":
+                stats.new_connections += 1
+            elif not event.endswith("send_request_headers.started"):
+                return
+            acquired = True
+            wait = time.perf_counter() - started
+            stats.queue_wait_total += wait
+            stats.queue_wait_max = max(stats.queue_wait_max, wait)
+
+        request.extensions["trace"] = trace
+        stats.requests += 1
+        stats.in_flight += 1
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            stats.in_flight -= 1
+
+    def connection_counts(self) -> Dict[str, int]:
+        """
+        Open and busy connections in the pool.
+
+        httpx has no public view of its pool, so this reads httpx's private _pool and
+        httpcore's AsyncConnectionPool.connections (httpx 0.28, httpcore 1.0). If a
+        later release moves either, only the in-flight request count we track
+        ourselves is reported rather than failing the whole stats endpoint.
+        """
+        try:
+            connections = list(self._pool.connections)
+            idle = sum(1 for connection in connections if connection.is_idle())
+        except AttributeError:
+            return {"connections_in_use": self.stats.in_flight}
+        return {"connections": len(connections), "connections_in_use": len(connections) - idle}
+
+
+class HTTPClientRegistry:
+    """
+    Application-scoped registry of pooled httpx clients, one per upstream host.
+
+    Clients are created in the FastAPI lifespan and closed on shutdown. If a client
+    is requested before startup (e.g. from a script) it is created on demand.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, MeteredTransport] = {}
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        limits = pool_limits(name)
+        timeout = httpx.Timeout(
+            config.HTTP_READ_TIMEOUT,
+            connect=config.HTTP_CONNECT_TIMEOUT,
+            pool=config.HTTP_POOL_TIMEOUT,
+        )
+        transport = MeteredTransport(http2=config.HTTP2_ENABLED, limits=limits)
+        override = UPSTREAM_OVERRIDES.get(name)
+        client = httpx.AsyncClient(
+            base_url=(override and getattr(config, override)) or UPSTREAMS.get(name, ""),
+            transport=transport,
+            timeout=timeout,
+        )
+        self._transports[name] = transport
+        self._clients[name] = client
+        return client
+
+    async def start(self):
+        """Creates a client for every known upstream."""
+        for name in UPSTREAMS:
+            if name not in self._clients:
+                self._create(name)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Returns the pooled client for an upstream, creating it if needed."""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(name)
+        return client
+
+    async def aclose(self):
+        """Closes every client and drains their connection pools."""
+        for name, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing HTTP client '{name}': {e}", exc_info=True)
+        self._clients.clear()
+        self._transports.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns pool metrics for every upstream client."""
+        return {
+            name: {
+                **transport.stats.as_dict(),
+                **transport.connection_counts(),
+                "max_connections": pool_limits(name).max_connections,
+            }
+            for name, transport in self._transports.items()
+        }
+
+
+http_clients = HTTPClientRegistry()
+
+
+def get_http_client(name: str = "openrouter") -> httpx.AsyncClient:
+    """Returns the shared pooled client for the given upstream."""
+    return http_clients.get(name)
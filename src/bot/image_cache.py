@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from src.config import (
+    IMAGE_CACHE_ENABLED,
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_MAX_BYTES,
+    IMAGE_CACHE_MAX_ENTRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data: bytes | bytearray | memoryview) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class _BoundedDict(OrderedDict):
+    """An LRU dict that forgets its oldest entries beyond IMAGE_CACHE_MAX_ENTRIES."""
+
+    def remember(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > IMAGE_CACHE_MAX_ENTRIES:
+            self.popitem(last=False)
+
+    def recall(self, key):
+        value = self.get(key)
+        if value is not None:
+            self.move_to_end(key)
+        return value
+
+
+class ImageCache:
+    """
+    Cache of image work keyed by Telegram's file_unique_id plus a content hash.
+
+    file_unique_id is known before downloading, so a repeat of the same Telegram file
+    is answered by resending the file_id of our earlier reply, with no download and no
+    remove.bg upload. The content hash catches the same picture uploaded again as a new
+    file. Processed PNGs are kept in a size-bounded directory and read back through mmap;
+    vision captions are kept in memory.
+    """
+
+    def __init__(self):
+        self._hashes = _BoundedDict()  # file_unique_id -> content hash
+        self._file_ids = _BoundedDict()  # (task, content hash) -> file_id of our reply
+        self._captions = _BoundedDict()  # content hash -> vision caption
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # content hash -> PNG size
+        self._disk_bytes = 0
+        self.stats = {"caption_hits": 0, "file_id_hits": 0, "disk_hits": 0, "computed": 0}
+
+    async def start(self):
+        """Indexes PNGs left on disk by a previous run, oldest first."""
+        if IMAGE_CACHE_ENABLED:
+            await asyncio.to_thread(self._scan)
+
+    def _scan(self):
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        entries = []
+        for entry in os.scandir(IMAGE_CACHE_DIR):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._remove_pngs(self._evict_disk())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(IMAGE_CACHE_DIR, f"{key}.png")
+
+    def hash_for(self, file_unique_id: str) -> str | None:
+        if not IMAGE_CACHE_ENABLED:
+            return None
+        return self._hashes.recall(file_unique_id)
+
+    def remember_hash(self, file_unique_id: str, key: str):
+        if IMAGE_CACHE_ENABLED:
+            self._hashes.remember(file_unique_id, key)
+
+    def get_file_id(self, task: str, key: str | None) -> str | None:
+        file_id = self._file_ids.recall((task, key)) if key and IMAGE_CACHE_ENABLED else None
+        if file_id:
+            self.stats["file_id_hits"] += 1
+        return file_id
+
+    def set_file_id(self, task: str, key: str, file_id: str):
+        if IMAGE_CACHE_ENABLED:
+            self._file_ids.remember((task, key), file_id)
+
+    def get_caption(self, key: str | None) -> str | None:
+        caption = self._captions.recall(key) if key and IMAGE_CACHE_ENABLED else None
+        if caption:
+            self.stats["caption_hits"] += 1
+        return caption
+
+    def set_caption(self, key: str, caption: str):
+        self.stats["computed"] += 1
+        if IMAGE_CACHE_ENABLED:
+            self._captions.remember(key, caption)
+
+    @contextmanager
+    def open_png(self, key: str | None) -> Iterator[mmap.mmap | None]:
+        """
+        Maps a cached PNG into memory for reading without copying it into Python objects.
+        Yields None on a miss, including a file that was removed behind the index's back.
+        """
+        mapped = self._map_png(key) if key and key in self._disk else None
+        if mapped is None:
+            yield None
+            return
+        with mapped:
+            self._disk.move_to_end(key)
+            self.stats["disk_hits"] += 1
+            yield mapped
+
+    def _map_png(self, key: str) -> mmap.mmap | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                # The mapping stays valid after the file is closed
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # Deleted or emptied: forget it so the next request recomputes and rewrites it
+            logger.warning(f"Image cache entry {key} is unreadable, dropping it: {e}")
+            self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+
+    async def store_png(self, key: str, data: bytes):
+        self.stats["computed"] += 1
+        if not IMAGE_CACHE_ENABLED or len(data) > IMAGE_CACHE_MAX_BYTES:
+            return
+        try:
+            await asyncio.to_thread(self._write_png, key, data)
+        except OSError as e:
+            logger.error(f"Could not write image cache entry {key}: {e}")
+            return
+        self._disk_bytes += len(data) - self._disk.pop(key, 0)
+        self._disk[key] = len(data)
+        evicted = self._evict_disk()
+        if evicted:
+            await asyncio.to_thread(self._remove_pngs, evicted)
+
+    def _write_png(self, key: str, data: bytes):
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        temporary = self._path(key) + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, self._path(key))
+
+    def _evict_disk(self) -> list:
+        """Drops the least recently used PNGs from the index until it fits the budget."""
+        evicted = []
+        while self._disk_bytes > IMAGE_CACHE_MAX_BYTES and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(key)
+        return evicted
+
+    def _remove_pngs(self, keys: list):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "captions": len(self._captions),
+            "file_ids": len(self._file_ids),
+            "disk_files": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+image_cache = ImageCache()
@@ -0,0 +1,121 @@
+import base64
+import json
+import logging
+import uuid
+from typing import Any, AsyncIterator, Dict, Sequence, Tuple
+
+from telegram import PhotoSize
+
+from src.config import IMAGE_TARGET_SIZES, IMAGE_ENCODE_CHUNK
+
+logger = logging.getLogger(__name__)
+
+# Stand-in for the data URL inside a payload; replaced by the streamed image when the body is sent
+IMAGE_URL = f"image-{uuid.uuid4().hex}"
+
+# Base64 works on 3-byte groups, so chunks that are a multiple of 3 encode independently
+_CHUNK = max(3, IMAGE_ENCODE_CHUNK - IMAGE_ENCODE_CHUNK % 3)
+
+
+def pick_photo(photos: Sequence[PhotoSize], task: str) -> PhotoSize:
+    """
+    Returns the smallest size whose longer side reaches the task's target resolution
+    (IMAGE_TARGET_SIZES), or the largest size if none does or the task has no target.
+    """
+    by_area = sorted(photos, key=lambda size: size.width * size.height)
+    target = IMAGE_TARGET_SIZES.get(task, 0)
+    if target > 0:
+        for size in by_area:
+            if max(size.width, size.height) >= target:
+                return size
+    return by_area[-1]
+
+
+class _Capture:
+    """Write-only sink that keeps the downloaded bytes object instead of copying it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(data)
+        return len(data)
+
+
+async def download_photo(photo: PhotoSize) -> memoryview:
+    """Downloads a photo into a single buffer and returns a read-only view of it."""
+    photo_file = await photo.get_file()
+    sink = _Capture()
+    await photo_file.download_to_memory(sink)
+    data = sink.chunks[0] if len(sink.chunks) == 1 else b"".join(sink.chunks)
+    return memoryview(data)
+
+
+def encoded_length(size: int) -> int:
+    return 4 * ((size + 2) // 3)
+
+
+def stream_json_with_image(payload: Dict[str, Any], image: memoryview, mime: str = "image/jpeg") -> Tuple[AsyncIterator[bytes], int]:
+    """
+    Serialises `payload`, whose image part has IMAGE_URL as its url, without ever building
+    the base64 string: the JSON around the image is encoded once and the image is base64
+    encoded chunk by chunk from the memoryview as the request body is sent.
+
+    Returns the body iterator and its exact length for the Content-Length header.
+    """
+    prefix, suffix = json.dumps(payload).encode("utf-8").split(IMAGE_URL.encode("ascii"))
+    prefix += f"data:{mime};base64,".encode("ascii")
+    length = len(prefix) + encoded_length(len(image)) + len(suffix)
+
+    async def body() -> AsyncIterator[bytes]:
+        yield prefix
+        for start in range(0, len(image), _CHUNK):
+            yield base64.b64encode(image[start:start + _CHUNK])
+        yield suffix
+
+    return body(), length
+
+
+class BufferEstimate:
+    """
+    Adds up the sizes of the large buffers one image request holds (the download, an
+    encoded chunk, the remove.bg result) to estimate its peak memory, so pipeline changes
+    can be compared. It is a tally, not a measurement: allocator overhead and copies made
+    inside httpx or PTB are not seen. Each buffer stays referenced until the request ends,
+    so the tally only grows.
+    """
+
+    def __init__(self, task: str):
+        self.task = task
+        self.held = 0
+
+    def hold(self, size: int):
+        self.held += size
+
+    def finish(self):
+        pipeline_stats.record(self.task, self.held)
+        logger.debug(f"{self.task} image request estimated peak buffer memory: {self.held} bytes")
+
+
+class PipelineStats:
+    def __init__(self):
+        self._tasks: Dict[str, Dict[str, int]] = {}
+
+    def record(self, task: str, estimate: int):
+        stats = self._tasks.setdefault(task, {"requests": 0, "estimated_peak_bytes_total": 0, "estimated_peak_bytes_max": 0})
+        stats["requests"] += 1
+        stats["estimated_peak_bytes_total"] += estimate
+        stats["estimated_peak_bytes_max"] = max(stats["estimated_peak_bytes_max"], estimate)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            task: {
+                "requests": stats["requests"],
+                "estimated_peak_bytes_avg": stats["estimated_peak_bytes_total"] // stats["requests"],
+                "estimated_peak_bytes_max": stats["estimated_peak_bytes_max"],
+            }
+            for task, stats in self._tasks.items()
+        }
+
+
+pipeline_stats = PipelineStats()
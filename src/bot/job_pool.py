@@ -0,0 +1,92 @@
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Set
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from src.config import IMAGE_JOB_CONCURRENCY, IMAGE_JOB_MAX_PENDING
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+Spawn = Callable[[Coroutine], asyncio.Task]
+
+
+class JobPool:
+    """
+    Runs slow jobs as background tasks, at most `concurrency` at a time.
+
+    Handlers hand their work to a pool and return at once, so the update workers stay free
+    for other chats. Jobs beyond `max_pending` (running plus waiting) are refused. A job
+    that fails is counted and re-raised, so `spawn` decides who handles the error.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_pending: int):
+        self.name = name
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._running = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "refused": 0}
+
+    def submit(self, job: Callable[[], Awaitable[Any]], spawn: Spawn = asyncio.create_task) -> bool:
+        """Schedules `job` as a task created by `spawn`. Returns False if the pool is full."""
+        if len(self._tasks) >= self.max_pending:
+            self.stats["refused"] += 1
+            return False
+        task = spawn(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.stats["submitted"] += 1
+        return True
+
+    async def _run(self, job: Callable[[], Awaitable[Any]]):
+        async with self._semaphore:
+            self._running += 1
+            try:
+                await job()
+                self.stats["completed"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+            finally:
+                self._running -= 1
+
+    async def stop(self, timeout: float):
+        """Waits up to `timeout` seconds for running jobs, then cancels the rest."""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "running": self._running,
+            "waiting": len(self._tasks) - self._running,
+        }
+
+
+image_jobs = JobPool("image", IMAGE_JOB_CONCURRENCY, IMAGE_JOB_MAX_PENDING)
+
+
+def in_pool(pool: JobPool, busy_message: str) -> Callable[[Handler], Handler]:
+    """
+    Makes a handler run on `pool` instead of the update worker that received it.
+
+    The job is an application task, so an exception it raises reaches the error handler
+    with its update, just as it would from the handler itself.
+    """
+
+    def decorate(handler: Handler) -> Handler:
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            spawn = lambda coroutine: context.application.create_task(coroutine, update=update)
+            if not pool.submit(lambda: handler(update, context), spawn):
+                if update.effective_message:
+                    await update.effective_message.reply_text(busy_message)
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,197 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+# Stage latencies range from sub-millisecond (parsing) to minutes (slow models)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram("bot_stage_seconds", "Time spent in each processing stage", ["stage"], buckets=BUCKETS)
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler run time", ["handler"], buckets=BUCKETS)
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised", ["handler"])
+MODEL_ATTEMPT_SECONDS = Histogram(
+    "bot_model_attempt_seconds", "Time per model attempt by outcome", ["model", "mode", "outcome"], buckets=BUCKETS
+)
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds", "How late a periodic timer fired",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+# Summed over the live workers in multiprocess mode
+THREAD_POOL_WORKERS = Gauge("bot_thread_pool_workers", "Threads in the default executor", multiprocess_mode="livesum")
+THREAD_POOL_ACTIVE = Gauge("bot_thread_pool_active", "Executor jobs running", multiprocess_mode="livesum")
+THREAD_POOL_QUEUED = Gauge("bot_thread_pool_queued", "Executor jobs waiting for a thread", multiprocess_mode="livesum")
+
+_tracer = None
+_tracer_provider = None
+
+
+class span:
+    """
+    Times a block and records it under `stage` in bot_stage_seconds, plus an
+    OpenTelemetry span when export is on. Works around awaits:
+
+        with span("history_fetch"):
+            history = await ...
+    """
+
+    __slots__ = ("stage", "started", "_otel")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._otel = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._otel = _tracer.start_as_current_span(self.stage)
+            self._otel.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if config.METRICS_ENABLED:
+            STAGE_SECONDS.labels(self.stage).observe(time.perf_counter() - self.started)
+        if self._otel is not None:
+            self._otel.__exit__(exc_type, exc, tb)
+        return False
+
+
+def observe_model_attempt(model: str, mode: str, outcome: str, seconds: float):
+    if config.METRICS_ENABLED:
+        MODEL_ATTEMPT_SECONDS.labels(model, mode, outcome).observe(seconds)
+
+
+def timed_handler(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """Records a handler's run time and failures under its function name."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            if config.METRICS_ENABLED:
+                HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            if config.METRICS_ENABLED:
+                HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """Default executor for asyncio.to_thread that keeps the saturation gauges current."""
+
+    def __init__(self, max_workers: int | None = None):
+        super().__init__(max_workers=max_workers, thread_name_prefix="bot-worker")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        THREAD_POOL_WORKERS.set(self._max_workers)
+
+    def _count(self, queued: int, active: int):
+        with self._lock:
+            self._queued += queued
+            self._active += active
+            THREAD_POOL_QUEUED.set(self._queued)
+            THREAD_POOL_ACTIVE.set(self._active)
+
+    def submit(self, fn, /, *args, **kwargs):
+        self._count(1, 0)
+
+        def run():
+            self._count(-1, 1)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._count(0, -1)
+
+        return super().submit(run)
+
+
+class LoopLagSampler:
+    """Measures how late a timer fires every METRICS_LAG_INTERVAL seconds, i.e. event-loop blocking."""
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self.last_lag = 0.0
+
+    async def _run(self):
+        interval = config.METRICS_LAG_INTERVAL
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.last_lag = max(0.0, time.perf_counter() - started - interval)
+            LOOP_LAG_SECONDS.observe(self.last_lag)
+
+    def start(self):
+        if config.METRICS_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+lag_sampler = LoopLagSampler()
+
+
+def start_metrics():
+    """Installs the instrumented executor, starts lag sampling and, if enabled, OpenTelemetry export."""
+    asyncio.get_running_loop().set_default_executor(InstrumentedExecutor(config.THREAD_POOL_WORKERS or None))
+    lag_sampler.start()
+    if config.METRICS_ENABLED and config.WEB_CONCURRENCY > 1 and not config.PROMETHEUS_MULTIPROC_DIR:
+        logger.warning("WEB_CONCURRENCY > 1 without PROMETHEUS_MULTIPROC_DIR: /metrics shows only the worker that answers")
+    if config.OTEL_EXPORT_ENABLED:
+        _start_otel()
+
+
+async def stop_metrics():
+    await lag_sampler.stop()
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        # Drops this worker's gauges from the live sums
+        multiprocess.mark_process_dead(os.getpid())
+    if _tracer_provider is not None:
+        # Flush spans that are still batched
+        await asyncio.to_thread(_tracer_provider.shutdown)
+
+
+def _start_otel():
+    global _tracer, _tracer_provider
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OTEL_EXPORT_ENABLED is set but opentelemetry-sdk / the OTLP exporter are not installed")
+        return
+    # The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT and friends from the environment
+    provider = TracerProvider(resource=Resource.create({"service.name": config.OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer_provider = provider
+    _tracer = trace.get_tracer("burmacodebot")
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if config.PROMETHEUS_MULTIPROC_DIR:
+        # Every worker's samples, whichever worker answers the scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
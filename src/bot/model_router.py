@@ -0,0 +1,167 @@
+import logging
+import random
+import time
+from typing import Any, Dict, List
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelHealth:
+    """Health record for one model: EWMA latency and error rate, 429 cooldown and circuit breaker."""
+
+    def __init__(self):
+        self.ewma_latency: float | None = None
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def expected_latency(self) -> float:
+        """Latency estimate used for ordering, inflated by the chance of having to retry."""
+        latency = self.ewma_latency if self.ewma_latency is not None else config.MODEL_DEFAULT_LATENCY
+        return latency / max(1.0 - self.error_rate, 0.05)
+
+    def as_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ewma_latency_s": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "expected_latency_s": round(self.expected_latency(), 3),
+            "successes": self.successes,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "cooldown_remaining_s": round(max(0.0, self.cooldown_until - now), 1),
+        }
+
+
+class ModelScoreboard:
+    """
+    In-process scoreboard used to route requests between models.
+
+    A model is skipped while it is cooling down after a 429 or while its breaker is
+    open. After MODEL_BREAKER_OPEN_SECONDS the breaker goes half-open and lets a
+    single probe request through: success closes it, failure opens it again.
+    """
+
+    def __init__(self):
+        self._models: Dict[str, ModelHealth] = {}
+
+    def _health(self, model: str) -> ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth()
+        return health
+
+    def _refresh(self, health: ModelHealth, now: float):
+        if health.state == OPEN and now - health.opened_at >= config.MODEL_BREAKER_OPEN_SECONDS:
+            health.state = HALF_OPEN
+            health.probe_in_flight = False
+
+    def is_available(self, model: str, now: float | None = None) -> bool:
+        now = now or time.monotonic()
+        health = self._health(model)
+        self._refresh(health, now)
+        if now < health.cooldown_until or health.state == OPEN:
+            return False
+        return not (health.state == HALF_OPEN and health.probe_in_flight)
+
+    def acquire(self, model: str, last_resort: bool = False) -> bool:
+        """
+        Claims permission to call a model. Half-open models allow only one caller at a time.
+        A last resort (see fallback) is let through even while it is cooling down or open.
+        """
+        if not self.is_available(model) and not last_resort:
+            return False
+        health = self._health(model)
+        if health.state == HALF_OPEN:
+            health.probe_in_flight = True
+        return True
+
+    def release(self, model: str):
+        """Gives back a half-open probe slot when a call was cancelled without an outcome."""
+        self._health(model).probe_in_flight = False
+
+    def order(self, models: List[str]) -> List[str]:
+        """
+        Orders models by expected latency, fastest first.
+        Models that are cooling down or whose breaker is open are left out; callers fall
+        back to fallback() when that leaves none.
+        """
+        now = time.monotonic()
+        available = [model for model in models if self.is_available(model, now)]
+        # Random tie-break so untried models share traffic evenly
+        return sorted(available, key=lambda model: (self._health(model).expected_latency(), random.random()))
+
+    def recovers_at(self, model: str, now: float | None = None) -> float:
+        """When a model becomes available again: after its cooldown and, if open, its breaker timeout."""
+        now = now or time.monotonic()
+        health = self._health(model)
+        self._refresh(health, now)
+        recovers = max(now, health.cooldown_until)
+        if health.state == OPEN:
+            recovers = max(recovers, health.opened_at + config.MODEL_BREAKER_OPEN_SECONDS)
+        return recovers
+
+    def fallback(self, models: List[str]) -> str | None:
+        """
+        The least bad model when order() leaves none: the one that recovers first, then the
+        fastest. Calling it beats failing every request until a cooldown ends, e.g. with a
+        single free-tier model after one 429.
+        """
+        if not models:
+            return None
+        now = time.monotonic()
+        return min(models, key=lambda model: (self.recovers_at(model, now), self._health(model).expected_latency()))
+
+    def record_success(self, model: str, latency: float):
+        health = self._health(model)
+        alpha = config.MODEL_EWMA_ALPHA
+        health.successes += 1
+        health.consecutive_failures = 0
+        health.ewma_latency = latency if health.ewma_latency is None else alpha * latency + (1 - alpha) * health.ewma_latency
+        health.error_rate = (1 - alpha) * health.error_rate
+        if health.state != CLOSED:
+            logger.info(f"Circuit for model {model} closed after a successful probe")
+        health.state = CLOSED
+        health.probe_in_flight = False
+
+    def record_failure(self, model: str, status_code: int | None = None, retry_after: float | None = None):
+        health = self._health(model)
+        alpha = config.MODEL_EWMA_ALPHA
+        now = time.monotonic()
+        health.failures += 1
+        health.consecutive_failures += 1
+        health.error_rate = alpha + (1 - alpha) * health.error_rate
+        health.probe_in_flight = False
+
+        if status_code == 429:
+            health.rate_limited += 1
+            cooldown = retry_after or config.MODEL_RATE_LIMIT_COOLDOWN
+            health.cooldown_until = now + cooldown
+            logger.warning(f"Model {model} is rate limited, cooling down for {cooldown:.0f}s")
+
+        if health.state == HALF_OPEN or health.consecutive_failures >= config.MODEL_BREAKER_FAILURES:
+            if health.state != OPEN:
+                logger.warning(f"Circuit for model {model} opened after {health.consecutive_failures} failures")
+            health.state = OPEN
+            health.opened_at = now
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        for health in self._models.values():
+            self._refresh(health, now)
+        return {model: health.as_dict(now) for model, health in self._models.items()}
+
+
+scoreboard = ModelScoreboard()
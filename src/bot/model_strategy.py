@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+
+from src import config
+from src.bot.model_router import scoreboard
+from src.bot.metrics import observe_model_attempt
+
+logger = logging.getLogger(__name__)
+
+SEQUENTIAL = "sequential"
+HEDGED = "hedged"
+RACE = "race"
+STRATEGIES = (SEQUENTIAL, HEDGED, RACE)
+
+Attempt = Callable[[str], Awaitable[str | None]]
+# Builds a streamed request body and its length from a payload too large to serialise whole
+BodyEncoder = Callable[[Dict[str, Any]], Tuple[AsyncIterator[bytes], int]]
+
+# The per-attempt deadline around the running attempt, so a cancelled call can tell a
+# timeout from being cancelled by a faster model or a newer message
+_attempt_deadline: ContextVar[asyncio.Timeout | None] = ContextVar("attempt_deadline", default=None)
+
+
+class LatencyWindow:
+    """Keeps the most recent successful response times to derive a hedge delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+latency_window = LatencyWindow()
+
+
+def hedge_delay() -> float:
+    """
+    Returns how long to wait on a model before starting the next one.
+    Uses the observed p95 latency once enough samples exist, clamped to the configured bounds.
+    """
+    p95 = latency_window.percentile(0.95)
+    if p95 is None or len(latency_window) < config.LLM_HEDGE_MIN_SAMPLES:
+        return config.LLM_HEDGE_DELAY
+    return min(max(p95, config.LLM_HEDGE_MIN_DELAY), config.LLM_HEDGE_MAX_DELAY)
+
+
+async def call_model(
+    client: httpx.AsyncClient,
+    model: str,
+    payload_base: Dict[str, Any],
+    headers: Dict[str, str],
+    endpoint: str,
+    body: BodyEncoder | None = None,
+    last_resort: bool = False,
+) -> str | None:
+    """
+    Sends a single chat completion request to one model.
+    Returns the response content, or None if the model failed or answered badly.
+    """
+    if not scoreboard.acquire(model, last_resort):
+        logger.info(f"Skipping model {model}: circuit open or cooling down")
+        return None
+
+    payload = payload_base.copy()
+    payload["model"] = model
+    started = time.perf_counter()
+    try:
+        logger.info(f"Trying model: {model}")
+        if body is None:
+            response = await client.post(endpoint, headers=headers, json=payload)
+        else:
+            content, length = body(payload)
+            response = await client.post(endpoint, headers={**headers, "Content-Length": str(length)}, content=content)
+        response.raise_for_status()
+        response_data = response.json()
+        # Add a check for expected structure before accessing keys
+        if (
+            "choices" in response_data
+            and response_data["choices"]
+            and "message" in response_data["choices"][0]
+            and "content" in response_data["choices"][0]["message"]
+        ):
+            latency = time.perf_counter() - started
+            latency_window.record(latency)
+            scoreboard.record_success(model, latency)
+            observe_model_attempt(model, "complete", "success", latency)
+            return response_data["choices"][0]["message"]["content"]
+        logger.warning(f"Model {model} returned an unexpected response structure: {response_data}")
+        outcome = "bad_response"
+    except httpx.HTTPStatusError as e:
+        logger.warning(f"Model {model} failed with status {e.response.status_code}: {e.response.text}")
+        scoreboard.record_failure(model, e.response.status_code, retry_after(e.response))
+        observe_model_attempt(model, "complete", f"http_{e.response.status_code}", time.perf_counter() - started)
+        return None
+    except asyncio.CancelledError:
+        scoreboard.release(model)
+        deadline = _attempt_deadline.get()
+        outcome = "timeout" if deadline is not None and deadline.expired() else "cancelled"
+        observe_model_attempt(model, "complete", outcome, time.perf_counter() - started)
+        raise
+    except Exception as e:
+        logger.error(f"An unexpected error occurred with model {model}: {e}", exc_info=True)
+        outcome = "error"
+    scoreboard.record_failure(model)
+    observe_model_attempt(model, "complete", outcome, time.perf_counter() - started)
+    return None
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    """The Retry-After header of a 429 in seconds, if it has one."""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+async def _attempt_with_deadline(attempt: Attempt, model: str, attempt_timeout: float) -> str | None:
+    token = None
+    try:
+        async with asyncio.timeout(attempt_timeout) as deadline:
+            token = _attempt_deadline.set(deadline)
+            return await attempt(model)
+    except asyncio.TimeoutError:
+        logger.warning(f"Model {model} did not answer within {attempt_timeout}s")
+        scoreboard.record_failure(model)
+        return None
+    finally:
+        if token is not None:
+            _attempt_deadline.reset(token)
+
+
+async def run_sequential(models: List[str], attempt: Attempt, attempt_timeout: float) -> str | None:
+    """Tries each model in turn until one answers."""
+    for model in models:
+        result = await _attempt_with_deadline(attempt, model, attempt_timeout)
+        if result:
+            return result
+    return None
+
+
+async def _first_valid(
+    models: List[str],
+    attempt: Attempt,
+    attempt_timeout: float,
+    initial: int,
+    delay: float | None,
+) -> str | None:
+    """
+    Shared engine for the hedged and race modes.
+
+    Starts `initial` attempts, then starts another one whenever an attempt fails or,
+    if `delay` is set, whenever no attempt has answered within `delay` seconds.
+    The first valid answer wins and every other attempt is cancelled.
+    """
+    remaining = iter(models)
+    pending: set[asyncio.Task] = set()
+
+    def launch() -> bool:
+        model = next(remaining, None)
+        if model is None:
+            return False
+        pending.add(asyncio.create_task(_attempt_with_deadline(attempt, model, attempt_timeout)))
+        return True
+
+    for _ in range(max(1, initial)):
+        if not launch():
+            break
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()  # Hedge: the current attempts are slower than usual
+                continue
+            for task in done:
+                pending.discard(task)
+                result = task.result()
+                if result:
+                    return result
+                launch()  # Fall back to the next model straight away
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def run_hedged(models: List[str], attempt: Attempt, attempt_timeout: float) -> str | None:
+    """Starts the next model if the current ones have not answered within the hedge delay."""
+    return await _first_valid(models, attempt, attempt_timeout, initial=1, delay=hedge_delay())
+
+
+async def run_race(models: List[str], attempt: Attempt, attempt_timeout: float) -> str | None:
+    """Starts several models at once; the first valid answer wins."""
+    return await _first_valid(models, attempt, attempt_timeout, initial=config.LLM_RACE_FANOUT, delay=None)
+
+
+RUNNERS = {
+    SEQUENTIAL: run_sequential,
+    HEDGED: run_hedged,
+    RACE: run_race,
+}
+
+
+async def run_strategy(
+    strategy: str,
+    models: List[str],
+    attempt: Attempt,
+    attempt_timeout: float,
+    overall_timeout: float,
+) -> str | None:
+    """Runs the named strategy under an overall deadline."""
+    runner = RUNNERS.get(strategy)
+    if runner is None:
+        logger.warning(f"Unknown model strategy '{strategy}', falling back to {SEQUENTIAL}")
+        runner = run_sequential
+    try:
+        return await asyncio.wait_for(runner(models, attempt, attempt_timeout), overall_timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"No model answered within the overall deadline of {overall_timeout}s")
+        return None
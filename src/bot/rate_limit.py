@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ReturnDocument
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from src.config import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_USER,
+    RATE_LIMIT_CHAT,
+    RATE_LIMIT_UPSTREAMS,
+    RATE_LIMIT_COSTS,
+    RATE_LIMIT_MAX_WAIT,
+    RATE_LIMIT_NOTIFY_AFTER,
+    RATE_LIMIT_MAX_KEYS,
+)
+from src.database.db import get_db_client
+
+logger = logging.getLogger(__name__)
+
+# Which paid upstream each kind of request uses
+UPSTREAM_FOR = {
+    "text": "openrouter",
+    "search": "openrouter",
+    "photo": "openrouter",
+    "removebg": "removebg",
+}
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # `now` may predate a bucket created after the caller read the clock
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until `cost` tokens are available (0 if they are available now)."""
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0 or cost > self.capacity:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float):
+        self.tokens -= cost
+
+    def pause(self, seconds: float, now: float):
+        """Empties the bucket so that the next token is available in `seconds`."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class BucketStore:
+    """In-memory token buckets for one scope (users, chats or upstreams), LRU-bounded."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+
+    def get(self, key: Any) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, self.rate)
+            if len(self._buckets) > RATE_LIMIT_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class MongoBuckets:
+    """
+    Token buckets shared by every worker process. Each take is a single atomic
+    find_one_and_update whose pipeline refills the bucket and takes tokens if enough are left.
+    """
+
+    def _collection(self):
+        return get_db_client().get_database("telegram_bot_db").get_collection("rate_limits")
+
+    async def try_take(self, key: str, capacity: float, rate: float, cost: float) -> bool:
+        now = datetime.now(timezone.utc)
+        refilled = {
+            "$min": [
+                capacity,
+                {"$add": [
+                    {"$ifNull": ["$tokens", capacity]},
+                    {"$multiply": [{"$divide": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 1000]}, rate]},
+                ]},
+            ]
+        }
+        document = await self._collection().find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return bool(document and document.get("allowed"))
+
+    async def refund(self, key: str, cost: float):
+        await self._collection().update_one({"_id": key}, {"$inc": {"tokens": cost}})
+
+
+def classify(update: Update) -> str | None:
+    """Returns the kind of request an update makes, or None if it uses no paid upstream."""
+    message = update.effective_message
+    if not message:
+        return None
+    text = message.text or message.caption or ""
+    if text.startswith("/"):
+        command = text.split()[0][1:].split("@")[0].lower()
+        return command if command in UPSTREAM_FOR else None
+    if message.photo:
+        return "photo"
+    if message.text:
+        return "text"
+    return None
+
+
+class AdmissionController:
+    """
+    Token-bucket admission control, applied before any handler runs.
+
+    Each request kind has a cost (RATE_LIMIT_COSTS) that is charged to the user's
+    bucket, the chat's bucket and the bucket of the upstream it uses. A request that
+    can be admitted within RATE_LIMIT_MAX_WAIT seconds waits for it, with a notice if
+    the wait reaches RATE_LIMIT_NOTIFY_AFTER; anything else is rejected with a short
+    reply and never reaches the LLM or remove.bg.
+    """
+
+    def __init__(self):
+        self._users = BucketStore(*RATE_LIMIT_USER)
+        self._chats = BucketStore(*RATE_LIMIT_CHAT)
+        self._upstreams = {name: BucketStore(*limits) for name, limits in RATE_LIMIT_UPSTREAMS.items()}
+        self._mongo = MongoBuckets() if RATE_LIMIT_BACKEND == "mongo" else None
+        self._notified: Dict[int, float] = {}
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "backend_errors": 0, "jobs_deferred": 0}
+
+    def _scopes(self, update: Update, kind: str) -> List[Tuple[str, BucketStore, Any]]:
+        scopes = []
+        if update.effective_user:
+            scopes.append(("user", self._users, update.effective_user.id))
+        if update.effective_chat:
+            scopes.append(("chat", self._chats, update.effective_chat.id))
+        upstream = UPSTREAM_FOR[kind]
+        if upstream in self._upstreams:
+            scopes.append(("upstream", self._upstreams[upstream], upstream))
+        return scopes
+
+    async def admit(self, update: Update) -> Tuple[bool, float]:
+        """Returns (admitted, seconds until a retry could succeed)."""
+        kind = classify(update)
+        if kind is None:
+            return True, 0.0
+        cost = RATE_LIMIT_COSTS.get(kind, 1)
+        scopes = self._scopes(update, kind)
+        if self._mongo is not None:
+            return await self._admit_shared(scopes, cost)
+
+        now = time.monotonic()
+        wait = max((store.get(key).wait_time(cost, now) for _, store, key in scopes), default=0.0)
+        if wait > RATE_LIMIT_MAX_WAIT:
+            self.stats["rejected"] += 1
+            return False, min(wait, 3600.0)
+        # Reserve the tokens now (buckets may dip below zero) so that concurrent
+        # requests queue up behind this one instead of all waking at once
+        for _, store, key in scopes:
+            store.get(key).take(cost)
+        if wait > 0:
+            self.stats["queued"] += 1
+            if wait >= RATE_LIMIT_NOTIFY_AFTER:
+                await self._notify_queued(update, wait)
+            # Sending the notice counts towards the wait
+            await asyncio.sleep(max(0.0, now + wait - time.monotonic()))
+        self.stats["admitted"] += 1
+        return True, 0.0
+
+    async def _notify_queued(self, update: Update, wait: float):
+        message = update.effective_message
+        user_id = update.effective_user.id if update.effective_user else 0
+        if not message or not self.should_notify(user_id, wait):
+            return
+        try:
+            await message.reply_text(f"You're sending requests quickly, so I'll get to this one in about {max(1, round(wait))} seconds.")
+        except Exception as e:
+            logger.warning(f"Could not send a queued notice: {e}")
+
+    async def admit_job(self, user_id: int, upstream: str, cost: float) -> bool:
+        """
+        Charges background work done for a user, e.g. summarising their history, to the
+        user's bucket and the upstream's. Returns False without waiting if it does not fit
+        now; the work can be done on a later attempt.
+        """
+        if not RATE_LIMIT_ENABLED:
+            return True
+        scopes = [("user", self._users, user_id)]
+        if upstream in self._upstreams:
+            scopes.append(("upstream", self._upstreams[upstream], upstream))
+        if self._mongo is not None:
+            admitted, _ = await self._admit_shared(scopes, cost)
+        else:
+            now = time.monotonic()
+            admitted = all(store.get(key).wait_time(cost, now) <= 0 for _, store, key in scopes)
+            if admitted:
+                for _, store, key in scopes:
+                    store.get(key).take(cost)
+        if not admitted:
+            self.stats["jobs_deferred"] += 1
+        return admitted
+
+    async def _admit_shared(self, scopes, cost: float) -> Tuple[bool, float]:
+        taken = []
+        try:
+            for scope, store, key in scopes:
+                bucket_key = f"{scope}:{key}"
+                if not await self._mongo.try_take(bucket_key, store.capacity, store.rate, cost):
+                    for taken_key in taken:
+                        await self._mongo.refund(taken_key, cost)
+                    self.stats["rejected"] += 1
+                    return False, cost / store.rate if store.rate else 60.0
+                taken.append(bucket_key)
+        except Exception as e:
+            # Fail open: a broken limiter backend should not take the bot down
+            self.stats["backend_errors"] += 1
+            logger.error(f"Rate limit backend error: {e}")
+        self.stats["admitted"] += 1
+        return True, 0.0
+
+    def should_notify(self, user_id: int, retry_in: float) -> bool:
+        """Only tell a user they are rate limited once per back-off period."""
+        now = time.monotonic()
+        if self._notified.get(user_id, 0.0) > now:
+            return False
+        if len(self._notified) > RATE_LIMIT_MAX_KEYS:
+            self._notified.clear()
+        self._notified[user_id] = now + max(retry_in, 1.0)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "backend": RATE_LIMIT_BACKEND,
+            "tracked_users": len(self._users),
+            "tracked_chats": len(self._chats),
+        }
+
+
+admission = AdmissionController()
+
+
+async def admission_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """High-priority handler: stops the update here if it is over its rate limits."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    admitted, retry_in = await admission.admit(update)
+    if admitted:
+        return
+    message = update.effective_message
+    user_id = update.effective_user.id if update.effective_user else 0
+    if message and admission.should_notify(user_id, retry_in):
+        await message.reply_text(
+            f"You're sending requests too quickly. Please try again in {max(1, round(retry_in))} seconds."
+        )
+    raise ApplicationHandlerStop
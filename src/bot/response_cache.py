@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from src.config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+)
+from src.database.db import get_db_client
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = "?!.,;:¿¡。？！ "
+
+
+def normalise_query(text: str) -> str:
+    """
+    Normalises a prompt so trivially different phrasings share a cache entry:
+    Unicode NFKC, case folding, collapsed whitespace and no trailing punctuation.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _WHITESPACE.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+def cache_key(text: str, models: Iterable[str], plugins: Iterable[str] = ()) -> str:
+    """Builds the cache key from the normalised text, the model set and the plugin set."""
+    parts = [normalise_query(text), ",".join(sorted(models)), ",".join(sorted(plugins))]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of LLM answers with an optional MongoDB tier.
+
+    get_or_compute() coalesces concurrent lookups of the same key, so a burst of
+    identical queries makes a single upstream call and everyone shares its answer.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "mongo_hits": 0, "misses": 0, "coalesced": 0, "stores": 0}
+
+    def _collection(self):
+        return get_db_client().get_database("telegram_bot_db").get_collection("response_cache")
+
+    async def start(self):
+        if RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_BACKEND == "mongo":
+            try:
+                await self._collection().create_index("expires_at", expireAfterSeconds=0)
+            except Exception as e:
+                logger.error(f"Could not create TTL index for the response cache: {e}", exc_info=True)
+
+    async def get(self, key: str) -> str | None:
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self._entries[key]
+
+        if RESPONSE_CACHE_BACKEND == "mongo":
+            try:
+                document = await self._collection().find_one(
+                    {"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}}, {"value": 1}
+                )
+                if document:
+                    self._remember(key, document["value"])
+                    self.stats["mongo_hits"] += 1
+                    return document["value"]
+            except Exception as e:
+                logger.error(f"Response cache lookup failed: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, value: str):
+        if not RESPONSE_CACHE_ENABLED or not value:
+            return
+        self._remember(key, value)
+        self.stats["stores"] += 1
+        if RESPONSE_CACHE_BACKEND == "mongo":
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=RESPONSE_CACHE_TTL)
+            try:
+                await self._collection().replace_one(
+                    {"_id": key}, {"_id": key, "value": value, "expires_at": expires_at}, upsert=True
+                )
+            except Exception as e:
+                logger.error(f"Response cache store failed: {e}")
+
+    def _remember(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + RESPONSE_CACHE_TTL, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > RESPONSE_CACHE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str | None]]) -> str | None:
+        """Returns the cached answer, or computes it once however many callers ask at the same time."""
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The caller doing the work was cancelled; take over from it
+                return await self.get_or_compute(key, compute)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await compute()
+            if value:
+                await self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the error; mark it retrieved so it is not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["mongo_hits"] + self.stats["misses"]
+        hits = self.stats["hits"] + self.stats["mongo_hits"]
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "backend": RESPONSE_CACHE_BACKEND,
+        }
+
+
+response_cache = ResponseCache()
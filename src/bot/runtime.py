@@ -0,0 +1,138 @@
+"""
+The bot side of the web app: Telegram application, upstream clients, caches and pools.
+
+src.main imports this module on startup rather than at import time, because it pulls
+in python-telegram-bot, httpx and pymongo. That keeps `import src.main` cheap and, with
+FAST_START, lets the server answer health checks while the bot is still starting.
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+
+from starlette.responses import Response
+from telegram import Update
+
+from src.bot.application import get_application
+from src.bot.http_client import http_clients
+from src.bot.model_router import scoreboard
+from src.bot.update_queue import update_queue
+from src.bot.dedup import deduplicator
+from src.bot.rate_limit import admission
+from src.bot.response_cache import response_cache
+from src.bot.image_cache import image_cache
+from src.bot.image_pipeline import pipeline_stats
+from src.bot.job_pool import image_jobs
+from src.bot.state_store import state_store
+from src.bot.send_scheduler import send_scheduler
+from src.bot.broadcast import broadcaster
+from src.bot.history_compaction import history_compactor
+from src.bot.coalescing import chat_coalescer
+from src.bot.context_builder import stop_summaries
+from src.bot.metrics import span, start_metrics, stop_metrics
+from src.bot.webhook_codec import json_response
+from src.database.db import close_db_client, ensure_indexes
+from src.database.write_buffer import write_buffer
+from src.database.history_cache import history_cache
+from src.config import WEBHOOK_MODE, UPDATE_DRAIN_TIMEOUT, check_required
+from src.startup import startup
+
+logger = logging.getLogger(__name__)
+
+_background: set[asyncio.Task] = set()
+
+
+async def start():
+    check_required()
+    # Everything below is per process: under gunicorn each worker builds its own
+    # bot, clients and pools here, after it has been forked
+    application = get_application()
+    start_metrics()
+    with startup.phase("clients"):
+        # Pooled keep-alive clients for OpenRouter and remove.bg, shared by all updates
+        await http_clients.start()
+        await write_buffer.start()
+    with startup.phase("caches"):
+        await deduplicator.start()
+        await response_cache.start()
+        await image_cache.start()
+        await state_store.start()
+    with startup.phase("application"):
+        await application.initialize()
+        await application.start()
+    if WEBHOOK_MODE == "queue":
+        await update_queue.start(application)
+    # Index builds can take a while on a large collection and nothing waits on them
+    task = asyncio.create_task(ensure_indexes())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    history_compactor.start()
+
+
+async def stop():
+    for task in list(_background):
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    application = get_application()
+    # Finish queued updates while the bot and clients are still available
+    await update_queue.stop()
+    await image_jobs.stop(UPDATE_DRAIN_TIMEOUT)
+    # A running broadcast saves its checkpoint and can be resumed after the restart
+    await broadcaster.stop()
+    await history_compactor.stop()
+    # Also waits for coalesced text replies, which run as application tasks
+    await application.stop()
+    await application.shutdown()
+    # A summary cut short keeps the batches it saved; the rest is done after the restart
+    await stop_summaries()
+    await http_clients.aclose()
+    # Drain buffered writes before the DB client goes away
+    await write_buffer.stop()
+    await close_db_client()
+    await stop_metrics()
+
+
+def snapshot() -> Dict[str, Any]:
+    return {
+        "http_pools": http_clients.stats(),
+        "models": scoreboard.snapshot(),
+        "write_buffer": write_buffer.snapshot(),
+        "history_cache": history_cache.snapshot(),
+        "history_compaction": history_compactor.snapshot(),
+        "update_queue": update_queue.snapshot(),
+        "coalescing": chat_coalescer.snapshot(),
+        "dedup": deduplicator.snapshot(),
+        "rate_limit": admission.snapshot(),
+        "response_cache": response_cache.snapshot(),
+        "image_cache": image_cache.snapshot(),
+        "image_pipeline": pipeline_stats.snapshot(),
+        "image_jobs": image_jobs.snapshot(),
+        "state": state_store.snapshot(),
+        "send_scheduler": send_scheduler.snapshot(),
+        "broadcast": broadcaster.snapshot(),
+    }
+
+
+def bot_username() -> str:
+    return get_application().bot.username
+
+
+async def handle_update(update_dict: Dict[str, Any]) -> Response:
+    # Telegram redelivers updates it thinks we missed; handle each update_id only once
+    update_id = update_dict["update_id"]
+    if await deduplicator.is_duplicate(update_id):
+        return json_response()
+
+    application = get_application()
+    with span("webhook_parse"):
+        update = Update.de_json(update_dict, application.bot)
+
+    if update_queue.running:
+        # Acknowledge straight away; a worker processes the update in the background.
+        # If the queue is full, a 503 makes Telegram redeliver the update later.
+        if not update_queue.submit(update):
+            await deduplicator.forget(update_id)
+            return json_response({"ok": False, "error": "overloaded"}, status_code=503)
+        return json_response()
+
+    await application.process_update(update)
+    return json_response()
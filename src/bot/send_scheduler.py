@@ -0,0 +1,187 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from src.bot.metrics import span
+from src.bot.rate_limit import BucketStore, TokenBucket
+from src.bot.streaming import retry_seconds
+from src.config import (
+    SEND_SCHEDULER_ENABLED,
+    SEND_RATE_GLOBAL,
+    SEND_RATE_CHAT,
+    SEND_RATE_GROUP,
+    SEND_MAX_RETRIES,
+    SEND_MAX_RETRY_AFTER,
+)
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, passed as rate_limit_args, e.g. bot.send_message(..., rate_limit_args=BULK).
+# Lower goes first when requests wait for the global bucket.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = {INTERACTIVE: 0, BULK: 1}
+
+
+class _PendingEdit:
+    """An edit waiting for its turn. Later edits of the same message replace its call."""
+
+    __slots__ = ("call", "result", "merged")
+
+    def __init__(self, call: Callable[[], Awaitable[Any]]):
+        self.call = call
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.merged = 0
+
+
+class SendScheduler(BaseRateLimiter[str]):
+    """
+    Central scheduler for everything the bot sends to Telegram.
+
+    Requests addressed to a chat take a token from that chat's bucket (groups have their
+    own, slower limit) and then from the global bucket, which serves waiting requests in
+    lane order so interactive replies overtake bulk sends. A RetryAfter pauses the chat
+    and the request is retried, and an edit still waiting for its turn is replaced by a
+    newer edit of the same message, so only the latest text is sent.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(*SEND_RATE_GLOBAL)
+        self._chats = BucketStore(*SEND_RATE_CHAT)
+        self._groups = BucketStore(*SEND_RATE_GROUP)
+        # Heap of (lane, sequence, future) waiting for a global token
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._wake = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+        self._edits: Dict[Tuple[Any, int], _PendingEdit] = {}
+        self.stats = {"sent": 0, "retried": 0, "gave_up": 0, "merged_edits": 0}
+
+    async def initialize(self):
+        if SEND_SCHEDULER_ENABLED and self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for _, _, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._dispatcher is None:
+            # Not addressed to a chat (getMe, getFile, inline edits, ...) or scheduling is off
+            return await callback(*args, **kwargs)
+        lane = LANES.get(rate_limit_args, LANES[INTERACTIVE])
+        call = functools.partial(callback, *args, **kwargs)
+        if endpoint == "editMessageText" and "message_id" in data:
+            return await self._edit((chat_id, data["message_id"]), lane, call)
+        return await self._send(chat_id, lane, call)
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        # Groups and channels have negative ids (or an @username)
+        if isinstance(chat_id, str) or chat_id < 0:
+            return self._groups.get(chat_id)
+        return self._chats.get(chat_id)
+
+    async def _acquire(self, chat_id: Any, lane: int):
+        bucket = self._bucket(chat_id)
+        wait = bucket.wait_time(1, time.monotonic())
+        # Reserve the token now so later sends to this chat queue up behind this one
+        bucket.take(1)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if not self._waiting and self._global.wait_time(1, time.monotonic()) == 0:
+            self._global.take(1)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (lane, next(self._sequence), future))
+        self._wake.set()
+        await future
+
+    async def _dispatch(self):
+        """Hands out global tokens to waiting requests, best lane first, as they refill."""
+        while True:
+            while not self._waiting:
+                self._wake.clear()
+                await self._wake.wait()
+            wait = self._global.wait_time(1, time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():  # Skip requests that were cancelled while waiting
+                self._global.take(1)
+                future.set_result(None)
+
+    async def _send(self, chat_id: Any, lane: int, call: Callable[[], Awaitable[Any]]):
+        for attempt in itertools.count():
+            with span("send_wait"):
+                await self._acquire(chat_id, lane)
+            try:
+                result = await call()
+            except RetryAfter as e:
+                seconds = retry_seconds(e)
+                self._bucket(chat_id).pause(seconds, time.monotonic())
+                if attempt >= SEND_MAX_RETRIES or seconds > SEND_MAX_RETRY_AFTER:
+                    self.stats["gave_up"] += 1
+                    raise
+                self.stats["retried"] += 1
+                logger.warning(f"Telegram asked to wait {seconds}s before sending to chat {chat_id}; retrying")
+                continue
+            self.stats["sent"] += 1
+            return result
+
+    async def _edit(self, key: Tuple[Any, int], lane: int, call: Callable[[], Awaitable[Any]]):
+        pending = self._edits.get(key)
+        if pending is not None:
+            # An earlier edit is still waiting: send this text in its place and share the result
+            pending.call = call
+            pending.merged += 1
+            self.stats["merged_edits"] += 1
+            return await asyncio.shield(pending.result)
+
+        pending = self._edits[key] = _PendingEdit(call)
+
+        async def latest():
+            # From here on, newer edits queue up separately
+            if self._edits.get(key) is pending:
+                del self._edits[key]
+            return await pending.call()
+
+        try:
+            result = await self._send(key[0], lane, latest)
+        except asyncio.CancelledError:
+            pending.result.cancel()
+            raise
+        except Exception as e:
+            if pending.merged:
+                pending.result.set_exception(e)
+            raise
+        finally:
+            if self._edits.get(key) is pending:
+                del self._edits[key]
+        pending.result.set_result(result)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self._dispatcher is not None,
+            "waiting": len(self._waiting),
+            "pending_edits": len(self._edits),
+            "chats": len(self._chats) + len(self._groups),
+        }
+
+
+send_scheduler = SendScheduler()
@@ -0,0 +1,193 @@
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from telegram.ext import CallbackContext, ExtBot
+
+from src.config import (
+    STATE_BACKEND,
+    STATE_MAX_TURNS,
+    STATE_MAX_KEY_BYTES,
+    STATE_MAX_BYTES,
+    STATE_TTL,
+)
+from src.database.db import get_db_client
+
+logger = logging.getLogger(__name__)
+
+# Rough per-turn overhead of the record, its strings and the deque slot
+TURN_OVERHEAD = 120
+
+
+class Turn:
+    """One conversation turn. Only the role and text are kept; images never are."""
+
+    __slots__ = ("role", "text")
+
+    def __init__(self, role: str, text: str):
+        self.role = role
+        # A single turn may use at most the whole per-key budget
+        self.text = text[: max(0, STATE_MAX_KEY_BYTES - TURN_OVERHEAD)]
+
+    @property
+    def size(self) -> int:
+        return TURN_OVERHEAD + len(self.text)
+
+    def to_message(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": [{"type": "text", "text": self.text}]}
+
+
+class _Conversation:
+    __slots__ = ("turns", "size")
+
+    def __init__(self):
+        self.turns: deque = deque()
+        self.size = 0
+
+
+class MemoryStateStore:
+    """
+    Per-user conversation state held in process, with flat memory use under load.
+
+    Each user keeps at most STATE_MAX_TURNS turns and STATE_MAX_KEY_BYTES bytes, oldest
+    turns dropped first, and least recently used users are evicted once all users together
+    exceed STATE_MAX_BYTES.
+    """
+
+    def __init__(self):
+        self._conversations: "OrderedDict[int, _Conversation]" = OrderedDict()
+        self._size = 0
+        self.stats = {"evictions": 0, "trimmed_turns": 0}
+
+    async def start(self):
+        pass
+
+    async def get(self, key: int, limit: int | None = None) -> List[Dict[str, Any]]:
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            return []
+        self._conversations.move_to_end(key)
+        turns = list(conversation.turns)
+        return [turn.to_message() for turn in (turns[-limit:] if limit else turns)]
+
+    async def append(self, key: int, role: str, text: str):
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            conversation = self._conversations[key] = _Conversation()
+        self._conversations.move_to_end(key)
+        turn = Turn(role, text)
+        conversation.turns.append(turn)
+        conversation.size += turn.size
+        self._size += turn.size
+        while len(conversation.turns) > STATE_MAX_TURNS or conversation.size > STATE_MAX_KEY_BYTES:
+            dropped = conversation.turns.popleft()
+            conversation.size -= dropped.size
+            self._size -= dropped.size
+            self.stats["trimmed_turns"] += 1
+        self._evict()
+
+    async def pop(self, key: int):
+        """Removes the newest turn, e.g. a question that got no answer."""
+        conversation = self._conversations.get(key)
+        if conversation and conversation.turns:
+            dropped = conversation.turns.pop()
+            conversation.size -= dropped.size
+            self._size -= dropped.size
+
+    async def clear(self, key: int):
+        conversation = self._conversations.pop(key, None)
+        if conversation is not None:
+            self._size -= conversation.size
+
+    def _evict(self):
+        while self._size > STATE_MAX_BYTES and self._conversations:
+            _, conversation = self._conversations.popitem(last=False)
+            self._size -= conversation.size
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "backend": "memory", "users": len(self._conversations), "bytes": self._size}
+
+
+class MongoStateStore:
+    """
+    Per-user conversation state shared by every worker process.
+
+    One document per user holds the latest STATE_MAX_TURNS turns ($push with $slice), and
+    a TTL index removes users that have been idle for STATE_TTL seconds.
+    """
+
+    def __init__(self):
+        self.stats = {"backend_errors": 0}
+
+    def _collection(self):
+        return get_db_client().get_database("telegram_bot_db").get_collection("conversation_state")
+
+    async def start(self):
+        try:
+            await self._collection().create_index("updated_at", expireAfterSeconds=int(STATE_TTL))
+        except Exception as e:
+            logger.error(f"Could not create TTL index for conversation state: {e}", exc_info=True)
+
+    async def get(self, key: int, limit: int | None = None) -> List[Dict[str, Any]]:
+        projection = {"turns": {"$slice": -limit} if limit else 1}
+        try:
+            document = await self._collection().find_one({"_id": key}, projection)
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            logger.error(f"Could not load conversation state for user {key}: {e}")
+            return []
+        turns = document.get("turns", []) if document else []
+        return [Turn(turn["role"], turn["text"]).to_message() for turn in turns]
+
+    async def append(self, key: int, role: str, text: str):
+        turn = Turn(role, text)
+        try:
+            await self._collection().update_one(
+                {"_id": key},
+                {
+                    "$push": {"turns": {"$each": [{"role": turn.role, "text": turn.text}], "$slice": -STATE_MAX_TURNS}},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            logger.error(f"Could not save conversation state for user {key}: {e}")
+
+    async def pop(self, key: int):
+        try:
+            await self._collection().update_one({"_id": key}, {"$pop": {"turns": 1}})
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            logger.error(f"Could not update conversation state for user {key}: {e}")
+
+    async def clear(self, key: int):
+        try:
+            await self._collection().delete_one({"_id": key})
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            logger.error(f"Could not clear conversation state for user {key}: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "backend": "mongo"}
+
+
+STATE_BACKENDS = {
+    "memory": MemoryStateStore,
+    "mongo": MongoStateStore,
+}
+
+if STATE_BACKEND not in STATE_BACKENDS:
+    logger.warning(f"Unknown state backend '{STATE_BACKEND}', falling back to memory")
+
+state_store = STATE_BACKENDS.get(STATE_BACKEND, MemoryStateStore)()
+
+
+class BotContext(CallbackContext[ExtBot, dict, dict, dict]):
+    """Callback context that gives handlers the configured state store as `context.state`."""
+
+    @property
+    def state(self) -> MemoryStateStore | MongoStateStore:
+        return state_store
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, List
+
+import httpx
+from telegram import Message
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter
+
+from src import config
+from src.bot import http_client
+from src.bot.model_router import scoreboard
+from src.bot.model_strategy import retry_after
+from src.bot.metrics import observe_model_attempt, span
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+
+# Last edit time per chat, shared by every streaming reply in that chat
+_last_edit: Dict[int, float] = {}
+
+
+class StreamError(Exception):
+    """Raised when OpenRouter reports an error inside an SSE stream."""
+
+
+async def stream_model(
+    client: httpx.AsyncClient,
+    model: str,
+    payload_base: Dict[str, Any],
+    headers: Dict[str, str],
+    endpoint: str,
+) -> AsyncIterator[str]:
+    """Yields content deltas from a single model using OpenRouter's SSE streaming mode."""
+    payload = payload_base.copy()
+    payload["model"] = model
+    payload["stream"] = True
+    async with client.stream("POST", endpoint, headers=headers, json=payload) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        async for line in response.aiter_lines():
+            # Blank lines separate events and ":" lines are keep-alive comments
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise StreamError(chunk["error"])
+            choices = chunk.get("choices")
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+
+async def stream_models(
+    models: List[str],
+    payload_base: Dict[str, Any],
+    headers: Dict[str, str],
+    endpoint: str,
+    client: httpx.AsyncClient | None = None,
+) -> AsyncIterator[str]:
+    """
+    Streams a completion from the first model that starts answering.
+
+    Models are tried in scoreboard order until one produces a first token within
+    LLM_ATTEMPT_TIMEOUT. Once tokens have been yielded we stay with that model: if
+    it fails mid-stream the partial answer is kept rather than restarted elsewhere.
+    """
+    client = client or http_client.get_http_client("openrouter")
+    deadline = time.monotonic() + config.LLM_OVERALL_TIMEOUT
+
+    ordered_models = scoreboard.order(models)
+    last_resort = not ordered_models
+    if last_resort:
+        # Every model is cooling down or open: try the one that recovers first instead of failing outright
+        ordered_models = [scoreboard.fallback(models)]
+
+    for model in ordered_models:
+        if not scoreboard.acquire(model, last_resort):
+            continue
+        started = time.perf_counter()
+        deltas = stream_model(client, model, payload_base, headers, endpoint)
+        received = False
+        outcome = "closed"  # The consumer stopped reading before the stream ended
+        try:
+            while True:
+                wait = config.LLM_STREAM_IDLE_TIMEOUT if received else config.LLM_ATTEMPT_TIMEOUT
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise asyncio.TimeoutError
+                try:
+                    delta = await asyncio.wait_for(anext(deltas), wait)
+                except StopAsyncIteration:
+                    break
+                received = True
+                yield delta
+        except GeneratorExit:
+            # The consumer closed us at `yield`, e.g. its answer was cancelled mid-edit
+            scoreboard.release(model)
+            raise
+        except asyncio.CancelledError:
+            scoreboard.release(model)
+            outcome = "cancelled"
+            raise
+        except httpx.HTTPStatusError as e:
+            logger.warning(f"Model {model} failed with status {e.response.status_code}: {e.response.text}")
+            scoreboard.record_failure(model, e.response.status_code, retry_after(e.response))
+            outcome = f"http_{e.response.status_code}"
+        except asyncio.TimeoutError:
+            logger.warning(f"Model {model} stream stalled")
+            scoreboard.record_failure(model)
+            outcome = "timeout"
+        except Exception as e:
+            logger.error(f"An unexpected error occurred while streaming model {model}: {e}", exc_info=True)
+            scoreboard.record_failure(model)
+            outcome = "error"
+        else:
+            if received:
+                scoreboard.record_success(model, time.perf_counter() - started)
+                outcome = "success"
+            else:
+                logger.warning(f"Model {model} returned an empty stream")
+                scoreboard.record_failure(model)
+                outcome = "empty"
+        finally:
+            await deltas.aclose()
+            observe_model_attempt(model, "stream", outcome, time.perf_counter() - started)
+
+        if received or time.monotonic() >= deadline:
+            return
+
+    logger.error("All available models failed to stream a response.")
+
+
+def _split_point(text: str, limit: int) -> int:
+    """Finds where to cut text to fit in one message, preferring a line or word boundary."""
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut != -1:
+            return cut + 1
+    return limit
+
+
+def retry_seconds(error: RetryAfter) -> float:
+    if isinstance(error.retry_after, timedelta):
+        return error.retry_after.total_seconds()
+    return float(error.retry_after)
+
+
+class StreamingReply:
+    """
+    Progressively edits a placeholder message as tokens arrive.
+
+    Tokens are coalesced in a buffer and applied with at most one edit per chat every
+    TELEGRAM_EDIT_INTERVAL seconds. When the text outgrows Telegram's 4096 character
+    limit the current message is finalised and the rest continues in a new message; the
+    sends of those messages are appended to `continuations` if it is given.
+    """
+
+    def __init__(self, message: Message, continuations: List[asyncio.Future] | None = None):
+        self._message = message
+        self._continuations = continuations
+        self._chat_id = message.chat_id
+        self._text = ""
+        # Start of the text shown in the current message, and what it currently shows
+        self._offset = 0
+        self._shown = message.text or ""
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def append(self, delta: str):
+        self._text += delta
+        if time.monotonic() - _last_edit.get(self._chat_id, 0.0) >= config.TELEGRAM_EDIT_INTERVAL:
+            await self._flush()
+
+    async def finish(self) -> str:
+        """Applies any buffered text and returns the complete reply."""
+        if not self._text:
+            return self._text
+        for _ in range(config.TELEGRAM_EDIT_RETRIES):
+            wait = _last_edit.get(self._chat_id, 0.0) + config.TELEGRAM_EDIT_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if await self._flush():
+                break
+        _prune_last_edit()
+        return self._text
+
+    async def _flush(self) -> bool:
+        """Shows the buffered text. Returns False if Telegram asked us to back off."""
+        while True:
+            pending = self._text[self._offset:]
+            cut = _split_point(pending, MAX_MESSAGE_LENGTH)
+            if not await self._edit(pending[:cut]):
+                return False
+            if cut == len(pending):
+                return True
+            # The current message is full: continue in a new one
+            self._offset += cut
+            rest = self._text[self._offset:]
+            self._shown = rest[:_split_point(rest, MAX_MESSAGE_LENGTH)]
+            send = asyncio.ensure_future(self._message.get_bot().send_message(chat_id=self._chat_id, text=self._shown))
+            if self._continuations is not None:
+                self._continuations.append(send)
+            # Shielded, so a cancelled answer still records the message it started
+            self._message = await asyncio.shield(send)
+            _last_edit[self._chat_id] = time.monotonic()
+
+    async def _edit(self, text: str) -> bool:
+        if not text.strip() or text == self._shown:
+            return True
+        try:
+            with span("telegram_edit"):
+                await self._message.edit_text(text)
+            self._shown = text
+        except RetryAfter as e:
+            # Back off this chat; the buffered text goes out with the next edit
+            _last_edit[self._chat_id] = time.monotonic() + retry_seconds(e)
+            return False
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        _last_edit[self._chat_id] = time.monotonic()
+        return True
+
+
+def _prune_last_edit():
+    """Forgets chats whose last edit is old enough not to matter for throttling."""
+    if len(_last_edit) < 1000:
+        return
+    cutoff = time.monotonic() - config.TELEGRAM_EDIT_INTERVAL
+    for chat_id in [chat_id for chat_id, at in _last_edit.items() if at < cutoff]:
+        del _last_edit[chat_id]
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from src import config
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> int:
+    """Returns the id that defines ordering for an update: its chat, user, or itself."""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """
+    Bounded in-process queue that decouples the webhook response from update processing.
+
+    Updates are sharded over UPDATE_WORKERS workers by chat, so updates from one chat
+    are handled in order while different chats run in parallel. When a shard is full
+    the update is shed and the caller can ask Telegram to redeliver it later.
+    """
+
+    def __init__(self):
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._application: Application | None = None
+        self.stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "shed": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "processing_total": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self, application: Application):
+        if self.running:
+            return
+        self._application = application
+        shard_size = max(1, config.UPDATE_QUEUE_SIZE // config.UPDATE_WORKERS)
+        self._queues = [asyncio.Queue(maxsize=shard_size) for _ in range(config.UPDATE_WORKERS)]
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def stop(self):
+        """Lets the workers finish what is queued (up to UPDATE_DRAIN_TIMEOUT), then stops them."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), config.UPDATE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.depth()} queued updates at shutdown")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+
+    def submit(self, update: Update) -> bool:
+        """Queues an update. Returns False if it was shed because its shard is full."""
+        queue = self._queues[hash(chat_key(update)) % len(self._queues)]
+        try:
+            queue.put_nowait((time.perf_counter(), update))
+        except asyncio.QueueFull:
+            self.stats["shed"] += 1
+            logger.warning(f"Update queue full, shedding update {update.update_id}")
+            return False
+        self.stats["enqueued"] += 1
+        return True
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            item: Tuple[float, Update] = await queue.get()
+            enqueued_at, update = item
+            started = time.perf_counter()
+            wait = started - enqueued_at
+            self.stats["queue_wait_total"] += wait
+            self.stats["queue_wait_max"] = max(self.stats["queue_wait_max"], wait)
+            try:
+                await self._application.process_update(update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Error processing update {update.update_id}: {e}", exc_info=True)
+            finally:
+                self.stats["processing_total"] += time.perf_counter() - started
+                queue.task_done()
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def snapshot(self) -> Dict[str, Any]:
+        done = self.stats["processed"] + self.stats["failed"]
+        return {
+            "running": self.running,
+            "workers": len(self._workers),
+            "depth": self.depth(),
+            "max_shard_depth": max((queue.qsize() for queue in self._queues), default=0),
+            "enqueued": self.stats["enqueued"],
+            "processed": self.stats["processed"],
+            "failed": self.stats["failed"],
+            "shed": self.stats["shed"],
+            "queue_wait_avg_ms": round(self.stats["queue_wait_total"] / done * 1000, 2) if done else 0.0,
+            "queue_wait_max_ms": round(self.stats["queue_wait_max"] * 1000, 2),
+            "processing_avg_ms": round(self.stats["processing_total"] / done * 1000, 2) if done else 0.0,
+        }
+
+
+update_queue = UpdateQueue()
@@ -1,9 +1,11 @@
 import base64
-from typing import List
-import random
-import httpx
 import logging
-from typing import Dict, Any, List
+from typing import TYPE_CHECKING, Dict, Any, List
+from src import config
+
+if TYPE_CHECKING:
+    import httpx
+    from src.bot import model_strategy
 
 logger = logging.getLogger(__name__)
 
@@ -27,48 +29,69 @@ async def try_models(
     payload_base: Dict[str, Any],
     headers: Dict[str, str],
     endpoint: str,
-    timeout: int = 60,
+    timeout: float | None = None,
+    client: "httpx.AsyncClient | None" = None,
+    strategy: str | None = None,
+    overall_timeout: float | None = None,
+    body: "model_strategy.BodyEncoder | None" = None,
 ) -> str | None:
     """
-    Tries a list of models in random order to get a response.
+    Tries a list of models, fastest expected first, to get a response.
 
     Args:
         models: A list of model names to try.
         payload_base: The base payload for the API request.
         headers: The request headers.
         endpoint: The API endpoint URL.
-        timeout: The request timeout in seconds.
+        timeout: The per-attempt deadline in seconds. Defaults to LLM_ATTEMPT_TIMEOUT.
+        client: The HTTP client to use. Defaults to the shared OpenRouter client.
+        strategy: "sequential", "hedged" or "race". Defaults to LLM_STRATEGY.
+        overall_timeout: The deadline for the whole call in seconds. Defaults to LLM_OVERALL_TIMEOUT.
+        body: Streams the request body instead of sending the payload as JSON, e.g. for images.
 
     Returns:
         The response content as a string on success, or None if all models fail.
     """
-    shuffled_models = random.sample(models, len(models))
-    logger.info(f"Attempting models in order: {shuffled_models}")
+    # Imported here so that src.config, which needs the parsers below, stays cheap to import
+    from src.bot import http_client, model_router, model_strategy
+
+    # Healthy models sorted by expected latency; rate-limited or broken ones are skipped
+    ordered_models = model_router.scoreboard.order(models)
+    last_resort = not ordered_models
+    if last_resort:
+        # Every model is cooling down or open: try the one that recovers first instead of failing outright
+        ordered_models = [model_router.scoreboard.fallback(models)]
+    strategy = strategy or config.LLM_STRATEGY
+    logger.info(f"Attempting models ({strategy}) in order: {ordered_models}")
+
+    client = client or http_client.get_http_client("openrouter")
 
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        for model in shuffled_models:
-            payload = payload_base.copy()
-            payload["model"] = model
-            try:
-                logger.info(f"Trying model: {model}")
-                response = await client.post(endpoint, headers=headers, json=payload)
-                response.raise_for_status()
-                response_data = response.json()
-                # Add a check for expected structure before accessing keys
-                if (
-                    "choices" in response_data
-                    and response_data["choices"]
-                    and "message" in response_data["choices"][0]
-                    and "content" in response_data["choices"][0]["message"]
-                ):
-                    return response_data["choices"][0]["message"]["content"]
-                else:
-                    logger.warning(f"Model {model} returned an unexpected response structure: {response_data}")
-                    continue # Try next model
-            except httpx.HTTPStatusError as e:
-                logger.warning(f"Model {model} failed with status {e.response.status_code}: {e.response.text}")
-            except Exception as e:
-                logger.error(f"An unexpected error occurred with model {model}: {e}", exc_info=True)
+    async def attempt(model: str) -> str | None:
+        return await model_strategy.call_model(client, model, payload_base, headers, endpoint, body, last_resort)
 
-    logger.error("All available models failed to respond.")
-    return None
+    result = await model_strategy.run_strategy(
+        strategy,
+        ordered_models,
+        attempt,
+        attempt_timeout=timeout or config.LLM_ATTEMPT_TIMEOUT,
+        overall_timeout=overall_timeout or config.LLM_OVERALL_TIMEOUT,
+    )
+    if result is None:
+        logger.error("All available models failed to respond.")
+    return result
+
+def get_int_mapping(mapping: str | None) -> Dict[str, int]:
+    """
+    Parses a comma-separated "name=number" list, e.g. per-model token budgets.
+    Entries that cannot be parsed are skipped with a warning.
+    """
+    values: Dict[str, int] = {}
+    if not mapping:
+        return values
+    for entry in mapping.split(","):
+        name, _, number = entry.partition("=")
+        try:
+            values[name.strip()] = int(number)
+        except ValueError:
+            logger.warning(f"Ignoring invalid mapping entry: '{entry}'")
+    return values
@@ -0,0 +1,91 @@
+"""
+Decoding and pre-dispatch filtering of webhook bodies.
+
+The body is parsed with orjson when it is installed (pip install ".[fast]"), and updates
+no handler acts on are recognised from the raw dict and acknowledged before
+Update.de_json builds an object graph for them. Imports nothing heavy, so src.main can
+use it before the bot has been loaded.
+"""
+import json
+from typing import Any, Dict
+
+from starlette.responses import Response
+
+from src.config import WEBHOOK_UPDATE_TYPES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(body: bytes) -> Any:
+    """Parses a JSON body. Invalid JSON raises ValueError with either parser."""
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+OK_BODY = dumps({"ok": True})
+
+
+def json_response(value: Any = None, status_code: int = 200) -> Response:
+    """A JSON response without FastAPI's encoder pass; the common {"ok": true} is pre-encoded."""
+    body = OK_BODY if value is None else dumps(value)
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+def update_type(update_dict: Dict[str, Any]) -> str:
+    """The kind of update, i.e. its one key besides update_id, e.g. "message" or "edited_message"."""
+    for key in update_dict:
+        if key != "update_id":
+            return key
+    return "empty"
+
+
+def command_of(message: Dict[str, Any]) -> str | None:
+    """The command a message starts with, without the slash, e.g. "search" or "removebg@somebot"."""
+    text = message.get("text") or message.get("caption") or ""
+    if not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:]
+
+
+class WebhookFilter:
+    """Decides from the raw dict whether an update can reach a handler, and counts what it drops."""
+
+    def __init__(self):
+        self.accepted = 0
+        self.dropped: Dict[str, int] = {}
+
+    def _drop(self, reason: str) -> bool:
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        return True
+
+    def drop(self, update_dict: Dict[str, Any], bot_username: str | None = None) -> bool:
+        kind = update_type(update_dict)
+        if kind not in WEBHOOK_UPDATE_TYPES:
+            return self._drop(kind)
+        message = update_dict[kind]
+        if not isinstance(message, dict):
+            return self._drop(kind)
+        # Every message handler wants text (commands included) or a photo
+        if "text" not in message and "photo" not in message:
+            return self._drop(f"{kind}_other")
+        command = command_of(message)
+        if command and bot_username and "@" in command:
+            # "/start@otherbot" in a group is meant for another bot
+            if command.partition("@")[2].lower() != bot_username.lower():
+                return self._drop("other_bot_command")
+        self.accepted += 1
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"accepted": self.accepted, "dropped": self.dropped, "parser": "orjson" if orjson else "json"}
+
+
+webhook_filter = WebhookFilter()
@@ -1,6 +1,7 @@
 from dotenv import load_dotenv
 import os
-from src.bot.utils import get_model_list
+import tempfile
+from src.bot.utils import get_model_list, get_int_mapping
 
 # Load variables from .env file
 load_dotenv()
@@ -12,22 +13,258 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_API_ENDPOINT = os.getenv("OPENROUTER_API_ENDPOINT", "https://openrouter.ai/api/v1/chat/completions")
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 RBG_API_KEY = os.getenv("API_KEY")
+RBG_API_BASE = os.getenv("RBG_API_BASE")
+# Bot API server; point at a local Bot API server (or a fake one for benchmarks) if needed
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
 
 DB_URI = os.getenv("DB_URI", "mongodb://localhost:27017")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+
+# Prometheus metrics on /metrics, event-loop lag sampling and optional OTLP trace export
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_LAG_INTERVAL = float(os.getenv("METRICS_LAG_INTERVAL", "0.5"))
+# Threads for asyncio.to_thread (0 keeps Python's default of min(32, cpus + 4))
+THREAD_POOL_WORKERS = int(os.getenv("THREAD_POOL_WORKERS", "0"))
+OTEL_EXPORT_ENABLED = os.getenv("OTEL_EXPORT_ENABLED", "false").lower() == "true"
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "burmacodebot")
+# With several workers each keeps its own counters; prometheus_client aggregates them from
+# files in this directory (empty it before starting the server). prometheus_client reads
+# it from the environment when first imported, which is after .env is loaded here
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Multi-process deployment. WEB_CONCURRENCY is the worker count gunicorn/uvicorn run with;
+# with several workers, state that must agree between them (dedup, rate limits, response
+# cache, conversation state) defaults to MongoDB instead of per-process memory.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "mongo" if WEB_CONCURRENCY > 1 else "memory").lower()
+# Chat-affinity router (src/router.py): worker base URLs that updates are spread over by chat
+ROUTER_WORKER_URLS = [url.strip().rstrip("/") for url in os.getenv("ROUTER_WORKER_URLS", "").split(",") if url.strip()]
+ROUTER_TIMEOUT = float(os.getenv("ROUTER_TIMEOUT", "10"))
+
+# Write-behind batching of chat history inserts and user upserts
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "true").lower() == "true"
+WRITE_BUFFER_FLUSH_SIZE = int(os.getenv("WRITE_BUFFER_FLUSH_SIZE", "100"))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv("WRITE_BUFFER_FLUSH_INTERVAL", "1.0"))
+WRITE_BUFFER_MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", "10000"))
+WRITE_BUFFER_MAX_RETRIES = int(os.getenv("WRITE_BUFFER_MAX_RETRIES", "3"))
+
+# In-memory cache of each user's recent turns in front of get_user_history. Off by default
+# with several workers, where another worker may have appended turns this one has not seen.
+HISTORY_CACHE_ENABLED = os.getenv("HISTORY_CACHE_ENABLED", str(WEB_CONCURRENCY == 1)).lower() == "true"
+HISTORY_CACHE_TURNS = int(os.getenv("HISTORY_CACHE_TURNS", "20"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "1800"))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Fraction of cache hits checked against MongoDB (0 disables the correctness mode)
+HISTORY_CACHE_VERIFY_RATE = float(os.getenv("HISTORY_CACHE_VERIFY_RATE", "0"))
+
+# Chat history storage. "flat" keeps one document per turn; "bucketed" packs up to
+# HISTORY_BUCKET_SIZE turns per document, so a conversation is read from a few documents.
+HISTORY_SCHEMA = os.getenv("HISTORY_SCHEMA", "flat").lower()
+HISTORY_BUCKET_SIZE = int(os.getenv("HISTORY_BUCKET_SIZE", "50"))
+# Retention: turns older than HISTORY_TTL seconds expire (0 keeps them), and users who
+# wrote recently are compacted every HISTORY_COMPACTION_INTERVAL seconds: older turns are
+# rolled into their summary and only the newest HISTORY_MAX_TURNS are kept (0 disables).
+HISTORY_TTL = float(os.getenv("HISTORY_TTL", "0"))
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "200"))
+HISTORY_COMPACTION_INTERVAL = float(os.getenv("HISTORY_COMPACTION_INTERVAL", "600"))
+
+# Start serving (health checks answer) before the bot is up; the first webhooks wait for it.
+# Useful on hosts that scale to zero or kill instances that are slow to bind their port.
+FAST_START = os.getenv("FAST_START", "false").lower() == "true"
+
+# "queue" acknowledges webhooks immediately and processes updates on a worker pool;
+# "inline" processes each update before responding to Telegram
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "queue").lower()
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1024"))
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "30"))
+# Update types any handler acts on. Others (edited messages, channel posts, member updates)
+# are acknowledged straight from the raw JSON, as are messages without text or a photo.
+WEBHOOK_UPDATE_TYPES = {name.strip() for name in os.getenv("WEBHOOK_UPDATE_TYPES", "message").split(",") if name.strip()}
+
+# Drop redelivered webhook updates. "memory" is per process; "mongo" shares the
+# view between replicas through a collection with a TTL index.
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", SHARED_STATE_BACKEND).lower()
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "3600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+
+# Token-bucket admission control: (burst capacity, refill tokens per second)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory" keeps buckets per process; "mongo" shares them between workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", SHARED_STATE_BACKEND).lower()
+RATE_LIMIT_USER = (
+    float(os.getenv("RATE_LIMIT_USER_BURST", "6")),
+    float(os.getenv("RATE_LIMIT_USER_RATE", "0.2")),
+)
+RATE_LIMIT_CHAT = (
+    float(os.getenv("RATE_LIMIT_CHAT_BURST", "10")),
+    float(os.getenv("RATE_LIMIT_CHAT_RATE", "0.5")),
+)
+RATE_LIMIT_UPSTREAMS = {
+    "openrouter": (
+        float(os.getenv("RATE_LIMIT_OPENROUTER_BURST", "20")),
+        float(os.getenv("RATE_LIMIT_OPENROUTER_RATE", "2")),
+    ),
+    "removebg": (
+        float(os.getenv("RATE_LIMIT_REMOVEBG_BURST", "5")),
+        float(os.getenv("RATE_LIMIT_REMOVEBG_RATE", "0.1")),
+    ),
+}
+# Tokens each kind of request costs, e.g. "text=1,search=2,photo=2,removebg=3". "summary"
+# is charged per LLM call that rolls older turns into a user's summary.
+RATE_LIMIT_COSTS = {
+    "text": 1, "search": 2, "photo": 2, "removebg": 3, "summary": 1,
+    **get_int_mapping(os.getenv("RATE_LIMIT_COSTS")),
+}
+# Requests that would be admitted within this many seconds wait instead of being rejected
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+# A request queued at least this many seconds gets a short notice first
+RATE_LIMIT_NOTIFY_AFTER = float(os.getenv("RATE_LIMIT_NOTIFY_AFTER", "1"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Cache of /search answers and standalone prompts. "memory" or "mongo" (adds a shared tier)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", SHARED_STATE_BACKEND).lower()
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+# Cache of image work keyed by Telegram file_unique_id and content hash
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "burmacodebot-images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "10000"))
+
+# Conversation state for /search and photos: "memory" (per process) or "mongo" (shared)
+STATE_BACKEND = os.getenv("STATE_BACKEND", SHARED_STATE_BACKEND).lower()
+STATE_MAX_TURNS = int(os.getenv("STATE_MAX_TURNS", "20"))
+STATE_MAX_KEY_BYTES = int(os.getenv("STATE_MAX_KEY_BYTES", str(64 * 1024)))
+STATE_MAX_BYTES = int(os.getenv("STATE_MAX_BYTES", str(32 * 1024 * 1024)))
+STATE_TTL = float(os.getenv("STATE_TTL", str(7 * 24 * 3600)))
+
+# Image pipeline: the smallest photo size whose longer side reaches the target is downloaded
+IMAGE_TARGET_SIZES = {
+    "vision": 768, "removebg": 1280,
+    **get_int_mapping(os.getenv("IMAGE_TARGET_SIZES")),
+}
+# Image jobs run on their own bounded pool so photo bursts cannot starve text chats
+IMAGE_JOB_CONCURRENCY = int(os.getenv("IMAGE_JOB_CONCURRENCY", "4"))
+IMAGE_JOB_MAX_PENDING = int(os.getenv("IMAGE_JOB_MAX_PENDING", "32"))
+# Bytes of image base64 encoded per chunk of a streamed request body
+IMAGE_ENCODE_CHUNK = int(os.getenv("IMAGE_ENCODE_CHUNK", str(48 * 1024)))
+
+# Outbound HTTP connection pools, one per upstream host
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+# Per-upstream overrides of the two limits above ("openrouter=40,removebg=4"). remove.bg
+# calls are few and heavy, so by default they get a smaller pool than chat traffic.
+HTTP_UPSTREAM_MAX_CONNECTIONS = {
+    "removebg": 5,
+    **get_int_mapping(os.getenv("HTTP_UPSTREAM_MAX_CONNECTIONS")),
+}
+HTTP_UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = {
+    "removebg": 2,
+    **get_int_mapping(os.getenv("HTTP_UPSTREAM_MAX_KEEPALIVE_CONNECTIONS")),
+}
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
 
 
 headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json"
     }
-# Validate and parse the model list
-LLM_MODELS = get_model_list(os.getenv("LLM_MODELS"))
+# Parse the model list; an empty one is reported by check_required()
+LLM_MODELS = get_model_list(os.getenv("LLM_MODELS")) if os.getenv("LLM_MODELS") else []
+# Models that accept image input, tried in order of expected latency for photos
+VISION_MODELS = get_model_list(os.getenv("VISION_MODELS", "mistralai/mistral-small-3.2-24b-instruct:free"))
 # Add more as needed
 
+# Prompt token budget for chat history, with optional per-model overrides ("model=tokens,...")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+MODEL_CONTEXT_BUDGETS = get_int_mapping(os.getenv("MODEL_CONTEXT_BUDGETS"))
+# Recent turns considered for the prompt; older ones are rolled into a stored summary
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "20"))
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "10"))
+CONTEXT_SUMMARY_MIN_TURNS = int(os.getenv("CONTEXT_SUMMARY_MIN_TURNS", "6"))
+# The history cache holds at least a prompt's worth of turns, or every read would miss it
+HISTORY_CACHE_TURNS = max(HISTORY_CACHE_TURNS, CONTEXT_MAX_TURNS)
+
+# How try_models spreads a request over LLM_MODELS: "sequential", "hedged" or "race"
+LLM_STRATEGY = os.getenv("LLM_STRATEGY", "sequential").lower()
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "60"))
+LLM_OVERALL_TIMEOUT = float(os.getenv("LLM_OVERALL_TIMEOUT", "120"))
+# Hedged mode waits for the observed p95 latency (clamped) before starting the next model
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "8"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "30"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Race mode starts this many models at once
+LLM_RACE_FANOUT = int(os.getenv("LLM_RACE_FANOUT", "3"))
+
+# Stream LLM replies into progressive Telegram message edits
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "30"))
+# Telegram allows roughly one message edit per chat per second
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_EDIT_RETRIES = int(os.getenv("TELEGRAM_EDIT_RETRIES", "3"))
+
+# Per-chat coalescing of text messages. Messages a user sends within COALESCE_WINDOW
+# seconds of each other are answered with one LLM request; with COALESCE_CANCEL, a message
+# arriving while a reply is being generated cancels it and both are answered together.
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0.5"))
+COALESCE_CANCEL = os.getenv("COALESCE_CANCEL", "true").lower() == "true"
+
+# Outbound Telegram send scheduler: (burst capacity, messages per second). Telegram allows
+# about 30 messages/s per bot, split here between worker processes, about 1/s per private
+# chat and 20/min per group.
+SEND_SCHEDULER_ENABLED = os.getenv("SEND_SCHEDULER_ENABLED", "true").lower() == "true"
+SEND_RATE_GLOBAL = (
+    float(os.getenv("SEND_GLOBAL_BURST", "30")),
+    float(os.getenv("SEND_GLOBAL_RATE", str(30 / WEB_CONCURRENCY))),
+)
+SEND_RATE_CHAT = (
+    float(os.getenv("SEND_CHAT_BURST", "3")),
+    float(os.getenv("SEND_CHAT_RATE", "1")),
+)
+SEND_RATE_GROUP = (
+    float(os.getenv("SEND_GROUP_BURST", "5")),
+    float(os.getenv("SEND_GROUP_RATE", str(20 / 60))),
+)
+# Times a request is retried after Telegram answers with retry_after
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+# Requests given up on if Telegram asks to wait longer than this many seconds
+SEND_MAX_RETRY_AFTER = float(os.getenv("SEND_MAX_RETRY_AFTER", "60"))
+
+# Broadcasts to every active user (/broadcast for ADMIN_USER_IDS, or python -m src.bot.broadcast).
+# Sends go through the scheduler's bulk lane, so interactive replies keep priority.
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "30"))
+# Seconds between progress reports, which also save the resume checkpoint
+BROADCAST_REPORT_INTERVAL = float(os.getenv("BROADCAST_REPORT_INTERVAL", "5"))
+
+# Model health scoreboard and circuit breakers
+MODEL_EWMA_ALPHA = float(os.getenv("MODEL_EWMA_ALPHA", "0.3"))
+MODEL_DEFAULT_LATENCY = float(os.getenv("MODEL_DEFAULT_LATENCY", "5"))
+MODEL_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "3"))
+MODEL_BREAKER_OPEN_SECONDS = float(os.getenv("MODEL_BREAKER_OPEN_SECONDS", "30"))
+MODEL_RATE_LIMIT_COOLDOWN = float(os.getenv("MODEL_RATE_LIMIT_COOLDOWN", "60"))
+
 REQUIRED_VARS = {
     "BOT_TOKEN": BOT_TOKEN,
     "WEBHOOK_URL": WEBHOOK_URL,
     "OPENROUTER_API_KEY": OPENROUTER_API_KEY,
+    "LLM_MODELS": LLM_MODELS,
 }
 GLOBAL_INSTRUCTION = '''
 You are a helpful telegram bot assistant, named \"Burmacodebot\" who can help on identifying images, removing background, and searching the web. 
@@ -44,6 +281,13 @@ SYSTEM_MESSAGE = {
     "content": [{"type": "text", "text": GLOBAL_INSTRUCTION}]
 }
 
-for var_name, var_value in REQUIRED_VARS.items():
-    if not var_value:
-        raise ValueError(f"Required environment variable '{var_name}' is not set.")
\ No newline at end of file
+
+def check_required():
+    """
+    Raises if a setting the bot cannot run without is missing. Called when the bot
+    starts rather than on import, so src.main can answer health checks (with the error)
+    whatever the environment holds.
+    """
+    for var_name, var_value in REQUIRED_VARS.items():
+        if not var_value:
+            raise ValueError(f"Required environment variable '{var_name}' is not set.")
\ No newline at end of file
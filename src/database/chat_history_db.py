@@ -1,47 +1,154 @@
 import logging
-from datetime import datetime, timezone
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+from src.config import HISTORY_CACHE_VERIFY_RATE
+from src.bot.metrics import span
 from .db import get_db_client
+from .history_cache import history_cache
+from .history_store import history_store
+from .write_buffer import write_buffer
 
 logger = logging.getLogger(__name__)
 
-def add_message_to_history(user_id: int, role: str, content: str):
+def stored_timestamp(moment: datetime) -> datetime:
+    """A timestamp as MongoDB returns it: naive UTC, to the millisecond."""
+    moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.replace(microsecond=moment.microsecond // 1000 * 1000)
+
+def _cached_turn(document) -> dict:
+    return {"role": document["role"], "content": document["content"], "timestamp": stored_timestamp(document["timestamp"])}
+
+async def add_message_to_history(user_id: int, role: str, content: str):
     """
     Adds a single message (from user or assistant) to the user's chat history.
+    While the write-behind buffer is running the insert is batched with others.
     """
     try:
-        client = get_db_client()
-        db = client.get_database("telegram_bot_db")
-        history_collection = db.get_collection("chat_history")
-
         message_document = {
             "user_id": user_id,
             "role": role,
             "content": content,
             "timestamp": datetime.now(timezone.utc)
         }
-        history_collection.insert_one(message_document)
+        history_cache.append(user_id, _cached_turn(message_document))
+        await history_store.insert([message_document])
     except Exception as e:
+        history_cache.invalidate(user_id)
         logger.error(f"Database error when adding chat history for user {user_id}: {e}", exc_info=True)
 
-def get_user_history(user_id: int, limit: int = 10):
+async def add_messages_to_history(user_id: int, messages: List[Tuple[str, str]]):
     """
-    Retrieves the most recent messages for a user.
-    Returns a list of message dictionaries, oldest first.
+    Adds several messages, e.g. a user turn and the assistant's reply, in one write.
+    Each message is a (role, content) tuple; timestamps keep them in the given order.
     """
     try:
-        client = get_db_client()
-        db = client.get_database("telegram_bot_db")
-        history_collection = db.get_collection("chat_history")
+        now = datetime.now(timezone.utc)
+        # MongoDB stores milliseconds, so space the turns out by 1 ms to keep them ordered
+        message_documents = [
+            {
+                "user_id": user_id,
+                "role": role,
+                "content": content,
+                "timestamp": now + timedelta(milliseconds=index)
+            }
+            for index, (role, content) in enumerate(messages)
+        ]
+        for message_document in message_documents:
+            history_cache.append(user_id, _cached_turn(message_document))
+        await history_store.insert(message_documents)
+    except Exception as e:
+        history_cache.invalidate(user_id)
+        logger.error(f"Database error when adding chat history for user {user_id}: {e}", exc_info=True)
 
-        # Find messages for the user, sort by timestamp descending, and limit results
-        messages_cursor = history_collection.find(
-            {"user_id": user_id}
-        ).sort("timestamp", -1).limit(limit)
+async def _fetch_user_history(user_id: int, limit: int):
+    # The newest `limit` turns in chronological order, with only role, content and timestamp read
+    with span("history_fetch"):
+        return await history_store.recent(user_id, limit)
 
-        # The messages are newest-first, so we reverse them to get chronological order
-        messages = list(messages_cursor)
-        return [{"role": msg["role"], "content": msg["content"]} for msg in reversed(messages)]
+async def _verify_cached_history(user_id: int, cached: list):
+    """Correctness mode: compares a cache hit with what MongoDB holds."""
+    # Buffered writes are already in the cache, so push them to MongoDB first
+    await write_buffer.flush()
+    stored = await _fetch_user_history(user_id, len(cached))
+    history_cache.stats["verified"] += 1
+    if stored != cached:
+        history_cache.stats["mismatches"] += 1
+        history_cache.invalidate(user_id)
+        logger.warning(f"History cache mismatch for user {user_id}: cached {len(cached)} messages, stored {len(stored)}")
+
+async def get_user_history(user_id: int, limit: int = 10):
+    """
+    Retrieves the most recent messages for a user.
+    Returns a list of message dictionaries (role, content and timestamp), oldest first.
+    Active conversations are served from the in-memory history cache.
+    """
+    try:
+        cached = history_cache.get(user_id, limit)
+        if cached is not None:
+            if HISTORY_CACHE_VERIFY_RATE and random.random() < HISTORY_CACHE_VERIFY_RATE:
+                await _verify_cached_history(user_id, cached)
+            return cached
+
+        # The entry is appended to from now on, so it must start with every turn written so far
+        await history_store.settle(user_id)
+        # Read a full ring buffer's worth so later calls can be served from the cache
+        messages = await _fetch_user_history(user_id, max(limit, history_cache.capacity))
+        history_cache.fill(user_id, messages)
+        return messages[-limit:] if limit else []
 
     except Exception as e:
         logger.error(f"Database error when retrieving chat history for user {user_id}: {e}", exc_info=True)
-        return []
\ No newline at end of file
+        return []
+
+async def get_turns_to_summarize(user_id: int, after: datetime | None, keep: int, limit: int = 50):
+    """
+    Returns the oldest `limit` of the user's messages newer than `after`, oldest first,
+    leaving out the latest `keep` messages which stay in the prompt verbatim.
+    Each message includes its timestamp so the summary can record what it covers.
+    """
+    try:
+        return await history_store.turns_after(user_id, after, keep, limit)
+    except Exception as e:
+        logger.error(f"Database error when reading turns to summarize for user {user_id}: {e}", exc_info=True)
+        return []
+
+async def load_user_summary(user_id: int):
+    """
+    Returns the stored summary document of the user's older turns, or None if there is
+    none. Database errors are raised, for callers that must not mistake them for no summary.
+    """
+    found, summary = history_cache.get_summary(user_id)
+    if found:
+        return summary
+    client = get_db_client()
+    db = client.get_database("telegram_bot_db")
+    summary = await db.get_collection("chat_summaries").find_one({"_id": user_id})
+    history_cache.set_summary(user_id, summary)
+    return summary
+
+async def get_user_summary(user_id: int):
+    """
+    Returns the stored summary document of the user's older turns, or None.
+    """
+    try:
+        return await load_user_summary(user_id)
+    except Exception as e:
+        logger.error(f"Database error when retrieving summary for user {user_id}: {e}", exc_info=True)
+        return None
+
+async def save_user_summary(user_id: int, summary: str, covered_until: datetime):
+    """
+    Stores the summary of the user's turns up to and including `covered_until`.
+    Returns the stored document, or None if it could not be saved.
+    """
+    document = {"_id": user_id, "summary": summary, "covered_until": covered_until}
+    try:
+        client = get_db_client()
+        db = client.get_database("telegram_bot_db")
+        await db.get_collection("chat_summaries").replace_one({"_id": user_id}, document, upsert=True)
+        history_cache.set_summary(user_id, document)
+        return document
+    except Exception as e:
+        logger.error(f"Database error when saving summary for user {user_id}: {e}", exc_info=True)
+        return None
@@ -1,44 +1,83 @@
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from src.config import DB_URI
-import pymongo
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+from src.config import (
+    DB_URI,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
 
-# Create a single, global client instance.
-# This is thread-safe and manages a connection pool internally.
-_client = MongoClient(DB_URI, server_api=ServerApi('1'))
+if TYPE_CHECKING:
+    from pymongo import AsyncMongoClient
+
+logger = logging.getLogger(__name__)
+
+# A single async client per process. It manages a connection pool internally and is
+# created on first use, so each worker process gets its own client after forking.
+# pymongo itself is imported on first use too, keeping it off the startup path.
+_client: "AsyncMongoClient | None" = None
 
 def get_db_client():
     """
-    Returns the shared MongoDB client instance.
+    Returns the shared MongoDB client instance, creating it on first use.
     """
+    global _client
+    if _client is None:
+        from pymongo import AsyncMongoClient
+        from pymongo.server_api import ServerApi
+
+        _client = AsyncMongoClient(
+            DB_URI,
+            server_api=ServerApi('1'),
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        )
     return _client
 
-def ensure_indexes():
+async def close_db_client():
+    """
+    Closes the shared client and its connection pool. Call on application shutdown.
+    """
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+async def ensure_indexes():
     """
     Ensures that the necessary indexes are created in the database.
-    This function is idempotent and can be safely called on application startup.
+    This function is idempotent and runs in the background once the app has started.
     """
+    # Imported here: history_store itself uses get_db_client from this module
+    from .history_store import history_store
+
     try:
-        client = get_db_client()
-        db = client.get_database("telegram_bot_db")
-        
-        # Create a compound index on the chat_history collection.
-        # This optimizes queries that filter by user_id and sort by timestamp.
-        chat_history_collection = db.get_collection("chat_history")
-        chat_history_collection.create_index([
-            ("user_id", pymongo.ASCENDING),
-            ("timestamp", pymongo.DESCENDING)
-        ])
-        print("Database indexes ensured for chat_history collection.")
+        # The (user_id, timestamp) index serves every history read, plus the TTL index
+        # when HISTORY_TTL is set, on whichever collection HISTORY_SCHEMA uses
+        await history_store.ensure_indexes()
+        logger.info(f"Database indexes ensured for {history_store.collection_name} collection.")
     except Exception as e:
-        print(f"An error occurred while ensuring database indexes: {e}")
+        logger.error(f"An error occurred while ensuring database indexes: {e}")
 
-# This block will only run when the script is executed directly
-# e.g., `python -m src.database.db`
-if __name__ == "__main__":
+async def _ping():
     try:
         client = get_db_client()
-        client.admin.command('ping')
+        await client.admin.command('ping')
         print("Pinged your deployment. You successfully connected to MongoDB!")
     except Exception as e:
-        print(f"Failed to connect to MongoDB: {e}")
\ No newline at end of file
+        print(f"Failed to connect to MongoDB: {e}")
+    finally:
+        await close_db_client()
+
+# This block will only run when the script is executed directly
+# e.g., `python -m src.database.db`
+if __name__ == "__main__":
+    asyncio.run(_ping())
@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Tuple
+
+from src.config import (
+    HISTORY_CACHE_ENABLED,
+    HISTORY_CACHE_TURNS,
+    HISTORY_CACHE_TTL,
+    HISTORY_CACHE_MAX_BYTES,
+)
+
+# Rough per-message overhead of the dict, its keys and the deque slot
+MESSAGE_OVERHEAD = 200
+
+
+def message_size(message: Dict[str, Any]) -> int:
+    """Estimates the memory a cached message (or summary document) uses."""
+    content = message.get("content", message.get("summary"))
+    if isinstance(content, str):
+        return MESSAGE_OVERHEAD + len(content)
+    return MESSAGE_OVERHEAD + len(str(content))
+
+
+# Marks a summary that has not been loaded yet (None means the user has no summary)
+_UNSET = object()
+
+
+class _Entry:
+    __slots__ = ("messages", "size", "expires_at", "summary")
+
+    def __init__(self, messages: List[Dict[str, Any]]):
+        self.messages: deque = deque(messages, maxlen=HISTORY_CACHE_TURNS)
+        self.size = sum(message_size(message) for message in self.messages)
+        self.expires_at = time.monotonic() + HISTORY_CACHE_TTL
+        self.summary: Any = _UNSET
+
+
+class HistoryCache:
+    """
+    Bounded LRU/TTL cache of each user's most recent conversation turns.
+
+    Every entry is a ring buffer holding the latest HISTORY_CACHE_TURNS messages.
+    It is filled from MongoDB on the first read, appended to in place on each write,
+    and least recently used users are evicted once HISTORY_CACHE_MAX_BYTES is exceeded.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "verified": 0, "mismatches": 0}
+
+    @property
+    def capacity(self) -> int:
+        return HISTORY_CACHE_TURNS
+
+    def get(self, user_id: int, limit: int) -> List[Dict[str, Any]] | None:
+        """Returns the latest `limit` messages, or None on a miss."""
+        if not HISTORY_CACHE_ENABLED or limit > HISTORY_CACHE_TURNS:
+            return None
+        entry = self._entries.get(user_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                self._remove(user_id)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.stats["hits"] += 1
+        messages = list(entry.messages)
+        return messages[-limit:] if limit else []
+
+    def fill(self, user_id: int, messages: List[Dict[str, Any]]):
+        """Caches the user's latest messages, oldest first, as read from MongoDB."""
+        if not HISTORY_CACHE_ENABLED:
+            return
+        self._remove(user_id)
+        entry = _Entry(messages)
+        self._entries[user_id] = entry
+        self._size += entry.size
+        self._evict()
+
+    def append(self, user_id: int, message: Dict[str, Any]):
+        """Adds a new message to a cached conversation. Users that are not cached are left alone."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        if len(entry.messages) == entry.messages.maxlen:
+            dropped = message_size(entry.messages[0])
+            entry.size -= dropped
+            self._size -= dropped
+        entry.messages.append(message)
+        added = message_size(message)
+        entry.size += added
+        self._size += added
+        entry.expires_at = time.monotonic() + HISTORY_CACHE_TTL
+        self._entries.move_to_end(user_id)
+        self._evict()
+
+    def get_summary(self, user_id: int) -> Tuple[bool, Dict[str, Any] | None]:
+        """Returns (found, summary document) for a cached user."""
+        entry = self._entries.get(user_id)
+        if entry is None or entry.summary is _UNSET:
+            return False, None
+        return True, entry.summary
+
+    def set_summary(self, user_id: int, summary: Dict[str, Any] | None):
+        """Attaches the user's summary document to their cache entry, if they have one."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        size = message_size(summary) if summary else 0
+        old_size = message_size(entry.summary) if entry.summary not in (_UNSET, None) else 0
+        entry.summary = summary
+        entry.size += size - old_size
+        self._size += size - old_size
+        self._evict()
+
+    def invalidate(self, user_id: int):
+        self._remove(user_id)
+
+    def _remove(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self):
+        while self._size > HISTORY_CACHE_MAX_BYTES and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "users": len(self._entries),
+            "bytes": self._size,
+        }
+
+
+history_cache = HistoryCache()
@@ -0,0 +1,272 @@
+import logging
+import math
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List
+
+from pymongo.errors import DuplicateKeyError
+
+from src.config import HISTORY_SCHEMA, HISTORY_BUCKET_SIZE, HISTORY_TTL
+from .db import get_db_client
+from .write_buffer import write_buffer
+
+logger = logging.getLogger(__name__)
+
+
+def _turn(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {"role": document["role"], "content": document["content"], "timestamp": document["timestamp"]}
+
+
+class _HistoryStore:
+    collection_name = ""
+
+    def __init__(self):
+        # Users with new turns since the last compaction pass
+        self._written: set = set()
+
+    def _collection(self):
+        return get_db_client().get_database("telegram_bot_db").get_collection(self.collection_name)
+
+    @property
+    def pending_compaction(self) -> int:
+        return len(self._written)
+
+    def take_written(self) -> set:
+        written, self._written = self._written, set()
+        return written
+
+    def mark_written(self, user_id: int):
+        """Queues a user for the next compaction pass again."""
+        self._written.add(user_id)
+
+    async def settle(self, user_id: int):
+        """Makes sure reads see every turn of the user written so far."""
+
+
+class FlatHistory(_HistoryStore):
+    """
+    One document per turn in chat_history. Reads walk the (user_id, timestamp) index in
+    order and project only the fields they return.
+    """
+
+    collection_name = "chat_history"
+
+    async def ensure_indexes(self):
+        collection = self._collection()
+        await collection.create_index([("user_id", 1), ("timestamp", -1)])
+        if HISTORY_TTL:
+            await collection.create_index("timestamp", expireAfterSeconds=int(HISTORY_TTL))
+
+    async def insert(self, documents: List[Dict[str, Any]]):
+        """Stores turns, each with user_id, role, content and timestamp."""
+        self._written.update(document["user_id"] for document in documents)
+        if write_buffer.running:
+            for document in documents:
+                await write_buffer.add_insert(self.collection_name, document)
+            return
+        await self._collection().insert_many(documents)
+
+    async def settle(self, user_id: int):
+        # The user's newest turns may still sit in the write-behind buffer
+        await write_buffer.settle(self.collection_name, "user_id", user_id)
+
+    async def recent(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        """The user's latest `limit` turns, oldest first, with timestamps."""
+        cursor = self._collection().find(
+            {"user_id": user_id}, {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
+        ).sort("timestamp", -1).limit(limit)
+        documents = await cursor.to_list(length=limit)
+        return [_turn(document) for document in reversed(documents)]
+
+    async def _nth_newest(self, user_id: int, skip: int) -> datetime | None:
+        """The timestamp of the user's turn with `skip` newer turns, or None if there are not that many."""
+        # Covered by the (user_id, timestamp) index: only the timestamp is read
+        cursor = self._collection().find(
+            {"user_id": user_id}, {"_id": 0, "timestamp": 1}
+        ).sort("timestamp", -1).skip(skip).limit(1)
+        found = await cursor.to_list(length=1)
+        return found[0]["timestamp"] if found else None
+
+    async def turns_after(self, user_id: int, after: datetime | None, keep: int, limit: int) -> List[Dict[str, Any]]:
+        """The oldest `limit` turns newer than `after`, leaving out the latest `keep`, oldest first, with timestamps."""
+        window: Dict[str, Any] = {}
+        if keep:
+            oldest_kept = await self._nth_newest(user_id, keep - 1)
+            if oldest_kept is None:
+                return []
+            window["$lt"] = oldest_kept
+        if after is not None:
+            window["$gt"] = after
+        query: Dict[str, Any] = {"user_id": user_id}
+        if window:
+            query["timestamp"] = window
+        cursor = self._collection().find(
+            query, {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
+        ).sort("timestamp", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def count(self, user_id: int) -> int:
+        return await self._collection().count_documents({"user_id": user_id})
+
+    async def prune(self, user_id: int, keep: int, covered_until: datetime) -> int:
+        """
+        Deletes the user's turns up to `covered_until` (the end of their summary), except
+        the newest `keep`. Returns how many were deleted.
+        """
+        newest_dropped = await self._nth_newest(user_id, keep)
+        if newest_dropped is None:
+            return 0
+        result = await self._collection().delete_many(
+            {"user_id": user_id, "timestamp": {"$lte": min(newest_dropped, covered_until)}}
+        )
+        return result.deleted_count
+
+    async def users_over(self, turns: int) -> AsyncIterator[int]:
+        """Every user with more than `turns` stored turns (a full scan, for one-off passes)."""
+        cursor = await self._collection().aggregate([
+            {"$group": {"_id": "$user_id", "turns": {"$sum": 1}}},
+            {"$match": {"turns": {"$gt": turns}}},
+        ])
+        async for document in cursor:
+            yield document["_id"]
+
+
+class BucketedHistory(_HistoryStore):
+    """
+    Up to HISTORY_BUCKET_SIZE turns per document in chat_history_buckets:
+
+        {user_id, open, count, first_ts, last_ts, turns: [{role, content, timestamp}, ...]}
+
+    New turns are pushed into the user's open bucket while they fit. Otherwise that bucket
+    is closed and a new one inserted, so the latest turns of a user are read from one or
+    two documents. A unique partial index allows one open bucket per user: a writer that
+    loses the race to open it pushes into the winner's instead. Writes bypass the
+    write-behind buffer: one exchange is one update.
+    """
+
+    collection_name = "chat_history_buckets"
+
+    async def ensure_indexes(self):
+        collection = self._collection()
+        await collection.create_index([("user_id", 1), ("last_ts", -1)])
+        await collection.create_index(
+            "user_id", unique=True, partialFilterExpression={"open": True}, name="one_open_bucket_per_user"
+        )
+        if HISTORY_TTL:
+            # A bucket expires once its newest turn is older than the TTL
+            await collection.create_index("last_ts", expireAfterSeconds=int(HISTORY_TTL))
+
+    async def insert(self, documents: List[Dict[str, Any]]):
+        by_user: Dict[int, List[Dict[str, Any]]] = {}
+        for document in documents:
+            by_user.setdefault(document["user_id"], []).append(document)
+        self._written.update(by_user)
+        for user_id, user_documents in by_user.items():
+            turns = [
+                {"role": document["role"], "content": document["content"], "timestamp": document["timestamp"]}
+                for document in user_documents
+            ]
+            await self._append(user_id, turns)
+
+    async def _append(self, user_id: int, turns: List[Dict[str, Any]]):
+        collection = self._collection()
+        while True:
+            result = await collection.update_one(
+                {"user_id": user_id, "open": True, "count": {"$lte": HISTORY_BUCKET_SIZE - len(turns)}},
+                {
+                    "$push": {"turns": {"$each": turns}},
+                    "$inc": {"count": len(turns)},
+                    "$min": {"first_ts": turns[0]["timestamp"]},
+                    "$max": {"last_ts": turns[-1]["timestamp"]},
+                },
+            )
+            if result.matched_count:
+                return
+            # No open bucket, or the turns do not fit in it: close it and start the next one
+            await collection.update_one({"user_id": user_id, "open": True}, {"$set": {"open": False}})
+            try:
+                await collection.insert_one({
+                    "user_id": user_id,
+                    "open": True,
+                    "count": len(turns),
+                    "first_ts": turns[0]["timestamp"],
+                    "last_ts": turns[-1]["timestamp"],
+                    "turns": turns,
+                })
+                return
+            except DuplicateKeyError:
+                # Another writer opened the next bucket first; add to that one
+                continue
+
+    async def _newest_turns(self, user_id: int, query: Dict[str, Any], turns: int) -> List[Dict[str, Any]]:
+        """Turns from the newest buckets holding at least `turns` turns, newest first."""
+        buckets = math.ceil(turns / HISTORY_BUCKET_SIZE) + 1
+        cursor = self._collection().find(
+            {"user_id": user_id, **query}, {"_id": 0, "turns": 1}
+        ).sort("last_ts", -1).limit(buckets)
+        documents = await cursor.to_list(length=buckets)
+        found = [turn for document in documents for turn in document.get("turns", [])]
+        found.sort(key=lambda turn: turn["timestamp"], reverse=True)
+        return found
+
+    async def recent(self, user_id: int, limit: int) -> List[Dict[str, Any]]:
+        found = await self._newest_turns(user_id, {}, limit)
+        return [_turn(turn) for turn in reversed(found[:limit])]
+
+    async def turns_after(self, user_id: int, after: datetime | None, keep: int, limit: int) -> List[Dict[str, Any]]:
+        before = None
+        if keep:
+            newest = await self._newest_turns(user_id, {}, keep)
+            if len(newest) < keep:
+                return []
+            before = newest[keep - 1]["timestamp"]
+        query: Dict[str, Any] = {"user_id": user_id}
+        if after is not None:
+            query["last_ts"] = {"$gt": after}
+        # Oldest buckets first, until `limit` turns are found
+        cursor = self._collection().find(query, {"_id": 0, "turns": 1}).sort("last_ts", 1)
+        found: List[Dict[str, Any]] = []
+        async for bucket in cursor:
+            found.extend(
+                turn for turn in bucket.get("turns", [])
+                if (after is None or turn["timestamp"] > after) and (before is None or turn["timestamp"] < before)
+            )
+            if len(found) >= limit:
+                break
+        found.sort(key=lambda turn: turn["timestamp"])
+        return found[:limit]
+
+    async def count(self, user_id: int) -> int:
+        cursor = self._collection().find({"user_id": user_id}, {"_id": 0, "count": 1})
+        return sum(document.get("count", 0) for document in await cursor.to_list(length=None))
+
+    async def prune(self, user_id: int, keep: int, covered_until: datetime) -> int:
+        """Deletes whole buckets older than the user's newest `keep` turns and up to `covered_until`."""
+        cursor = self._collection().find({"user_id": user_id}, {"count": 1, "last_ts": 1}).sort("last_ts", -1)
+        kept, expired, deleted = 0, [], 0
+        async for bucket in cursor:
+            if kept >= keep and bucket["last_ts"] <= covered_until:
+                expired.append(bucket["_id"])
+                deleted += bucket.get("count", 0)
+            kept += bucket.get("count", 0)
+        if expired:
+            await self._collection().delete_many({"_id": {"$in": expired}})
+        return deleted
+
+    async def users_over(self, turns: int) -> AsyncIterator[int]:
+        cursor = await self._collection().aggregate([
+            {"$group": {"_id": "$user_id", "turns": {"$sum": "$count"}}},
+            {"$match": {"turns": {"$gt": turns}}},
+        ])
+        async for document in cursor:
+            yield document["_id"]
+
+
+HISTORY_SCHEMAS = {
+    "flat": FlatHistory,
+    "bucketed": BucketedHistory,
+}
+
+if HISTORY_SCHEMA not in HISTORY_SCHEMAS:
+    logger.warning(f"Unknown history schema '{HISTORY_SCHEMA}', falling back to flat")
+
+history_store = HISTORY_SCHEMAS.get(HISTORY_SCHEMA, FlatHistory)()
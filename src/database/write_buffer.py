@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from src.config import (
+    WRITE_BUFFER_ENABLED,
+    WRITE_BUFFER_FLUSH_SIZE,
+    WRITE_BUFFER_FLUSH_INTERVAL,
+    WRITE_BUFFER_MAX_PENDING,
+    WRITE_BUFFER_MAX_RETRIES,
+)
+from .db import get_db_client
+
+logger = logging.getLogger(__name__)
+
+DB_NAME = "telegram_bot_db"
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindBuffer:
+    """
+    Batches chat history inserts and user upserts into bulk writes.
+
+    Inserts are flushed with insert_many and upserts with bulk_write(ordered=False),
+    whenever WRITE_BUFFER_FLUSH_SIZE operations are pending or every
+    WRITE_BUFFER_FLUSH_INTERVAL seconds. Upserts to the same document are merged
+    before the flush. Producers wait once WRITE_BUFFER_MAX_PENDING operations are
+    queued, and stop() lets a flush in progress finish and drains everything that is
+    left. A flush that is cancelled puts the operations it has not written back.
+    """
+
+    def __init__(self):
+        self._inserts: Dict[str, List[Dict[str, Any]]] = {}
+        self._upserts: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        self._pending = 0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "dropped": 0,
+            "merged_upserts": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if WRITE_BUFFER_ENABLED and not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop and writes out every pending operation."""
+        if self._task is not None:
+            # The loop finishes the flush it is in, flushes once more and exits
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    async def add_insert(self, collection: str, document: Dict[str, Any]):
+        await self._reserve()
+        self._inserts.setdefault(collection, []).append(document)
+        self._added()
+
+    async def add_upsert(self, collection: str, document_id: Any, fields: Dict[str, Any]):
+        key = (collection, document_id)
+        if key in self._upserts:
+            # A newer upsert of the same document replaces the fields it sets
+            self._upserts[key].update(fields)
+            self.stats["merged_upserts"] += 1
+            return
+        await self._reserve()
+        self._upserts[key] = dict(fields)
+        self._added()
+
+    async def settle(self, collection: str, field: str, value: Any):
+        """
+        Makes buffered inserts into `collection` whose `field` equals `value` readable, by
+        flushing if there are any. Also waits for a flush in progress, whose documents are
+        neither in the buffer nor necessarily in MongoDB yet.
+        """
+        if self._flush_lock.locked() or any(document.get(field) == value for document in self._inserts.get(collection, ())):
+            await self.flush()
+
+    async def _reserve(self):
+        async with self._space:
+            await self._space.wait_for(lambda: self._pending < WRITE_BUFFER_MAX_PENDING)
+            self._pending += 1
+
+    def _added(self):
+        self.stats["enqueued"] += 1
+        if self._pending >= WRITE_BUFFER_FLUSH_SIZE:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), WRITE_BUFFER_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}", exc_info=True)
+
+    async def flush(self):
+        """Writes every pending operation to MongoDB."""
+        async with self._flush_lock:
+            inserts, self._inserts = self._inserts, {}
+            upserts, self._upserts = self._upserts, {}
+            count = sum(len(documents) for documents in inserts.values()) + len(upserts)
+            if not count:
+                return
+
+            try:
+                db = get_db_client().get_database(DB_NAME)
+                while inserts:
+                    collection, documents = next(iter(inserts.items()))
+                    await self._write(collection, lambda c=collection, d=documents: db.get_collection(c).insert_many(d, ordered=False), len(documents))
+                    del inserts[collection]
+
+                requests: Dict[str, Dict[Tuple[str, Any], UpdateOne]] = {}
+                for (collection, document_id), fields in upserts.items():
+                    requests.setdefault(collection, {})[(collection, document_id)] = UpdateOne(
+                        {"_id": document_id}, {"$set": fields}, upsert=True
+                    )
+                for collection, operations in requests.items():
+                    await self._write(collection, lambda c=collection, o=list(operations.values()): db.get_collection(c).bulk_write(o, ordered=False), len(operations))
+                    for key in operations:
+                        del upserts[key]
+            except asyncio.CancelledError:
+                # Nothing that was not written is lost: it is flushed again later
+                count -= self._requeue(inserts, upserts)
+                raise
+            finally:
+                async with self._space:
+                    self._pending -= count
+                    self._space.notify_all()
+
+    def _requeue(self, inserts: Dict[str, List[Dict[str, Any]]], upserts: Dict[Tuple[str, Any], Dict[str, Any]]) -> int:
+        """Puts unwritten operations back in front of newer ones. Returns how many stay pending."""
+        pending = 0
+        for collection, documents in inserts.items():
+            self._inserts[collection] = documents + self._inserts.get(collection, [])
+            pending += len(documents)
+        for key, fields in upserts.items():
+            newer = self._upserts.get(key)
+            # A newer upsert of the same document already holds its own slot
+            self._upserts[key] = {**fields, **(newer or {})}
+            pending += newer is None
+        return pending
+
+    async def _write(self, collection: str, operation, size: int):
+        for attempt in range(WRITE_BUFFER_MAX_RETRIES + 1):
+            try:
+                await operation()
+                break
+            except BulkWriteError as e:
+                # Documents already written by an earlier attempt show up as duplicate keys
+                errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+                if not errors:
+                    break
+                logger.warning(f"Bulk write to {collection} had {len(errors)} errors: {errors[0].get('errmsg')}")
+            except Exception as e:
+                logger.warning(f"Bulk write to {collection} failed (attempt {attempt + 1}): {e}")
+            if attempt < WRITE_BUFFER_MAX_RETRIES:
+                self.stats["retries"] += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        else:
+            logger.error(f"Dropping {size} buffered writes to {collection} after {WRITE_BUFFER_MAX_RETRIES} retries")
+            self.stats["dropped"] += size
+            return
+        self.stats["written"] += size
+        self.stats["batches"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": self._pending, "running": self.running}
+
+
+write_buffer = WriteBehindBuffer()
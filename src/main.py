@@ -1,28 +1,107 @@
-from telegram import Update
-from fastapi import FastAPI, Request
+import asyncio
+import logging
+from fastapi import FastAPI, Request, Response
 from contextlib import asynccontextmanager
-from .bot.application import application  # Import your PTB Application
+from .config import FAST_START
+from .startup import startup
+from .bot.webhook_codec import json_response, loads, webhook_filter
+
+logger = logging.getLogger(__name__)
+
+# src.bot.runtime, imported during startup so that importing this module stays cheap
+_runtime = None
+_starting: asyncio.Task | None = None
+
+
+async def _start_bot():
+    global _runtime
+    try:
+        with startup.phase("import"):
+            from .bot import runtime
+        await runtime.start()
+    except Exception as e:
+        startup.error = repr(e)
+        raise
+    _runtime = runtime
+    startup.mark_ready()
+
+
+async def _ready_runtime():
+    """Returns the bot runtime, waiting for a FAST_START startup that is still running."""
+    if _runtime is None and _starting is not None:
+        await asyncio.shield(_starting)
+    return _runtime
+
+
+def _log_start_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Bot startup failed", exc_info=task.exception())
 
-app = FastAPI()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await application.initialize()
-    await application.start()
+    global _starting
+    if FAST_START:
+        # Start serving at once and bring the bot up in the background; webhooks that
+        # arrive meanwhile wait for it, health checks do not
+        _starting = asyncio.create_task(_start_bot())
+        _starting.add_done_callback(_log_start_failure)
+    else:
+        await _start_bot()
     yield
-    await application.stop()
-    await application.shutdown()
+    if _starting is not None and not _starting.done():
+        _starting.cancel()
+        await asyncio.gather(_starting, return_exceptions=True)
+    if _runtime is not None:
+        await _runtime.stop()
+
 
 app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 async def check_health():
-    return {"message": "Telegram Bot is running!"}
+    # 503 while a FAST_START startup runs and after it failed, so load balancers and
+    # orchestrators only send traffic to a worker whose bot is up
+    if not startup.ready:
+        message = "Telegram Bot failed to start" if startup.error else "Telegram Bot is starting"
+        return json_response({"message": message, "ready": False, "error": startup.error}, status_code=503)
+    return {"message": "Telegram Bot is running!", "ready": True}
+
+
+@app.get("/stats")
+async def stats():
+    if _runtime is None:
+        return {"webhook": webhook_filter.snapshot(), "startup": startup.snapshot()}
+    return {**_runtime.snapshot(), "webhook": webhook_filter.snapshot(), "startup": startup.snapshot()}
+
+
+@app.get("/metrics")
+async def metrics():
+    from .bot.metrics import render_metrics
+
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
 
 
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
-    update_dict = await request.json()
-    update = Update.de_json(update_dict, application.bot)
-    await application.process_update(update)
-    return {"ok": True}
\ No newline at end of file
+    try:
+        update_dict = loads(await request.body())
+    except ValueError:
+        update_dict = None
+    if not isinstance(update_dict, dict) or "update_id" not in update_dict:
+        return json_response({"ok": False, "error": "invalid update"}, status_code=400)
+
+    # Updates no handler acts on are acknowledged from the raw JSON, without waiting for
+    # a starting bot or building an Update
+    if webhook_filter.drop(update_dict, _runtime.bot_username() if _runtime else None):
+        return json_response()
+
+    try:
+        runtime = await _ready_runtime()
+    except Exception:
+        runtime = None
+    if runtime is None:
+        # Startup failed; a 503 makes Telegram redeliver the update later
+        return json_response({"ok": False, "error": "starting"}, status_code=503)
+    return await runtime.handle_update(update_dict)
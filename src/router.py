@@ -0,0 +1,91 @@
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+import httpx
+from fastapi import FastAPI, Request, Response
+
+from .config import ROUTER_WORKER_URLS, ROUTER_TIMEOUT
+from .bot.webhook_codec import json_response, loads, webhook_filter
+
+logger = logging.getLogger(__name__)
+
+_client: httpx.AsyncClient | None = None
+stats = {"forwarded": 0, "failed": 0}
+
+
+def chat_key_from_dict(update_dict: Dict[str, Any]) -> int:
+    """
+    Returns the chat (or user) an update belongs to from the raw webhook JSON, using the
+    same precedence as update_queue.chat_key but without building an Update object.
+    """
+    for value in update_dict.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+    return update_dict.get("update_id", 0)
+
+
+def worker_for(chat_key: int) -> str:
+    return ROUTER_WORKER_URLS[chat_key % len(ROUTER_WORKER_URLS)]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _client
+    if not ROUTER_WORKER_URLS:
+        raise ValueError("ROUTER_WORKER_URLS must list the worker URLs to route updates to.")
+    _client = httpx.AsyncClient(
+        timeout=ROUTER_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=len(ROUTER_WORKER_URLS) * 4),
+    )
+    yield
+    await _client.aclose()
+
+
+# Chat-affinity front end for multi-process deployments. Telegram's webhook points here,
+# and every update of a chat is forwarded to the same single-process worker, so per-chat
+# ordering and that worker's in-memory caches stay valid while load spreads across cores.
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/")
+async def check_health():
+    return {"message": "Telegram update router is running!", "workers": len(ROUTER_WORKER_URLS)}
+
+
+@app.get("/stats")
+async def router_stats():
+    return {**stats, "webhook": webhook_filter.snapshot()}
+
+
+@app.post("/webhook")
+async def route_update(request: Request):
+    body = await request.body()
+    try:
+        update_dict = loads(body)
+    except ValueError:
+        update_dict = None
+    if not isinstance(update_dict, dict) or "update_id" not in update_dict:
+        return json_response({"ok": False, "error": "invalid update"}, status_code=400)
+    # No worker would act on it, so it is not forwarded at all
+    if webhook_filter.drop(update_dict):
+        return json_response()
+
+    worker = worker_for(chat_key_from_dict(update_dict))
+    try:
+        response = await _client.post(
+            f"{worker}/webhook", content=body, headers={"Content-Type": "application/json"}
+        )
+    except httpx.HTTPError as e:
+        # Telegram redelivers updates that were not acknowledged with a 2xx
+        stats["failed"] += 1
+        logger.error(f"Could not forward update {update_dict['update_id']} to {worker}: {e}")
+        return json_response({"ok": False, "error": "worker unavailable"}, status_code=503)
+    stats["forwarded"] += 1
+    return Response(response.content, status_code=response.status_code, media_type="application/json")
@@ -0,0 +1,117 @@
+"""
+Startup timings.
+
+`startup` records how long each startup phase took in the running process (shown
+under "startup" in /stats). Running this module profiles import cost per module
+with Python's -X importtime in a fresh interpreter:
+
+    python -m src.startup               # top modules and packages for src.main
+    python -m src.startup --module src.bot.runtime --top 30
+    python -m src.startup --json > startup.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+
+class StartupProfile:
+    """Durations of named startup phases, measured from the first import of the app."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.ready_after: float | None = None
+        self.error: str | None = None
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def mark_ready(self):
+        self.ready_after = round(time.perf_counter() - self.origin, 4)
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_after is not None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "ready_after": self.ready_after, "error": self.error, "phases": self.phases}
+
+
+startup = StartupProfile()
+
+
+def import_profile(module: str = "src.main") -> List[Dict[str, Any]]:
+    """
+    Imports `module` in a fresh interpreter with -X importtime and returns one entry per
+    imported module with its own and cumulative import time in milliseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # the header line
+        entries.append({
+            "module": name.strip(),
+            "self_ms": int(own) / 1000,
+            "cumulative_ms": int(cumulative) / 1000,
+        })
+    return entries
+
+
+def summarize(entries: List[Dict[str, Any]], module: str, top: int) -> Dict[str, Any]:
+    packages: Dict[str, float] = {}
+    for entry in entries:
+        package = entry["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + entry["self_ms"]
+    target = next((e for e in entries if e["module"] == module), None)
+    return {
+        "module": module,
+        "total_ms": target["cumulative_ms"] if target else None,
+        "modules": len(entries),
+        "by_package": dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]),
+        "slowest": sorted(entries, key=lambda e: e["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import cost per module at startup.")
+    parser.add_argument("--module", default="src.main", help="module to import (default: src.main)")
+    parser.add_argument("--top", type=int, default=20, help="rows per table")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = summarize(import_profile(args.module), args.module, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"import {report['module']}: {report['total_ms']:.1f} ms over {report['modules']} modules\n")
+    print(f"{'package':<40}{'self ms':>10}")
+    for package, ms in report["by_package"].items():
+        print(f"{package:<40}{ms:>10.1f}")
+    print(f"\n{'module':<60}{'self ms':>10}{'cumul. ms':>12}")
+    for entry in report["slowest"]:
+        print(f"{entry['module'].strip()[:59]:<60}{entry['self_ms']:>10.1f}{entry['cumulative_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
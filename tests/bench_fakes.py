@@ -0,0 +1,261 @@
+"""
+Local stand-ins for the services the bot talks to, used by benchmark_bot.py.
+
+One FastAPI app serves a fake Telegram Bot API, a fake OpenRouter chat completions
+endpoint and a fake remove.bg on a single port, in a background thread with its own
+event loop so the fakes do not add to the bot's event-loop lag. AsyncMongomock wraps
+mongomock so the bot's async pymongo calls run against an in-memory database.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+
+ANSWER = "This is a benchmark answer from the fake model. " * 4 + "[end]"
+
+# Interim messages the bot sends before its real reply
+PROGRESS_TEXTS = {
+    "Thinking...",
+    "Searching the web, please wait...",
+    "Identifying your image, please wait...",
+    "Removing background, please wait...",
+}
+
+# A minimal valid PNG (1x1, transparent)
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+
+@dataclass
+class FakeConfig:
+    llm_latency: float = 0.8  # median seconds to a full answer (or to the first token)
+    llm_jitter: float = 0.5  # sigma of the lognormal latency distribution
+    llm_error_rate: float = 0.0  # share of requests answered with a 500
+    llm_429_rate: float = 0.0  # share of requests answered with a 429
+    token_delay: float = 0.02  # seconds between streamed tokens
+    removebg_latency: float = 1.5
+    telegram_latency: float = 0.03
+    photo_bytes: int = 200_000
+    seed: int = 1
+
+
+@dataclass
+class FakeState:
+    """What the fakes observed; read by the benchmark driver from another thread."""
+
+    completions: Dict[int, float] = field(default_factory=dict)  # chat id -> perf_counter
+    failures: Dict[int, str] = field(default_factory=dict)  # chat id -> error text sent
+    calls: Dict[str, int] = field(default_factory=dict)
+    message_id: int = 0
+
+
+def _latency(rng: random.Random, median: float, sigma: float) -> float:
+    return median * rng.lognormvariate(0, sigma) if median > 0 else 0.0
+
+
+def build_fake_app(config: FakeConfig, state: FakeState) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    photo = rng.randbytes(config.photo_bytes)
+
+    def count(name: str):
+        state.calls[name] = state.calls.get(name, 0) + 1
+
+    def message(chat_id: int, **extra) -> Dict[str, Any]:
+        state.message_id += 1
+        return {
+            "message_id": state.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **extra,
+        }
+
+    def observe(chat_id: int, method: str, text: str | None):
+        if chat_id in state.completions:
+            return
+        if method == "sendPhoto" or text == ANSWER:
+            state.completions[chat_id] = time.perf_counter()
+        elif text and text not in PROGRESS_TEXTS and not ANSWER.startswith(text):
+            # Any other reply is the bot giving up with an error message
+            state.failures[chat_id] = text
+            state.completions[chat_id] = time.perf_counter()
+
+    @app.post("/bot{token}/{method}")
+    async def bot_api(token: str, method: str, request: Request):
+        count(method)
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = await request.json()
+        else:
+            params = dict(await request.form())
+        await asyncio.sleep(config.telegram_latency)
+
+        if method == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            observe(chat_id, method, params.get("text"))
+            result = message(chat_id, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            chat_id = int(params.get("chat_id", 0))
+            observe(chat_id, method, None)
+            result = message(chat_id, photo=[{"file_id": f"out-{chat_id}", "file_unique_id": f"out-{chat_id}", "width": 1, "height": 1}])
+        elif method == "getFile":
+            file_id = params.get("file_id", "")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(photo), "file_path": f"photos/{file_id}.jpg"}
+        else:
+            result = True
+        return {"ok": True, "result": result}
+
+    @app.get("/file/bot{token}/{path:path}")
+    async def bot_file(token: str, path: str):
+        count("download")
+        await asyncio.sleep(config.telegram_latency)
+        return Response(photo, media_type="image/jpeg")
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        count("completions")
+        payload = json.loads(await request.body())
+        roll = rng.random()
+        if roll < config.llm_429_rate:
+            return Response(status_code=429, headers={"Retry-After": "1"})
+        if roll < config.llm_429_rate + config.llm_error_rate:
+            await asyncio.sleep(_latency(rng, config.llm_latency, config.llm_jitter) / 2)
+            return Response(status_code=500)
+        await asyncio.sleep(_latency(rng, config.llm_latency, config.llm_jitter))
+
+        if not payload.get("stream"):
+            return {"choices": [{"message": {"role": "assistant", "content": ANSWER}}]}
+
+        async def events():
+            for index, token in enumerate(ANSWER.split(" ")):
+                delta = token if index == 0 else " " + token
+                yield f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]})}\n\n"
+                await asyncio.sleep(config.token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1.0/removebg")
+    async def removebg(request: Request):
+        count("removebg")
+        await request.body()
+        await asyncio.sleep(_latency(rng, config.removebg_latency, 0.3))
+        return Response(PNG, media_type="image/png")
+
+    return app
+
+
+class FakeServer:
+    """Runs the fake services on 127.0.0.1 in a background thread."""
+
+    def __init__(self, config: FakeConfig, port: int = 0):
+        self.state = FakeState()
+        self._server = uvicorn.Server(
+            uvicorn.Config(build_fake_app(config, self.state), host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+        )
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        socket = self._server.servers[0].sockets[0]
+        return f"http://127.0.0.1:{socket.getsockname()[1]}"
+
+    def start(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+class _AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        method = getattr(self._cursor, name)
+
+        def chain(*args, **kwargs):
+            method(*args, **kwargs)
+            return self
+
+        return chain
+
+    async def to_list(self, length: int | None = None):
+        documents = list(self._cursor)
+        return documents[:length] if length else documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._cursor:
+            yield document
+
+
+class _AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs):
+        # Like pymongo's AsyncCollection.aggregate, a coroutine that returns a cursor
+        return _AsyncCursor(self._collection.aggregate(*args, **kwargs))
+
+    async def bulk_write(self, requests, ordered=True):
+        # mongomock's bulk_write predates the sort option current pymongo passes with
+        # UpdateOne, so the updates the bot batches are applied one by one
+        for request in requests:
+            self._collection.update_one(request._filter, request._doc, upsert=request._upsert)
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class _AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def get_collection(self, name: str, **kwargs):
+        return _AsyncCollection(self._database.get_collection(name))
+
+    async def command(self, *args, **kwargs):
+        return {"ok": 1.0}
+
+
+class AsyncMongomock:
+    """The subset of pymongo's AsyncMongoClient the bot uses, backed by mongomock."""
+
+    def __init__(self):
+        import mongomock
+
+        self._client = mongomock.MongoClient()
+
+    def get_database(self, name: str, **kwargs):
+        return _AsyncDatabase(self._client.get_database(name))
+
+    @property
+    def admin(self):
+        return self.get_database("admin")
+
+    async def close(self):
+        self._client.close()
@@ -0,0 +1,341 @@
+"""
+Offline benchmark: runs the FastAPI app in-process against local fakes (bench_fakes.py)
+and drives it with a mix of text, /search and photo updates.
+
+    python -m tests.benchmark_bot --updates 500 --rate 50 --output bench.json
+    python -m tests.benchmark_bot --compare bench.json --output bench-new.json
+
+Kinds "edited", "sticker" and "channel" in --mix send updates the bot does not answer
+(edited messages, stickers, channel posts); they count towards webhook CPU but not latency.
+
+Reports throughput, webhook requests per CPU-second of the event-loop thread, end-to-end latency (webhook post to the bot's final reply reaching
+the fake Telegram) p50/p95/p99 overall and per update kind, webhook acknowledgement
+latency, event-loop lag and memory, and saves everything as JSON. Uses mongomock unless
+--mongo-uri points at a real MongoDB.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+import httpx
+import uvicorn
+
+from tests.bench_fakes import AsyncMongomock, FakeConfig, FakeServer
+
+BOT_TOKEN = "123456:BENCHMARK"
+SEARCH_QUERIES = ["latest python release", "weather in yangon", "what is asyncio", "myanmar news", "fastapi vs flask"]
+# Update kinds the bot does not reply to
+IGNORED_KINDS = {"edited", "sticker", "channel"}
+TEXTS = ["hello", "Explain recursion briefly", "Write a haiku about rain", "What is a token bucket?", "Tell me a joke"]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarise(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values, default=0.0) * 1000, 2),
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for entry in mix.split(","):
+        name, _, weight = entry.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def make_update(update_id: int, chat_id: int, kind: str, rng: random.Random) -> Dict[str, Any]:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+    message: Dict[str, Any] = {
+        "message_id": update_id,
+        "from": user,
+        "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+        "date": int(time.time()),
+    }
+    if kind == "edited":
+        message["text"] = rng.choice(TEXTS)
+        message["edit_date"] = message["date"]
+        return {"update_id": update_id, "edited_message": message}
+    if kind == "channel":
+        message.pop("from")
+        message["chat"] = {"id": -chat_id, "type": "channel", "title": "Bench channel"}
+        message["text"] = rng.choice(TEXTS)
+        return {"update_id": update_id, "channel_post": message}
+    if kind == "sticker":
+        message["sticker"] = {
+            "file_id": f"sticker-{update_id}", "file_unique_id": f"sticker-{update_id}",
+            "type": "regular", "width": 512, "height": 512, "is_animated": False, "is_video": False,
+        }
+    elif kind == "text":
+        message["text"] = rng.choice(TEXTS)
+    elif kind == "search":
+        text = "/search " + rng.choice(SEARCH_QUERIES)
+        message["text"] = text
+        message["entities"] = [{"offset": 0, "length": 7, "type": "bot_command"}]
+    else:
+        # Telegram sends several sizes of every photo
+        file_id = f"photo-{update_id}"
+        message["photo"] = [
+            {"file_id": f"{file_id}-{side}", "file_unique_id": f"{file_id}-{side}", "width": side, "height": side * 3 // 4}
+            for side in (90, 320, 800, 1280)
+        ]
+        if kind == "removebg":
+            message["caption"] = "/removebg"
+            message["caption_entities"] = [{"offset": 0, "length": 9, "type": "bot_command"}]
+    return {"update_id": update_id, "message": message}
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires, i.e. how long the event loop was blocked."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+def configure_environment(args, fake_url: str):
+    """Points the bot at the fakes. Must run before any src module is imported."""
+    os.environ.update({
+        "BOT_TOKEN": BOT_TOKEN,
+        "WEBHOOK_URL": "http://127.0.0.1/webhook",
+        "OPENROUTER_API_KEY": "benchmark",
+        "OPENROUTER_API_ENDPOINT": f"{fake_url}/api/v1/chat/completions",
+        "API_KEY": "benchmark",
+        "RBG_API_BASE": fake_url,
+        "TELEGRAM_API_BASE_URL": fake_url,
+        "LLM_MODELS": args.models,
+        "LLM_STREAMING": str(args.streaming).lower(),
+        "RATE_LIMIT_ENABLED": str(args.rate_limit).lower(),
+        "DB_URI": args.mongo_uri or "mongodb://127.0.0.1:1",
+        # Fresh caches for every run
+        "IMAGE_CACHE_DIR": os.path.join(os.getenv("TMPDIR", "/tmp"), f"bench-images-{os.getpid()}"),
+    })
+
+
+async def run(args) -> Dict[str, Any]:
+    fakes = FakeServer(FakeConfig(
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        llm_error_rate=args.llm_error_rate,
+        llm_429_rate=args.llm_429_rate,
+        token_delay=args.token_delay,
+        removebg_latency=args.removebg_latency,
+        telegram_latency=args.telegram_latency,
+        photo_bytes=args.photo_bytes,
+        seed=args.seed,
+    ))
+    fakes.start()
+    configure_environment(args, fakes.url)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+
+    from src.database import db
+    from src.main import app
+
+    if not args.mongo_uri:
+        db._client = AsyncMongomock()
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    bot_url = f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}"
+
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    sent: Dict[int, tuple] = {}
+    ack_latencies: List[float] = []
+    rejected = 0
+    ignored: Dict[str, int] = {}
+    lag = LoopLagMonitor()
+    lag.start()
+
+    async with httpx.AsyncClient(base_url=bot_url, timeout=30) as client:
+        async def post(update_id: int):
+            nonlocal rejected
+            # Every update comes from a new chat, so completions map one-to-one to updates
+            chat_id = 1_000_000 + update_id
+            kind = rng.choices(kinds, weights)[0]
+            update = make_update(update_id, chat_id, kind, rng)
+            started = time.perf_counter()
+            response = await client.post("/webhook", json=update)
+            ack_latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                rejected += 1
+            elif kind in IGNORED_KINDS:
+                ignored[kind] = ignored.get(kind, 0) + 1
+            else:
+                sent[chat_id] = (kind, started)
+
+        begun = time.perf_counter()
+        # The bot and this driver share the event-loop thread; the fakes run in their own
+        cpu_begun = time.thread_time()
+        posts = []
+        for update_id in range(args.updates):
+            posts.append(asyncio.create_task(post(update_id)))
+            # Open-loop Poisson arrivals at --rate updates per second
+            await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*posts)
+
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and any(chat_id not in fakes.state.completions for chat_id in sent):
+            await asyncio.sleep(0.05)
+        cpu_seconds = time.thread_time() - cpu_begun
+
+        stats = (await client.get("/stats")).json()
+
+    await lag.stop()
+    rss_after = rss_bytes()
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    server.should_exit = True
+    await serving
+    fakes.stop()
+
+    latencies: Dict[str, List[float]] = {kind: [] for kind in kinds if kind not in IGNORED_KINDS}
+    finished_at = begun
+    for chat_id, (kind, started) in sent.items():
+        completed = fakes.state.completions.get(chat_id)
+        if completed is not None and chat_id not in fakes.state.failures:
+            latencies[kind].append(completed - started)
+            finished_at = max(finished_at, completed)
+    succeeded = sum(len(values) for values in latencies.values())
+
+    return {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "scenario": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "updates": {
+            "sent": args.updates,
+            "accepted": len(sent),
+            "rejected": rejected,
+            "ignored": ignored,
+            "succeeded": succeeded,
+            "failed": len([chat_id for chat_id in sent if chat_id in fakes.state.failures]),
+            "timed_out": len([chat_id for chat_id in sent if chat_id not in fakes.state.completions]),
+        },
+        "throughput_per_s": round(succeeded / (finished_at - begun), 2) if finished_at > begun else 0.0,
+        "cpu": {
+            "event_loop_thread_s": round(cpu_seconds, 3),
+            "requests_per_core_s": round(args.updates / cpu_seconds, 2) if cpu_seconds else 0.0,
+        },
+        "latency": summarise([value for values in latencies.values() for value in values]),
+        "latency_by_kind": {kind: summarise(values) for kind, values in latencies.items()},
+        "webhook_ack": summarise(ack_latencies),
+        "event_loop_lag": summarise(lag.samples),
+        "memory": {
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "tracemalloc_peak_bytes": traced_peak,
+        },
+        "upstream_calls": dict(fakes.state.calls),
+        "bot_stats": stats,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict[str, Any], result: Dict[str, Any]):
+    rows = [
+        ("throughput/s", baseline["throughput_per_s"], result["throughput_per_s"]),
+        ("req/core-s", baseline.get("cpu", {}).get("requests_per_core_s", 0.0), result["cpu"]["requests_per_core_s"]),
+        ("p50 ms", baseline["latency"]["p50_ms"], result["latency"]["p50_ms"]),
+        ("p95 ms", baseline["latency"]["p95_ms"], result["latency"]["p95_ms"]),
+        ("p99 ms", baseline["latency"]["p99_ms"], result["latency"]["p99_ms"]),
+        ("loop lag p99 ms", baseline["event_loop_lag"]["p99_ms"], result["event_loop_lag"]["p99_ms"]),
+        ("max rss MB", baseline["memory"]["max_rss_bytes"] / 2**20, result["memory"]["max_rss_bytes"] / 2**20),
+    ]
+    print(f"{'metric':<18}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, before, after in rows:
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:<18}{before:>12.2f}{after:>12.2f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="updates per second (Poisson arrivals)")
+    parser.add_argument("--mix", default="text=0.7,search=0.15,photo=0.1,removebg=0.05")
+    parser.add_argument("--models", default="fake/model-a,fake/model-b")
+    parser.add_argument("--streaming", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--rate-limit", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--llm-jitter", type=float, default=0.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0.02)
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--removebg-latency", type=float, default=1.5)
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--photo-bytes", type=int, default=200_000)
+    parser.add_argument("--mongo-uri", help="use this MongoDB instead of mongomock")
+    parser.add_argument("--tracemalloc", action="store_true", help="also record the Python heap peak (slower)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for replies after the last update")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare the results with")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps({key: result[key] for key in ("updates", "throughput_per_s", "cpu", "latency", "latency_by_kind", "event_loop_lag", "memory")}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Shared setup for the unit tests.
+
+src.config reads the environment when it is imported, so placeholder settings are put
+in place before any test imports it.
+Tests that touch MongoDB get the in-memory AsyncMongomock from bench_fakes.
+"""
+import os
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("WEBHOOK_URL", "https://example.invalid")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
+os.environ.setdefault("LLM_MODELS", "test/model-a,test/model-b")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Points get_db_client at a fresh in-memory database."""
+    pytest.importorskip("mongomock")
+    from src.database import db
+    from tests.bench_fakes import AsyncMongomock
+
+    client = AsyncMongomock()
+    monkeypatch.setattr(db, "_client", client)
+    return client
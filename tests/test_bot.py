@@ -1,3 +1,39 @@
-from src.config import MODEL_LIST
+import os
+import subprocess
+import sys
+from pathlib import Path
 
-print(MODEL_LIST)
\ No newline at end of file
+import pytest
+
+from src import config
+from src.bot.utils import get_int_mapping, get_model_list
+
+
+def test_model_list_is_parsed_from_the_environment():
+    assert config.LLM_MODELS == ["test/model-a", "test/model-b"]
+
+
+def test_get_model_list_strips_whitespace():
+    assert get_model_list(" a , b,c ") == ["a", "b", "c"]
+
+
+def test_get_model_list_rejects_an_empty_setting():
+    with pytest.raises(ValueError):
+        get_model_list("")
+
+
+def test_get_int_mapping_skips_invalid_entries():
+    assert get_int_mapping("a=1, b = 2,c=x,d") == {"a": 1, "b": 2}
+
+
+def test_missing_required_settings_are_reported_at_startup_not_import(monkeypatch):
+    monkeypatch.setitem(config.REQUIRED_VARS, "LLM_MODELS", [])
+    with pytest.raises(ValueError, match="LLM_MODELS"):
+        config.check_required()
+
+
+def test_main_imports_without_any_settings(tmp_path):
+    # Run from an empty directory so no .env is picked up either
+    environment = {"PATH": os.environ["PATH"], "PYTHONPATH": str(Path(__file__).resolve().parents[1])}
+    result = subprocess.run([sys.executable, "-c", "import src.main"], cwd=tmp_path, env=environment, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from telegram.error import Forbidden
+
+from src.bot import broadcast as broadcast_module
+from src.bot.broadcast import Broadcast, Broadcaster
+
+USERS = range(1, 21)
+BLOCKED = {4, 13}
+ADMIN_CHAT = 999
+
+
+class FakeBot:
+    def __init__(self, stop_after=None, fail_report=False):
+        self.sent = []
+        self.reports = []
+        self.stop_after = stop_after
+        self.fail_report = fail_report
+        self.broadcast: Broadcast | None = None
+
+    async def send_message(self, chat_id, text, parse_mode=None, rate_limit_args=None):
+        await asyncio.sleep(0)
+        if chat_id == ADMIN_CHAT:
+            if self.fail_report:
+                raise Forbidden("Forbidden: bot was blocked by the user")
+            self.reports.append(text)
+            return
+        if chat_id in BLOCKED:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append(chat_id)
+        if len(self.sent) == self.stop_after:
+            self.broadcast.stop()
+
+
+@pytest.fixture
+def users(mongo, monkeypatch):
+    monkeypatch.setattr(broadcast_module, "BROADCAST_BATCH_SIZE", 4)
+    monkeypatch.setattr(broadcast_module, "BROADCAST_CONCURRENCY", 3)
+    collection = mongo.get_database("telegram_bot_db").get_collection("users")._collection
+    collection.insert_many([{"_id": user_id} for user_id in USERS])
+    # Already marked inactive, so never sent to
+    collection.update_one({"_id": 20}, {"$set": {"active": False}})
+    return collection
+
+
+async def start(bot, text="News"):
+    broadcast = await Broadcast.create(bot, text)
+    bot.broadcast = broadcast
+    return broadcast
+
+
+def test_broadcast_reaches_active_users_and_deactivates_blocked_ones(users):
+    bot = FakeBot()
+
+    async def run():
+        return await (await start(bot)).run()
+
+    progress = asyncio.run(run())
+
+    assert sorted(bot.sent) == [user for user in USERS if user not in BLOCKED and user != 20]
+    assert (progress["status"], progress["sent"], progress["blocked"], progress["failed"]) == ("done", 17, 2, 0)
+    assert {user["_id"] for user in users.find({"active": False})} == BLOCKED | {20}
+
+
+def test_stopped_broadcast_resumes_after_its_checkpoint(users):
+    bot = FakeBot(stop_after=5)
+
+    async def run():
+        first = await start(bot)
+        stopped = await first.run()
+        bot.stop_after = None
+        resumed = await Broadcast.load(bot, first.id)
+        bot.broadcast = resumed
+        return first, stopped, await resumed.run()
+
+    first, stopped, finished = asyncio.run(run())
+
+    assert stopped["status"] == "stopped"
+    assert first.checkpoint is not None and first.checkpoint < 19
+    # Every active user got the message exactly once across both runs
+    assert sorted(bot.sent) == [user for user in USERS if user not in BLOCKED and user != 20]
+    assert (finished["status"], finished["sent"], finished["blocked"]) == ("done", 17, 2)
+    document = users.database.get_collection("broadcasts").find_one({"_id": first.id})
+    assert document["status"] == "done" and document["checkpoint"] == 19
+
+
+def test_failed_report_to_the_admin_does_not_fail_the_task(users):
+    bot = FakeBot(fail_report=True)
+    broadcaster = Broadcaster()
+
+    async def run():
+        broadcaster.start(await start(bot), report_chat_id=ADMIN_CHAT)
+        await asyncio.wait([broadcaster._task])
+        return broadcaster._task
+
+    task = asyncio.run(run())
+
+    assert task.exception() is None
+    assert broadcaster.snapshot()["status"] == "done"
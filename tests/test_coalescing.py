@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+from src.bot import coalescing
+from src.bot.coalescing import ChatCoalescer
+
+KEY = (1, 1)
+
+
+@pytest.fixture(autouse=True)
+def short_window(monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_WINDOW", 0.01)
+    monkeypatch.setattr(coalescing, "COALESCE_CANCEL", True)
+
+
+class Chat:
+    """The Telegram side: replies take a moment to send, like a real round trip."""
+
+    def __init__(self):
+        self.sent = []
+        self.deleted = []
+
+    def message(self, text):
+        return ChatMessage(self, text)
+
+
+class ChatMessage:
+    def __init__(self, chat, text):
+        self.chat = chat
+        self.text = text
+
+    async def reply_text(self, text):
+        await asyncio.sleep(0.01)
+        reply = ChatMessage(self.chat, f"{text} {len(self.chat.sent) + 1}")
+        self.chat.sent.append(reply)
+        return reply
+
+    async def delete(self):
+        self.chat.deleted.append(self)
+
+
+class Answers:
+    """Stands in for answer_text: records each request and holds it until released."""
+
+    def __init__(self, finish_first=False):
+        self.started = []
+        self.answered = []
+        self.release = asyncio.Event()
+        self.finish_first = finish_first
+
+    async def __call__(self, request):
+        self.started.append(request.text)
+        placeholder = await request.placeholder("Thinking...")
+        if self.finish_first:
+            request.finishing()
+        await self.release.wait()
+        self.answered.append((request.text, placeholder.text))
+
+
+async def started(answers, count=1):
+    while len(answers.started) < count:
+        await asyncio.sleep(0.001)
+
+
+async def settle(coalescer):
+    while coalescer._requests:
+        await asyncio.sleep(0.005)
+
+
+def test_messages_within_the_window_get_one_answer():
+    async def run():
+        chat, coalescer, answers = Chat(), ChatCoalescer(), Answers()
+        answers.release.set()
+        for text in ("one", "two", "three"):
+            coalescer.submit(KEY, chat.message(text), answers)
+        await settle(coalescer)
+        return coalescer, answers
+
+    coalescer, answers = asyncio.run(run())
+
+    assert answers.answered == [("one\ntwo\nthree", "Thinking... 1")]
+    assert coalescer.stats["merged"] == 2
+    assert coalescer.stats["answered"] == 1
+
+
+def test_message_during_an_answer_cancels_it_and_is_answered_together():
+    async def run():
+        chat, coalescer, answers = Chat(), ChatCoalescer(), Answers()
+        coalescer.submit(KEY, chat.message("one"), answers)
+        await started(answers)
+        await asyncio.sleep(0.02)
+        coalescer.submit(KEY, chat.message("two"), answers)
+        answers.release.set()
+        await settle(coalescer)
+        return chat, coalescer, answers
+
+    chat, coalescer, answers = asyncio.run(run())
+
+    assert answers.started == ["one", "one\ntwo"]
+    # The cancelled answer's placeholder is reused for the combined one
+    assert answers.answered == [("one\ntwo", "Thinking... 1")]
+    assert len(chat.sent) == 1
+    assert coalescer.stats["cancelled"] == 1
+    assert coalescer.stats["answered"] == 1
+
+
+def test_cancel_while_the_placeholder_is_sent_reuses_it():
+    async def run():
+        chat, coalescer, answers = Chat(), ChatCoalescer(), Answers()
+        answers.release.set()
+        coalescer.submit(KEY, chat.message("one"), answers)
+        await started(answers)
+        # reply_text("Thinking...") is still in flight
+        coalescer.submit(KEY, chat.message("two"), answers)
+        await settle(coalescer)
+        return chat, answers
+
+    chat, answers = asyncio.run(run())
+
+    assert [message.text for message in chat.sent] == ["Thinking... 1"]
+    assert answers.answered == [("one\ntwo", "Thinking... 1")]
+
+
+def test_cancelled_answer_leaves_no_continuation_behind():
+    async def answer(request):
+        placeholder = await request.placeholder("Thinking...")
+        if len(request.messages) == 1:
+            # A long answer overflowed into a second message, then is cancelled mid-send
+            request.continuations.append(asyncio.ensure_future(placeholder.reply_text("continued")))
+            await asyncio.sleep(1)
+
+    async def run():
+        chat, coalescer = Chat(), ChatCoalescer()
+        coalescer.submit(KEY, chat.message("one"), answer)
+        while not coalescer._requests[KEY].continuations:
+            await asyncio.sleep(0.001)
+        coalescer.submit(KEY, chat.message("two"), answer)
+        await settle(coalescer)
+        return chat
+
+    chat = asyncio.run(run())
+
+    assert [message.text for message in chat.sent] == ["Thinking... 1", "continued 2"]
+    assert chat.deleted == chat.sent[1:]
+
+
+def test_message_during_an_answer_waits_for_it_without_cancel(monkeypatch):
+    monkeypatch.setattr(coalescing, "COALESCE_CANCEL", False)
+
+    async def run():
+        chat, coalescer, answers = Chat(), ChatCoalescer(), Answers()
+        coalescer.submit(KEY, chat.message("one"), answers)
+        await started(answers)
+        coalescer.submit(KEY, chat.message("two"), answers)
+        answers.release.set()
+        await settle(coalescer)
+        return coalescer, answers
+
+    coalescer, answers = asyncio.run(run())
+
+    assert answers.answered == [("one", "Thinking... 1"), ("two", "Thinking... 2")]
+    assert coalescer.stats["cancelled"] == 0
+
+
+def test_finishing_answer_is_never_cancelled():
+    async def run():
+        chat, coalescer, answers = Chat(), ChatCoalescer(), Answers(finish_first=True)
+        coalescer.submit(KEY, chat.message("one"), answers)
+        await started(answers)
+        await asyncio.sleep(0.02)
+        coalescer.submit(KEY, chat.message("two"), answers)
+        answers.release.set()
+        await settle(coalescer)
+        return coalescer, answers
+
+    coalescer, answers = asyncio.run(run())
+
+    assert answers.answered == [("one", "Thinking... 1"), ("two", "Thinking... 2")]
+    assert coalescer.stats["cancelled"] == 0
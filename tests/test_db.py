@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from telegram import User
+
+from src.database import db
+from src.database.user_db import update_or_create_user
+
+
+@pytest.fixture
+def no_client(monkeypatch):
+    monkeypatch.setattr(db, "_client", None)
+    monkeypatch.setattr(db, "DB_URI", "mongodb://127.0.0.1:1")
+    monkeypatch.setattr(db, "MONGO_MAX_POOL_SIZE", 7)
+
+
+def test_one_pooled_client_is_created_on_first_use_and_closed_on_shutdown(no_client):
+    async def run():
+        client = db.get_db_client()
+        same = db.get_db_client() is client
+        pool_size = client.options.pool_options.max_pool_size
+        await db.close_db_client()
+        return same, pool_size
+
+    # Creating the client does not connect, so no server is needed
+    assert asyncio.run(run()) == (True, 7)
+    assert db._client is None
+
+
+def test_users_are_upserted_through_the_async_client(mongo):
+    user = User(42, "Ada", False, username="ada")
+
+    async def run():
+        await update_or_create_user(user)
+        await update_or_create_user(User(42, "Ada", False, username="ada_l"))
+        users = db.get_db_client().get_database("telegram_bot_db").get_collection("users")
+        return await users.find({}).to_list()
+
+    documents = asyncio.run(run())
+
+    assert len(documents) == 1
+    assert documents[0]["_id"] == 42
+    assert documents[0]["username"] == "ada_l"
+    assert documents[0]["active"] is True
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.bot import dedup
+from src.bot.dedup import UpdateDeduplicator
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(dedup, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(dedup, "DEDUP_ENABLED", True)
+    monkeypatch.setattr(dedup, "DEDUP_BACKEND", "memory")
+    monkeypatch.setattr(dedup, "DEDUP_WINDOW", 60)
+    return clock
+
+
+def test_a_redelivery_within_the_window_is_a_duplicate(clock):
+    deduplicator = UpdateDeduplicator()
+
+    async def run():
+        first = await deduplicator.is_duplicate(1)
+        clock.now += 59
+        return first, await deduplicator.is_duplicate(1)
+
+    assert asyncio.run(run()) == (False, True)
+
+
+def test_an_id_is_forgotten_once_the_window_has_passed(clock):
+    deduplicator = UpdateDeduplicator()
+
+    async def run():
+        await deduplicator.is_duplicate(1)
+        clock.now += 61
+        return await deduplicator.is_duplicate(1)
+
+    assert asyncio.run(run()) is False
+    assert deduplicator.snapshot()["tracked"] == 1
+
+
+def test_the_oldest_ids_go_first_when_the_set_is_full(clock, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_MAX_ENTRIES", 3)
+    deduplicator = UpdateDeduplicator()
+
+    async def run():
+        for update_id in range(5):
+            await deduplicator.is_duplicate(update_id)
+        return await deduplicator.is_duplicate(4), await deduplicator.is_duplicate(0)
+
+    assert asyncio.run(run()) == (True, False)
+    assert deduplicator.snapshot()["tracked"] <= 3
+
+
+def test_forget_lets_a_redelivery_through(clock):
+    deduplicator = UpdateDeduplicator()
+
+    async def run():
+        await deduplicator.is_duplicate(1)
+        await deduplicator.forget(1)
+        return await deduplicator.is_duplicate(1)
+
+    assert asyncio.run(run()) is False
+
+
+def test_replicas_share_the_mongo_backend(clock, mongo, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_BACKEND", "mongo")
+    replica, other_replica, restarted_replica = UpdateDeduplicator(), UpdateDeduplicator(), UpdateDeduplicator()
+
+    async def run():
+        await replica.start()
+        taken = [await replica.is_duplicate(1), await other_replica.is_duplicate(1)]
+        await replica.forget(1)
+        taken.append(await restarted_replica.is_duplicate(1))
+        return taken
+
+    assert asyncio.run(run()) == [False, True, False]
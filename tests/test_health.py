@@ -0,0 +1,37 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from src import main
+from src.startup import StartupProfile
+
+
+@pytest.fixture
+def startup(monkeypatch):
+    profile = StartupProfile()
+    monkeypatch.setattr(main, "startup", profile)
+    return profile
+
+
+def health():
+    # Without a `with` block the lifespan does not run, so the bot is never started
+    return TestClient(main.app).get("/")
+
+
+def test_health_is_unavailable_while_starting(startup):
+    response = health()
+    assert response.status_code == 503
+    assert response.json()["ready"] is False
+
+
+def test_health_is_unavailable_after_a_failed_start(startup):
+    startup.error = "RuntimeError('no database')"
+    response = health()
+    assert response.status_code == 503
+    assert response.json()["error"] == startup.error
+
+
+def test_health_is_ok_once_ready(startup):
+    startup.mark_ready()
+    response = health()
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
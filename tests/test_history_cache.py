@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.database import chat_history_db, history_cache as history_cache_module
+from src.database.history_cache import MESSAGE_OVERHEAD, HistoryCache
+
+USER_ID = 7
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(history_cache_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(history_cache_module, "HISTORY_CACHE_ENABLED", True)
+    monkeypatch.setattr(history_cache_module, "HISTORY_CACHE_TURNS", 4)
+    monkeypatch.setattr(history_cache_module, "HISTORY_CACHE_TTL", 60)
+    monkeypatch.setattr(history_cache_module, "HISTORY_CACHE_MAX_BYTES", 3 * 4 * (MESSAGE_OVERHEAD + 10))
+    return clock
+
+
+def turn(index):
+    return {"role": "user", "content": f"message {index:2d}"}
+
+
+def contents(messages):
+    return [message["content"] for message in messages]
+
+
+def test_a_cached_user_keeps_only_the_latest_turns(clock):
+    cache = HistoryCache()
+    cache.fill(USER_ID, [turn(0), turn(1)])
+    for index in range(2, 6):
+        cache.append(USER_ID, turn(index))
+
+    assert contents(cache.get(USER_ID, 4)) == contents(turn(index) for index in range(2, 6))
+    assert contents(cache.get(USER_ID, 2)) == contents([turn(4), turn(5)])
+    assert cache.snapshot()["bytes"] == 4 * (MESSAGE_OVERHEAD + 10)
+    # More turns than the ring buffer holds have to come from MongoDB
+    assert cache.get(USER_ID, 5) is None
+
+
+def test_an_entry_expires_unless_the_user_keeps_talking(clock):
+    cache = HistoryCache()
+    cache.fill(USER_ID, [turn(0)])
+    clock.now += 50
+    cache.append(USER_ID, turn(1))
+    clock.now += 50
+
+    assert contents(cache.get(USER_ID, 2)) == contents([turn(0), turn(1)])
+    clock.now += 61
+    assert cache.get(USER_ID, 2) is None
+    assert cache.snapshot()["users"] == 0
+
+
+def test_the_least_recently_used_user_is_evicted_over_the_byte_budget(clock):
+    cache = HistoryCache()
+    for user_id in (1, 2, 3):
+        cache.fill(user_id, [turn(index) for index in range(4)])
+    # Reading user 1 makes user 2 the least recently used
+    cache.get(1, 1)
+    cache.fill(4, [turn(0)])
+
+    assert [cache.get(user_id, 1) is not None for user_id in (1, 2, 3, 4)] == [True, False, True, True]
+    assert cache.stats["evictions"] == 1
+
+
+def test_history_is_read_from_mongodb_once_and_then_served_from_the_cache(clock, mongo, monkeypatch):
+    cache = HistoryCache()
+    monkeypatch.setattr(chat_history_db, "history_cache", cache)
+    reads = []
+    fetch = chat_history_db._fetch_user_history
+
+    async def counted_fetch(user_id, limit):
+        reads.append(limit)
+        return await fetch(user_id, limit)
+
+    monkeypatch.setattr(chat_history_db, "_fetch_user_history", counted_fetch)
+
+    async def run():
+        await chat_history_db.add_messages_to_history(USER_ID, [("user", "hi"), ("assistant", "hello")])
+        first = await chat_history_db.get_user_history(USER_ID, 2)
+        await chat_history_db.add_message_to_history(USER_ID, "user", "and again")
+        return first, await chat_history_db.get_user_history(USER_ID, 2)
+
+    first, second = asyncio.run(run())
+
+    assert contents(first) == ["hi", "hello"]
+    assert contents(second) == ["hello", "and again"]
+    # The first read fetches a full ring buffer's worth; the second is a cache hit
+    assert reads == [4]
+    assert cache.stats["hits"] == 1
@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.bot import context_builder, history_compaction
+from src.bot.history_compaction import HistoryCompactor
+from src.bot.rate_limit import AdmissionController
+from src.database import chat_history_db
+from src.database.history_cache import HistoryCache
+from src.database.history_store import BucketedHistory, FlatHistory
+
+USER_ID = 42
+TURNS = 120
+MAX_TURNS = 20
+STARTED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(params=[FlatHistory, BucketedHistory])
+def store(request, mongo, monkeypatch):
+    store = request.param()
+    monkeypatch.setattr(chat_history_db, "history_store", store)
+    monkeypatch.setattr(chat_history_db, "history_cache", HistoryCache())
+    monkeypatch.setattr(history_compaction, "history_store", store)
+    monkeypatch.setattr(history_compaction, "HISTORY_MAX_TURNS", MAX_TURNS)
+    monkeypatch.setattr(context_builder, "admission", AdmissionController())
+    return store
+
+
+@pytest.fixture
+def summarised(monkeypatch):
+    """Stands in for the LLM; records every transcript it was asked to summarise."""
+    transcripts = []
+
+    async def try_models(models, payload_base, headers, endpoint, **kwargs):
+        transcripts.append(payload_base["messages"][1]["content"])
+        return f"summary {len(transcripts)}"
+
+    monkeypatch.setattr(context_builder, "try_models", try_models)
+    return transcripts
+
+
+def content(index: int) -> str:
+    return f"turn-{index:03d}"
+
+
+async def fill(store):
+    # Written an exchange at a time, the way handle_text stores them
+    for index in range(0, TURNS, 2):
+        await store.insert([
+            {"user_id": USER_ID, "role": role, "content": content(index + offset), "timestamp": STARTED + timedelta(seconds=index + offset)}
+            for offset, role in enumerate(("user", "assistant"))
+        ])
+
+
+async def stored_contents(store):
+    return [turn["content"] for turn in await store.recent(USER_ID, TURNS)]
+
+
+def test_nothing_is_deleted_when_summarising_fails(store, monkeypatch):
+    async def try_models(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(context_builder, "try_models", try_models)
+    compactor = HistoryCompactor()
+
+    async def run():
+        await fill(store)
+        await compactor.compact_user(USER_ID)
+        return await store.count(USER_ID), await chat_history_db.get_user_summary(USER_ID)
+
+    count, summary = asyncio.run(run())
+
+    assert count == TURNS
+    assert summary is None
+    assert compactor.stats["errors"] == 1
+    assert USER_ID in store.take_written()
+
+
+def test_only_summarised_turns_are_deleted(store, summarised):
+    compactor = HistoryCompactor()
+
+    async def run():
+        await fill(store)
+        await compactor.compact_user(USER_ID)
+        return await stored_contents(store), await chat_history_db.get_user_summary(USER_ID)
+
+    remaining, summary = asyncio.run(run())
+
+    deleted = [content(index) for index in range(TURNS) if content(index) not in remaining]
+    assert len(remaining) == MAX_TURNS
+    assert remaining == [content(index) for index in range(TURNS - MAX_TURNS, TURNS)]
+    # Oldest first: every deleted turn went into a summary before it was deleted
+    assert all(any(turn in transcript for transcript in summarised) for turn in deleted)
+    assert summary["covered_until"] >= (STARTED + timedelta(seconds=TURNS - MAX_TURNS - 1)).replace(tzinfo=None)
+    assert compactor.stats["turns_deleted"] == TURNS - MAX_TURNS
+
+
+def test_turns_after_the_summary_are_never_deleted(store, summarised, monkeypatch):
+    # The rate limiter allows one batch, so the summary stops short of the turns
+    # compaction would otherwise delete
+    monkeypatch.setattr(context_builder, "SUMMARY_BATCH_TURNS", 30)
+    admitted = []
+
+    async def admit_once(user_id, upstream, cost):
+        admitted.append(cost)
+        return len(admitted) == 1
+
+    monkeypatch.setattr(context_builder.admission, "admit_job", admit_once)
+    compactor = HistoryCompactor()
+
+    async def run():
+        await fill(store)
+        await compactor.compact_user(USER_ID)
+        return await stored_contents(store), await chat_history_db.get_user_summary(USER_ID)
+
+    remaining, summary = asyncio.run(run())
+
+    assert len(summarised) == 1
+    covered = summary["covered_until"]
+    assert covered == (STARTED + timedelta(seconds=29)).replace(tzinfo=None)
+    assert all(turn in remaining for turn in (content(index) for index in range(30, TURNS)))
+
+
+def test_background_summaries_are_cancelled_on_shutdown(monkeypatch):
+    started = asyncio.Event()
+    cancelled = []
+
+    async def summarise_older_turns(user_id, models):
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(user_id)
+            raise
+
+    monkeypatch.setattr(context_builder, "summarise_older_turns", summarise_older_turns)
+    monkeypatch.setattr(context_builder, "_last_summary", {})
+
+    async def run():
+        context_builder.schedule_summary(USER_ID, ["model"])
+        await started.wait()
+        await context_builder.stop_summaries()
+
+    asyncio.run(run())
+
+    assert cancelled == [USER_ID]
+    assert context_builder._summary_tasks == {}
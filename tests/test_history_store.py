@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.database import history_store as history_store_module
+from src.database.history_store import BucketedHistory
+
+USER_ID = 7
+STARTED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class _YieldingCollection:
+    """Gives other tasks a turn before every write, like a round trip to a real server."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+        if name not in ("insert_one", "update_one"):
+            return method
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return await method(*args, **kwargs)
+
+        return call
+
+
+class _InterleavedBuckets(BucketedHistory):
+    def _collection(self):
+        return _YieldingCollection(super()._collection())
+
+
+@pytest.fixture
+def buckets(mongo, monkeypatch):
+    monkeypatch.setattr(history_store_module, "HISTORY_BUCKET_SIZE", 10)
+    return _InterleavedBuckets()
+
+
+def exchange(index: int):
+    return [
+        {"user_id": USER_ID, "role": role, "content": f"{index}-{role}", "timestamp": STARTED + timedelta(seconds=index, milliseconds=offset)}
+        for offset, role in enumerate(("user", "assistant"))
+    ]
+
+
+def bucket_documents(mongo):
+    return list(mongo.get_database("telegram_bot_db").get_collection("chat_history_buckets")._collection.find({"user_id": USER_ID}))
+
+
+def test_buckets_fill_up_to_the_size_and_one_stays_open(buckets, mongo):
+    async def run():
+        await buckets.ensure_indexes()
+        for index in range(23):
+            await buckets.insert(exchange(index))
+
+    asyncio.run(run())
+
+    documents = bucket_documents(mongo)
+    assert [document["count"] for document in documents] == [10, 10, 10, 10, 6]
+    assert [document["open"] for document in documents] == [False, False, False, False, True]
+
+
+def test_concurrent_writers_share_one_open_bucket(buckets, mongo):
+    async def run():
+        await buckets.ensure_indexes()
+        await asyncio.gather(*(buckets.insert(exchange(index)) for index in range(23)))
+        return await buckets.recent(USER_ID, 100)
+
+    turns = asyncio.run(run())
+
+    documents = bucket_documents(mongo)
+    assert len(turns) == 46
+    assert all(document["count"] == len(document["turns"]) <= 10 for document in documents)
+    assert sum(document["open"] for document in documents) == 1
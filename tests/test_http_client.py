@@ -0,0 +1,16 @@
+from src.bot.http_client import MeteredTransport
+
+
+def test_connection_counts_read_the_pool():
+    transport = MeteredTransport()
+
+    assert transport.connection_counts() == {"connections": 0, "connections_in_use": 0}
+
+
+def test_connection_counts_fall_back_when_the_pool_is_not_where_we_expect(monkeypatch):
+    transport = MeteredTransport()
+    monkeypatch.delattr(type(transport._pool), "connections")
+    transport.stats.in_flight = 2
+
+    assert transport.connection_counts() == {"connections_in_use": 2}
+
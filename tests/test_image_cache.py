@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+import pytest
+
+from src.bot import image_cache as image_cache_module
+from src.bot.image_cache import ImageCache
+
+PNG = b"\x89PNG not really"
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_cache_module, "IMAGE_CACHE_ENABLED", True)
+    monkeypatch.setattr(image_cache_module, "IMAGE_CACHE_DIR", str(tmp_path))
+    cache = ImageCache()
+    asyncio.run(cache.store_png("key", PNG))
+    return cache
+
+
+def test_cached_png_is_read_back(cache):
+    with cache.open_png("key") as png:
+        assert png[:] == PNG
+    assert cache.stats["disk_hits"] == 1
+
+
+def test_png_removed_from_disk_is_a_miss(cache, tmp_path):
+    os.remove(tmp_path / "key.png")
+
+    with cache.open_png("key") as png:
+        assert png is None
+    assert cache.snapshot()["disk_files"] == 0
+    assert cache.snapshot()["disk_bytes"] == 0
+
+
+def test_unknown_key_is_a_miss(cache):
+    with cache.open_png(None) as png:
+        assert png is None
+    with cache.open_png("other") as png:
+        assert png is None
@@ -0,0 +1,44 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+from telegram import PhotoSize
+
+from src.bot import image_pipeline
+from src.bot.image_pipeline import IMAGE_URL, pick_photo, stream_json_with_image
+
+SIZES = [PhotoSize(f"{side}", f"{side}", side, side * 3 // 4) for side in (1280, 90, 320, 800)]
+
+
+@pytest.fixture(autouse=True)
+def targets(monkeypatch):
+    monkeypatch.setattr(image_pipeline, "IMAGE_TARGET_SIZES", {"vision": 512, "removebg": 4000})
+
+
+def test_the_smallest_size_reaching_the_target_is_picked():
+    assert pick_photo(SIZES, "vision").width == 800
+
+
+@pytest.mark.parametrize("task", ["removebg", "unknown"])
+def test_the_largest_size_is_picked_without_a_reachable_target(task):
+    assert pick_photo(SIZES, task).width == 1280
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 1000, 1001])
+def test_the_streamed_body_is_the_payload_with_the_image_inlined(monkeypatch, size):
+    # A small chunk so the image is encoded in many pieces
+    monkeypatch.setattr(image_pipeline, "_CHUNK", 30)
+    image = os.urandom(size)
+    payload = {"messages": [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": IMAGE_URL}}]}]}
+
+    async def read():
+        chunks, length = stream_json_with_image(payload, memoryview(image), "image/png")
+        return b"".join([chunk async for chunk in chunks]), length
+
+    body, length = asyncio.run(read())
+
+    assert len(body) == length
+    url = json.loads(body)["messages"][0]["content"][0]["image_url"]["url"]
+    assert url == "data:image/png;base64," + base64.b64encode(image).decode("ascii")
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.bot.job_pool import JobPool, in_pool
+
+
+class _Application:
+    """Records the errors of its tasks, as Application.create_task hands them to process_error."""
+
+    def __init__(self):
+        self.errors = []
+
+    def create_task(self, coroutine, update=None):
+        task = asyncio.create_task(coroutine)
+        task.add_done_callback(lambda done: done.exception() and self.errors.append((update, done.exception())))
+        return task
+
+
+def test_a_failing_job_reaches_the_error_handler_with_its_update():
+    pool = JobPool("test", concurrency=1, max_pending=2)
+    application = _Application()
+    context = SimpleNamespace(application=application)
+
+    @in_pool(pool, "busy")
+    async def handler(update, context):
+        raise ValueError("boom")
+
+    async def run():
+        await handler("update", context)
+        await pool.stop(timeout=1)
+
+    asyncio.run(run())
+
+    assert [(update, type(error)) for update, error in application.errors] == [("update", ValueError)]
+    assert pool.stats["failed"] == 1
+
+
+def test_jobs_beyond_max_pending_are_refused():
+    pool = JobPool("test", concurrency=1, max_pending=1)
+    replies = []
+
+    async def reply_text(text):
+        replies.append(text)
+
+    update = SimpleNamespace(effective_message=SimpleNamespace(reply_text=reply_text))
+    context = SimpleNamespace(application=_Application())
+
+    @in_pool(pool, "busy")
+    async def handler(update, context):
+        await asyncio.sleep(0.01)
+
+    async def run():
+        await handler(update, context)
+        await handler(update, context)
+        await pool.stop(timeout=1)
+
+    asyncio.run(run())
+
+    assert replies == ["busy"]
+    assert pool.stats == {"submitted": 1, "completed": 1, "failed": 0, "refused": 1}
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+
+from src import config
+from src.bot import model_router, model_strategy
+from src.bot.model_router import CLOSED, HALF_OPEN, OPEN, ModelScoreboard
+from src.bot.utils import try_models
+
+
+@pytest.fixture
+def scoreboard(monkeypatch):
+    board = ModelScoreboard()
+    monkeypatch.setattr(model_router, "scoreboard", board)
+    monkeypatch.setattr(config, "MODEL_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 30)
+    return board
+
+
+def test_order_puts_the_fastest_model_first(scoreboard):
+    scoreboard.record_success("slow", 2.0)
+    scoreboard.record_success("fast", 0.2)
+    assert scoreboard.order(["slow", "fast"]) == ["fast", "slow"]
+
+
+def test_rate_limited_model_is_skipped_until_its_cooldown_ends(scoreboard):
+    scoreboard.record_failure("a", 429, retry_after=30)
+    assert scoreboard.order(["a", "b"]) == ["b"]
+    assert scoreboard.is_available("a", now=time.monotonic() + 31)
+
+
+def test_breaker_opens_after_consecutive_failures(scoreboard):
+    for _ in range(2):
+        scoreboard.record_failure("a")
+    assert scoreboard.acquire("a")
+    scoreboard.record_failure("a")
+    assert scoreboard.snapshot()["a"]["state"] == OPEN
+    assert not scoreboard.acquire("a")
+
+
+def test_half_open_breaker_lets_one_probe_through(scoreboard, monkeypatch):
+    for _ in range(3):
+        scoreboard.record_failure("a")
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 0)
+    assert scoreboard.acquire("a")
+    assert scoreboard.snapshot()["a"]["state"] == HALF_OPEN
+    assert not scoreboard.acquire("a")
+
+    scoreboard.record_success("a", 1.0)
+    assert scoreboard.snapshot()["a"]["state"] == CLOSED
+    assert scoreboard.acquire("a")
+
+
+def test_failed_probe_opens_the_breaker_again(scoreboard, monkeypatch):
+    for _ in range(3):
+        scoreboard.record_failure("a")
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 0)
+    assert scoreboard.acquire("a")
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 30)
+    scoreboard.record_failure("a")
+    assert scoreboard.snapshot()["a"]["state"] == OPEN
+    assert not scoreboard.acquire("a")
+
+
+def test_cancelled_probe_gives_its_slot_back(scoreboard, monkeypatch):
+    for _ in range(3):
+        scoreboard.record_failure("a")
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 0)
+    assert scoreboard.acquire("a")
+    scoreboard.release("a")
+    assert scoreboard.acquire("a")
+
+
+def test_fallback_is_the_model_that_recovers_first(scoreboard):
+    scoreboard.record_failure("a", 429, retry_after=30)
+    scoreboard.record_failure("b", 429, retry_after=10)
+    assert scoreboard.order(["a", "b"]) == []
+    assert scoreboard.fallback(["a", "b"]) == "b"
+    assert not scoreboard.acquire("b")
+    assert scoreboard.acquire("b", last_resort=True)
+
+
+def test_try_models_calls_the_fallback_when_every_model_is_cooling_down(scoreboard, monkeypatch):
+    calls = []
+
+    async def call_model(client, model, payload_base, headers, endpoint, body=None, last_resort=False):
+        calls.append((model, last_resort))
+        return "answer"
+
+    monkeypatch.setattr(model_strategy, "call_model", call_model)
+    scoreboard.record_failure("only", 429, retry_after=60)
+
+    result = asyncio.run(try_models(["only"], {}, {}, "https://example.invalid", client=object(), strategy="sequential"))
+
+    assert result == "answer"
+    assert calls == [("only", True)]
+
+
+def test_timed_out_attempt_is_recorded_as_a_timeout(scoreboard, monkeypatch):
+    outcomes = []
+    monkeypatch.setattr(model_strategy, "scoreboard", scoreboard)
+    monkeypatch.setattr(model_strategy, "observe_model_attempt", lambda model, mode, outcome, seconds: outcomes.append(outcome))
+
+    class SlowClient:
+        async def post(self, *args, **kwargs):
+            await asyncio.sleep(1)
+
+    async def attempt(model):
+        return await model_strategy.call_model(SlowClient(), model, {}, {}, "https://example.invalid")
+
+    result = asyncio.run(model_strategy._attempt_with_deadline(attempt, "slow", 0.01))
+
+    assert result is None
+    assert outcomes == ["timeout"]
+    assert scoreboard.snapshot()["slow"]["failures"] == 1
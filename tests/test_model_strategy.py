@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from src import config
+from src.bot import model_strategy
+from src.bot.model_router import ModelScoreboard
+from src.bot.model_strategy import HEDGED, RACE, SEQUENTIAL, LatencyWindow, run_strategy
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(model_strategy, "scoreboard", ModelScoreboard())
+    monkeypatch.setattr(model_strategy, "latency_window", LatencyWindow())
+    monkeypatch.setattr(config, "LLM_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(config, "LLM_RACE_FANOUT", 2)
+
+
+class Models:
+    """Fake models answering after a set delay; None stands for a failed attempt."""
+
+    def __init__(self, **script):
+        self.script = script
+        self.started = []
+        self.cancelled = []
+
+    async def attempt(self, model):
+        self.started.append(model)
+        delay, answer = self.script[model]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        return answer
+
+
+def run(strategy, models, attempt_timeout=5, overall_timeout=5):
+    return asyncio.run(run_strategy(strategy, list(models.script), models.attempt, attempt_timeout, overall_timeout))
+
+
+def test_hedge_starts_the_next_model_once_the_first_is_slow():
+    models = Models(a=(1, "from a"), b=(0.01, "from b"))
+
+    assert run(HEDGED, models) == "from b"
+    assert models.started == ["a", "b"]
+    assert models.cancelled == ["a"]
+
+
+def test_no_hedge_when_the_first_model_answers_in_time():
+    models = Models(a=(0.01, "from a"), b=(0.01, "from b"))
+
+    assert run(HEDGED, models) == "from a"
+    assert models.started == ["a"]
+
+
+def test_race_skips_a_failed_answer_and_cancels_the_losers():
+    models = Models(a=(0.01, None), b=(0.05, "from b"), c=(1, "from c"))
+
+    assert run(RACE, models) == "from b"
+    # a failing straight away starts c without waiting for b
+    assert models.started == ["a", "b", "c"]
+    assert models.cancelled == ["c"]
+
+
+def test_attempt_timeout_moves_on_to_the_next_model():
+    models = Models(a=(1, "from a"), b=(0.01, "from b"))
+
+    assert run(SEQUENTIAL, models, attempt_timeout=0.05) == "from b"
+    assert models.cancelled == ["a"]
+
+
+@pytest.mark.parametrize("strategy", [SEQUENTIAL, HEDGED, RACE])
+def test_overall_deadline_gives_up_and_cancels_every_attempt(strategy):
+    models = Models(a=(1, "from a"), b=(1, "from b"))
+
+    assert run(strategy, models, overall_timeout=0.2) is None
+    assert sorted(models.cancelled) == sorted(models.started)
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.bot import rate_limit
+from src.bot.rate_limit import AdmissionController, TokenBucket
+
+
+def text_update(user_id=1, chat_id=1):
+    replies = []
+
+    async def reply_text(text):
+        replies.append(text)
+
+    message = SimpleNamespace(text="hello", caption=None, photo=None, reply_text=reply_text)
+    return SimpleNamespace(
+        effective_message=message,
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=chat_id),
+        replies=replies,
+    )
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """One token per user, refilled every 0.1s; chats and upstreams never limit."""
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_USER", (1, 10))
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_CHAT", (100, 100))
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_UPSTREAMS", {})
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BACKEND", "memory")
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_COSTS", {"text": 1})
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_MAX_WAIT", 0.15)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_NOTIFY_AFTER", 0.05)
+
+
+def test_bucket_refills_at_its_rate_up_to_its_capacity():
+    bucket = TokenBucket(capacity=2, rate=1)
+    start = bucket.updated
+    bucket.take(2)
+    assert bucket.wait_time(1, start) == pytest.approx(1)
+    assert bucket.wait_time(1, start + 1) == 0
+    assert bucket.wait_time(2, start + 10) == 0
+    assert bucket.tokens == 2
+    assert bucket.wait_time(3, start + 10) == float("inf")
+
+
+def test_fresh_bucket_is_full_for_a_clock_read_before_it_was_made():
+    bucket = TokenBucket(capacity=1, rate=10)
+    assert bucket.wait_time(1, bucket.updated - 0.001) == 0
+
+
+def test_request_over_the_limit_is_queued_with_a_notice_then_rejected(limits):
+    async def run():
+        controller = AdmissionController()
+        updates = [text_update() for _ in range(3)]
+        # The second request reserves the next token, so the third would wait too long
+        results = await asyncio.gather(*(controller.admit(update) for update in updates))
+        return controller, updates, results
+
+    controller, updates, results = asyncio.run(run())
+
+    assert [admitted for admitted, _ in results] == [True, True, False]
+    assert results[2][1] > 0.15
+    assert updates[0].replies == []
+    assert len(updates[1].replies) == 1 and "quickly" in updates[1].replies[0]
+    assert controller.stats["queued"] == 1
+    assert controller.stats["rejected"] == 1
+
+
+def test_short_waits_are_queued_silently(limits, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_NOTIFY_AFTER", 1)
+
+    async def run():
+        controller = AdmissionController()
+        updates = [text_update() for _ in range(2)]
+        for update in updates:
+            assert (await controller.admit(update))[0]
+        return updates
+
+    updates = asyncio.run(run())
+
+    assert updates[1].replies == []
+
+
+class FakeMongoBuckets:
+    def __init__(self, refuse=(), fail=False):
+        self.refuse = refuse
+        self.fail = fail
+        self.taken = []
+        self.refunded = []
+
+    async def try_take(self, key, capacity, rate, cost):
+        if self.fail:
+            raise ConnectionError("mongo is down")
+        if key.split(":")[0] in self.refuse:
+            return False
+        self.taken.append(key)
+        return True
+
+    async def refund(self, key, cost):
+        self.refunded.append(key)
+
+
+def test_shared_limiter_refunds_scopes_already_charged_on_rejection(limits):
+    controller = AdmissionController()
+    controller._mongo = FakeMongoBuckets(refuse=("chat",))
+
+    admitted, retry_in = asyncio.run(controller.admit(text_update()))
+
+    assert not admitted
+    assert retry_in == pytest.approx(1 / 100)
+    assert controller._mongo.refunded == ["user:1"]
+
+
+def test_shared_limiter_fails_open_when_mongo_is_down(limits):
+    controller = AdmissionController()
+    controller._mongo = FakeMongoBuckets(fail=True)
+
+    admitted, _ = asyncio.run(controller.admit(text_update()))
+
+    assert admitted
+    assert controller.stats["backend_errors"] == 1
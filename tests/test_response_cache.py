@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src import config
+from src.bot import handlers
+from src.bot import response_cache as response_cache_module
+from src.bot.coalescing import CoalescedRequest
+from src.bot.response_cache import ResponseCache
+
+
+class FakeMessage:
+    def __init__(self, chat_id, text=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = SimpleNamespace(id=chat_id)
+        self.edits = []
+        self.replies = []
+
+    async def reply_text(self, text):
+        reply = FakeMessage(self.chat_id, text)
+        self.replies.append(reply)
+        return reply
+
+    async def edit_text(self, text):
+        self.text = text
+        self.edits.append(text)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(response_cache_module, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache_module, "RESPONSE_CACHE_BACKEND", "memory")
+    cache = ResponseCache()
+    monkeypatch.setattr(handlers, "response_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """A slow, non-streaming model behind standalone prompts; records each upstream call."""
+    calls = []
+
+    async def build_context(user_id, text, models):
+        return [{"role": "system", "content": "system"}, {"role": "user", "content": text}]
+
+    async def try_models(models, payload_base, headers, endpoint, **kwargs):
+        calls.append(payload_base["messages"][-1]["content"])
+        await asyncio.sleep(0.05)
+        return "Paris"
+
+    async def store(*args):
+        pass
+
+    monkeypatch.setattr(config, "TELEGRAM_EDIT_INTERVAL", 0)
+    monkeypatch.setattr(handlers, "LLM_STREAMING", False)
+    monkeypatch.setattr(handlers, "build_context", build_context)
+    monkeypatch.setattr(handlers, "try_models", try_models)
+    monkeypatch.setattr(handlers, "add_messages_to_history", store)
+    monkeypatch.setattr(handlers, "add_message_to_history", store)
+    return calls
+
+
+def answer(chat_id, text):
+    request = CoalescedRequest([FakeMessage(chat_id, text)])
+    return request, handlers.answer_text(request)
+
+
+def test_identical_standalone_prompts_share_one_llm_call(cache, llm):
+    async def run():
+        first, first_answer = answer(1, "What is the capital of France?")
+        second, second_answer = answer(2, "what is the capital of france")
+        await asyncio.gather(first_answer, second_answer)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(llm) == 1
+    assert first.message.replies[0].text == second.message.replies[0].text == "Paris"
+    assert cache.stats["coalesced"] == 1
+
+
+def test_answered_prompt_is_served_from_the_cache(cache, llm):
+    async def run():
+        _, first_answer = answer(1, "What is the capital of France?")
+        await first_answer
+        request, second_answer = answer(2, "What is the capital of France?")
+        await second_answer
+        return request
+
+    request = asyncio.run(run())
+
+    assert len(llm) == 1
+    assert request.message.replies[0].text == "Paris"
+    assert cache.stats["hits"] == 1
@@ -0,0 +1,69 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from telegram import Update
+
+from src import router
+from src.bot.update_queue import chat_key
+
+USER = {"id": 42, "is_bot": False, "first_name": "A"}
+CHAT = {"id": -1001, "type": "group"}
+MESSAGE = {"message_id": 1, "date": 0, "chat": CHAT, "from": USER, "text": "hi"}
+
+UPDATES = [
+    {"update_id": 1, "message": MESSAGE},
+    {"update_id": 2, "edited_message": {**MESSAGE, "edit_date": 0}},
+    {"update_id": 3, "callback_query": {"id": "q", "from": USER, "chat_instance": "c", "message": MESSAGE}},
+    {"update_id": 4, "inline_query": {"id": "q", "from": USER, "query": "", "offset": ""}},
+    {"update_id": 5, "my_chat_member": {"chat": CHAT, "from": USER, "date": 0, "old_chat_member": {"status": "left", "user": USER}, "new_chat_member": {"status": "member", "user": USER}}},
+    # A kind neither side knows falls back to the update_id
+    {"update_id": 6, "future_update": {"id": "x"}},
+]
+
+
+@pytest.mark.parametrize("update_dict", UPDATES, ids=lambda update_dict: list(update_dict)[1])
+def test_the_router_keys_updates_like_the_worker_queue(update_dict):
+    assert router.chat_key_from_dict(update_dict) == chat_key(Update.de_json(update_dict, None))
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    urls = ["http://worker-0", "http://worker-1", "http://worker-2"]
+    forwarded = []
+
+    def handler(request):
+        forwarded.append((f"{request.url.scheme}://{request.url.host}", request.content))
+        return httpx.Response(200, json={"ok": True})
+
+    monkeypatch.setattr(router, "ROUTER_WORKER_URLS", urls)
+    monkeypatch.setattr(router, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return forwarded
+
+
+def post(update_dict):
+    # Without a `with` block the lifespan does not run, so the patched client is used
+    return TestClient(router.app).post("/webhook", json=update_dict)
+
+
+def test_every_update_of_a_chat_goes_to_the_same_worker(workers):
+    for update_id in range(6):
+        chat = {"id": update_id % 3, "type": "private"}
+        assert post({"update_id": update_id, "message": {**MESSAGE, "chat": chat}}).status_code == 200
+
+    assert [worker for worker, _ in workers] == ["http://worker-0", "http://worker-1", "http://worker-2"] * 2
+    # The body is passed on untouched
+    assert all(body.startswith(b'{"update_id"') for _, body in workers)
+
+
+def test_an_unhandled_update_is_acknowledged_without_forwarding(workers):
+    assert post(UPDATES[5]).status_code == 200
+    assert workers == []
+
+
+def test_an_unreachable_worker_asks_telegram_to_retry(workers, monkeypatch):
+    def handler(request):
+        raise httpx.ConnectError("refused")
+
+    monkeypatch.setattr(router, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    assert post(UPDATES[0]).status_code == 503
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from telegram.error import RetryAfter
+
+from src.bot import send_scheduler as send_scheduler_module
+from src.bot.send_scheduler import SendScheduler
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(send_scheduler_module, "SEND_SCHEDULER_ENABLED", True)
+    monkeypatch.setattr(send_scheduler_module, "SEND_RATE_GLOBAL", (100, 1000))
+    monkeypatch.setattr(send_scheduler_module, "SEND_RATE_CHAT", (1, 10))
+    monkeypatch.setattr(send_scheduler_module, "SEND_MAX_RETRIES", 3)
+    monkeypatch.setattr(send_scheduler_module, "SEND_MAX_RETRY_AFTER", 1)
+    return SendScheduler
+
+
+class Telegram:
+    """Records sent texts, answering the first `flood` calls with a RetryAfter."""
+
+    def __init__(self, flood=0, retry_after=0.2):
+        self.flood = flood
+        self.retry_after = retry_after
+        self.calls = []
+
+    async def call(self, chat_id, text):
+        self.calls.append((chat_id, text, time.monotonic()))
+        if self.flood:
+            self.flood -= 1
+            raise RetryAfter(timedelta(seconds=self.retry_after))
+        return text
+
+
+async def send(scheduler, telegram, chat_id, text, endpoint="sendMessage", message_id=None):
+    data = {"chat_id": chat_id, "text": text}
+    if message_id is not None:
+        data["message_id"] = message_id
+    return await scheduler.process_request(telegram.call, (chat_id, text), {}, endpoint, data, None)
+
+
+def run(scheduler_class, scenario):
+    async def main():
+        scheduler = scheduler_class()
+        await scheduler.initialize()
+        try:
+            return await scenario(scheduler)
+        finally:
+            await scheduler.shutdown()
+
+    return asyncio.run(main())
+
+
+def test_retry_after_pauses_only_that_chat_and_the_send_is_retried(scheduler):
+    telegram = Telegram(flood=1)
+
+    async def scenario(scheduler):
+        results = await asyncio.gather(send(scheduler, telegram, 1, "flooded"), send(scheduler, telegram, 2, "other chat"))
+        return results, scheduler.stats
+
+    results, stats = run(scheduler, scenario)
+
+    assert results == ["flooded", "other chat"]
+    assert stats["retried"] == 1
+    first, other, retry = telegram.calls
+    assert other[0] == 2 and other[2] - first[2] < 0.1
+    assert retry[0] == 1 and retry[2] - first[2] >= 0.2
+
+
+def test_a_retry_after_longer_than_the_limit_is_raised(scheduler):
+    telegram = Telegram(flood=1, retry_after=5)
+
+    async def scenario(scheduler):
+        with pytest.raises(RetryAfter):
+            await send(scheduler, telegram, 1, "flooded")
+        return scheduler.stats
+
+    assert run(scheduler, scenario)["gave_up"] == 1
+    assert len(telegram.calls) == 1
+
+
+def test_waiting_edits_of_a_message_are_merged_into_the_latest(scheduler):
+    telegram = Telegram()
+
+    async def scenario(scheduler):
+        # Uses up the chat's token, so the edits have to wait for the next one
+        await send(scheduler, telegram, 1, "Thinking...")
+        edits = [send(scheduler, telegram, 1, text, "editMessageText", message_id=7) for text in ("a", "ab", "abc")]
+        return await asyncio.gather(*edits), scheduler.snapshot()
+
+    results, snapshot = run(scheduler, scenario)
+
+    assert [text for _, text, _ in telegram.calls] == ["Thinking...", "abc"]
+    assert results == ["abc"] * 3
+    assert snapshot["merged_edits"] == 2
+    assert snapshot["pending_edits"] == 0
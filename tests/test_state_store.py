@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from src.bot import state_store as state_store_module
+from src.bot.state_store import TURN_OVERHEAD, MemoryStateStore, MongoStateStore
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(state_store_module, "STATE_MAX_TURNS", 4)
+    monkeypatch.setattr(state_store_module, "STATE_MAX_KEY_BYTES", 4 * (TURN_OVERHEAD + 100))
+    monkeypatch.setattr(state_store_module, "STATE_MAX_BYTES", 3 * 4 * (TURN_OVERHEAD + 100))
+
+
+def texts(messages):
+    return [message["content"][0]["text"] for message in messages]
+
+
+def test_a_user_keeps_only_the_latest_turns():
+    store = MemoryStateStore()
+
+    async def run():
+        for index in range(6):
+            await store.append(1, "user", f"turn {index}")
+        return await store.get(1), await store.get(1, limit=2)
+
+    turns, latest = asyncio.run(run())
+
+    assert texts(turns) == ["turn 2", "turn 3", "turn 4", "turn 5"]
+    assert texts(latest) == ["turn 4", "turn 5"]
+    assert store.stats["trimmed_turns"] == 2
+
+
+def test_a_long_turn_pushes_older_ones_out_and_is_cut_to_the_user_budget():
+    store = MemoryStateStore()
+
+    async def run():
+        await store.append(1, "user", "short")
+        await store.append(1, "assistant", "x" * 10_000)
+        return await store.get(1)
+
+    turns = asyncio.run(run())
+
+    assert texts(turns) == ["x" * (4 * (TURN_OVERHEAD + 100) - TURN_OVERHEAD)]
+    assert store.snapshot()["bytes"] == 4 * (TURN_OVERHEAD + 100)
+
+
+def test_the_least_recently_used_user_is_evicted_first():
+    store = MemoryStateStore()
+
+    async def fill(key):
+        for _ in range(4):
+            await store.append(key, "user", "y" * 100)
+
+    async def run():
+        for key in (1, 2, 3):
+            await fill(key)
+        # Reading user 1 makes user 2 the least recently used
+        await store.get(1)
+        await fill(4)
+        return [bool(await store.get(key)) for key in (1, 2, 3, 4)]
+
+    assert asyncio.run(run()) == [True, False, True, True]
+    assert store.stats["evictions"] == 1
+    assert store.snapshot()["bytes"] <= state_store_module.STATE_MAX_BYTES
+
+
+def test_pop_and_clear_give_their_bytes_back():
+    store = MemoryStateStore()
+
+    async def run():
+        await store.append(1, "user", "question")
+        await store.append(1, "assistant", "answer")
+        await store.pop(1)
+        remaining = await store.get(1)
+        await store.clear(2)
+        await store.append(2, "user", "other")
+        await store.clear(2)
+        return remaining
+
+    assert texts(asyncio.run(run())) == ["question"]
+    assert store.snapshot()["bytes"] == TURN_OVERHEAD + len("question")
+
+
+def test_the_shared_store_keeps_only_the_latest_turns(mongo):
+    store = MongoStateStore()
+
+    async def run():
+        for index in range(6):
+            await store.append(1, "user", f"turn {index}")
+        await store.pop(1)
+        return await store.get(1), await store.get(1, limit=2)
+
+    turns, latest = asyncio.run(run())
+
+    assert texts(turns) == ["turn 2", "turn 3", "turn 4"]
+    assert texts(latest) == ["turn 3", "turn 4"]
@@ -0,0 +1,137 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+
+from src import config
+from src.bot import streaming
+from src.bot.model_router import HALF_OPEN, ModelScoreboard
+from src.bot.streaming import stream_models
+
+
+@pytest.fixture
+def scoreboard(monkeypatch):
+    board = ModelScoreboard()
+    monkeypatch.setattr(streaming, "scoreboard", board)
+    monkeypatch.setattr(config, "MODEL_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 30)
+    return board
+
+
+def upstream(monkeypatch, script):
+    """Replaces the SSE request with `script(model)`, an async generator of deltas."""
+
+    def stream_model(client, model, payload_base, headers, endpoint):
+        return script(model)
+
+    monkeypatch.setattr(streaming, "stream_model", stream_model)
+
+
+def collect(models, limit=None):
+    async def run():
+        deltas = []
+        async with aclosing(stream_models(models, {}, {}, "https://example.invalid", client=object())) as stream:
+            async for delta in stream:
+                deltas.append(delta)
+                if len(deltas) == limit:
+                    break
+        return deltas
+
+    return asyncio.run(run())
+
+
+def test_closing_the_stream_gives_a_half_open_probe_back(scoreboard, monkeypatch):
+    async def script(model):
+        yield "Hello"
+        yield " world"
+
+    upstream(monkeypatch, script)
+    for _ in range(3):
+        scoreboard.record_failure("a")
+    monkeypatch.setattr(config, "MODEL_BREAKER_OPEN_SECONDS", 0)
+
+    assert collect(["a"], limit=1) == ["Hello"]
+
+    assert scoreboard.snapshot()["a"]["state"] == HALF_OPEN
+    # The probe slot is free again, so the model can be tried
+    assert scoreboard.acquire("a")
+
+
+def test_a_model_that_never_starts_is_skipped_for_the_next(scoreboard, monkeypatch):
+    async def script(model):
+        if model == "a":
+            await asyncio.sleep(1)
+        yield f"from {model}"
+
+    upstream(monkeypatch, script)
+    monkeypatch.setattr(config, "LLM_ATTEMPT_TIMEOUT", 0.05)
+    scoreboard.record_success("a", 0.1)
+
+    assert collect(["a", "b"]) == ["from b"]
+    assert scoreboard.snapshot()["a"]["failures"] == 1
+
+
+def test_a_stalled_stream_keeps_the_partial_answer(scoreboard, monkeypatch):
+    async def script(model):
+        yield f"from {model}"
+        await asyncio.sleep(1)
+        yield " and more"
+
+    upstream(monkeypatch, script)
+    monkeypatch.setattr(config, "LLM_STREAM_IDLE_TIMEOUT", 0.05)
+    scoreboard.record_success("a", 0.1)
+
+    # Not restarted on b, which would repeat the answer from the beginning
+    assert collect(["a", "b"]) == ["from a"]
+    assert scoreboard.snapshot()["a"]["failures"] == 1
+
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        message = Message(self, text)
+        self.sent.append(message)
+        return message
+
+
+class Message:
+    chat_id = 1
+
+    def __init__(self, bot, text):
+        self.bot = bot
+        self.text = text
+
+    def get_bot(self):
+        return self.bot
+
+    async def edit_text(self, text):
+        assert len(text) <= streaming.MAX_MESSAGE_LENGTH
+        self.text = text
+
+
+def test_a_long_reply_continues_in_new_messages_at_word_boundaries(monkeypatch):
+    monkeypatch.setattr(config, "TELEGRAM_EDIT_INTERVAL", 0)
+    monkeypatch.setattr(streaming, "_last_edit", {})
+    bot = Bot()
+    placeholder = Message(bot, "Thinking...")
+    continuations = []
+    words = [f"word{index}" for index in range(1100)]
+
+    async def run():
+        reply = streaming.StreamingReply(placeholder, continuations)
+        for word in words:
+            await reply.append(word + " ")
+        return await reply.finish()
+
+    text = asyncio.run(run())
+
+    messages = [placeholder, *bot.sent]
+    assert len(messages) == 3
+    assert len(continuations) == 2
+    assert all(len(message.text) <= streaming.MAX_MESSAGE_LENGTH for message in messages)
+    # Every message ends on a whole word and together they are the full answer
+    assert all(message.text.endswith(" ") for message in messages[:-1])
+    assert "".join(message.text for message in messages) == text
+    assert text.split() == words
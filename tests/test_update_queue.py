@@ -0,0 +1,97 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from src import config
+from src.bot.update_queue import UpdateQueue
+
+
+def update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id), effective_user=None)
+
+
+class Application:
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.processed = []
+        self.running = 0
+        self.most_running = 0
+
+    async def process_update(self, update):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            await asyncio.sleep(random.uniform(0, 0.01))
+            if update.update_id < 0:
+                raise RuntimeError("handler failed")
+            self.processed.append((update.effective_chat.id, update.update_id))
+        finally:
+            self.running -= 1
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setattr(config, "UPDATE_WORKERS", 4)
+    monkeypatch.setattr(config, "UPDATE_QUEUE_SIZE", 400)
+    monkeypatch.setattr(config, "UPDATE_DRAIN_TIMEOUT", 5)
+
+
+def test_updates_from_one_chat_run_in_order_and_chats_run_in_parallel(settings):
+    application = Application()
+
+    async def run():
+        queue = UpdateQueue()
+        await queue.start(application)
+        for update_id in range(20):
+            for chat_id in range(8):
+                assert queue.submit(update(update_id, chat_id))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+
+    for chat_id in range(8):
+        assert [update_id for chat, update_id in application.processed if chat == chat_id] == list(range(20))
+    assert application.most_running > 1
+    assert queue.snapshot()["processed"] == 160
+
+
+def test_a_full_shard_sheds_the_update(settings, monkeypatch):
+    monkeypatch.setattr(config, "UPDATE_WORKERS", 1)
+    monkeypatch.setattr(config, "UPDATE_QUEUE_SIZE", 2)
+
+    async def run():
+        application = Application(gate=asyncio.Event())
+        queue = UpdateQueue()
+        await queue.start(application)
+        accepted = [queue.submit(update(update_id, 1)) for update_id in range(3)]
+        application.gate.set()
+        await queue.stop()
+        return accepted, queue.snapshot(), application
+
+    accepted, snapshot, application = asyncio.run(run())
+
+    assert accepted == [True, True, False]
+    assert snapshot["shed"] == 1
+    assert application.processed == [(1, 0), (1, 1)]
+
+
+def test_a_failing_update_does_not_stop_its_worker(settings):
+    application = Application()
+
+    async def run():
+        queue = UpdateQueue()
+        await queue.start(application)
+        queue.submit(update(-1, 1))
+        queue.submit(update(1, 1))
+        await queue.stop()
+        return queue.snapshot()
+
+    snapshot = asyncio.run(run())
+
+    assert snapshot["failed"] == 1
+    assert application.processed == [(1, 1)]
@@ -0,0 +1,68 @@
+import pytest
+
+from src.bot import webhook_codec
+from src.bot.webhook_codec import WebhookFilter, dumps, json_response, loads
+
+
+@pytest.fixture(autouse=True)
+def update_types(monkeypatch):
+    monkeypatch.setattr(webhook_codec, "WEBHOOK_UPDATE_TYPES", {"message", "edited_message"})
+
+
+def message(**fields):
+    return {"update_id": 1, "message": {"message_id": 1, "chat": {"id": 1}, **fields}}
+
+
+@pytest.mark.parametrize(
+    "update_dict, reason",
+    [
+        ({"update_id": 1, "channel_post": {"text": "hi"}}, "channel_post"),
+        ({"update_id": 1}, "empty"),
+        ({"update_id": 1, "message": None}, "message"),
+        (message(sticker={"file_id": "s"}), "message_other"),
+        (message(text="/start@other_bot"), "other_bot_command"),
+    ],
+)
+def test_updates_no_handler_acts_on_are_dropped(update_dict, reason):
+    webhook_filter = WebhookFilter()
+
+    assert webhook_filter.drop(update_dict, bot_username="this_bot")
+    assert webhook_filter.snapshot()["dropped"] == {reason: 1}
+
+
+@pytest.mark.parametrize(
+    "update_dict",
+    [
+        message(text="hello"),
+        message(photo=[{"file_id": "p"}], caption="/removebg"),
+        message(text="/start@This_Bot"),
+        message(text="/start"),
+        {"update_id": 1, "edited_message": {"text": "fixed typo"}},
+    ],
+)
+def test_updates_a_handler_may_act_on_are_kept(update_dict):
+    webhook_filter = WebhookFilter()
+
+    assert not webhook_filter.drop(update_dict, bot_username="this_bot")
+    assert webhook_filter.snapshot()["accepted"] == 1
+
+
+@pytest.mark.parametrize("parser", ["orjson", "json"])
+def test_both_parsers_read_and_write_the_same_json(monkeypatch, parser):
+    if parser == "json":
+        monkeypatch.setattr(webhook_codec, "orjson", None)
+    else:
+        pytest.importorskip("orjson")
+    update_dict = message(text="héllo ✓")
+
+    assert loads(dumps(update_dict)) == update_dict
+    with pytest.raises(ValueError):
+        loads(b"{not json")
+    assert WebhookFilter().snapshot()["parser"] == parser
+
+
+def test_the_default_response_is_a_plain_ok():
+    response = json_response()
+
+    assert response.status_code == 200
+    assert loads(response.body) == {"ok": True}
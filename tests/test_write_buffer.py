@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from src.database import write_buffer as write_buffer_module
+from src.database.write_buffer import DB_NAME, WriteBehindBuffer
+
+
+@pytest.fixture
+def buffer(mongo, monkeypatch):
+    monkeypatch.setattr(write_buffer_module, "WRITE_BUFFER_ENABLED", True)
+    # Nothing is flushed by size or time, so only stop() writes
+    monkeypatch.setattr(write_buffer_module, "WRITE_BUFFER_FLUSH_SIZE", 1000)
+    monkeypatch.setattr(write_buffer_module, "WRITE_BUFFER_FLUSH_INTERVAL", 60)
+    return WriteBehindBuffer()
+
+
+def documents(mongo, collection):
+    return list(mongo.get_database(DB_NAME).get_collection(collection)._collection.find({}, {"_id": 0}))
+
+
+def test_stop_writes_out_every_pending_operation(buffer, mongo):
+    async def run():
+        await buffer.start()
+        for index in range(3):
+            await buffer.add_insert("chat_history", {"user_id": 1, "content": f"turn {index}"})
+        await buffer.add_upsert("users", 1, {"name": "old"})
+        await buffer.add_upsert("users", 1, {"name": "new", "active": True})
+        assert documents(mongo, "chat_history") == []
+        await buffer.stop()
+
+    asyncio.run(run())
+
+    assert [document["content"] for document in documents(mongo, "chat_history")] == ["turn 0", "turn 1", "turn 2"]
+    assert documents(mongo, "users") == [{"name": "new", "active": True}]
+    assert buffer.snapshot()["pending"] == 0
+    assert not buffer.running
+    assert buffer.stats["merged_upserts"] == 1
+
+
+def test_producers_wait_while_the_buffer_is_full(buffer, mongo, monkeypatch):
+    monkeypatch.setattr(write_buffer_module, "WRITE_BUFFER_MAX_PENDING", 2)
+
+    async def run():
+        for index in range(2):
+            await buffer.add_insert("chat_history", {"user_id": 1, "content": f"turn {index}"})
+        blocked = asyncio.create_task(buffer.add_insert("chat_history", {"user_id": 1, "content": "turn 2"}))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        await buffer.flush()
+        await blocked
+        await buffer.stop()
+
+    asyncio.run(run())
+
+    assert len(documents(mongo, "chat_history")) == 3
+
+
+def test_settle_flushes_only_for_a_user_with_buffered_turns(buffer, mongo):
+    async def run():
+        await buffer.add_insert("chat_history", {"user_id": 1, "content": "turn"})
+        await buffer.settle("chat_history", "user_id", 2)
+        assert documents(mongo, "chat_history") == []
+        await buffer.settle("chat_history", "user_id", 1)
+
+    asyncio.run(run())
+
+    assert documents(mongo, "chat_history") == [{"user_id": 1, "content": "turn"}]
+
+
+@pytest.fixture
+def slow_inserts(monkeypatch):
+    """Makes insert_many take a while, so stop() and cancels land in the middle of a flush."""
+    from tests.bench_fakes import _AsyncCollection
+
+    async def insert_many(self, documents, **kwargs):
+        await asyncio.sleep(0.05)
+        return self._collection.insert_many(documents, **kwargs)
+
+    monkeypatch.setattr(_AsyncCollection, "insert_many", insert_many, raising=False)
+
+
+def test_stop_during_a_slow_flush_loses_nothing(buffer, mongo, slow_inserts, monkeypatch):
+    monkeypatch.setattr(write_buffer_module, "WRITE_BUFFER_FLUSH_SIZE", 5)
+
+    async def run():
+        await buffer.start()
+        for index in range(5):
+            await buffer.add_insert("chat_history", {"user_id": 1, "content": f"turn {index}"})
+        # The flush loop is now inside insert_many with every buffered turn
+        await asyncio.sleep(0.01)
+        assert buffer._flush_lock.locked()
+        await buffer.add_insert("chat_history", {"user_id": 1, "content": "turn 5"})
+        await buffer.stop()
+
+    asyncio.run(run())
+
+    assert len(documents(mongo, "chat_history")) == 6
+    assert buffer.snapshot()["pending"] == 0
+
+
+def test_cancelled_flush_puts_its_batch_back(buffer, mongo, slow_inserts):
+    async def run():
+        for index in range(5):
+            await buffer.add_insert("chat_history", {"user_id": 1, "content": f"turn {index}"})
+        await buffer.add_upsert("users", 1, {"name": "old"})
+        flush = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0.01)
+        await buffer.add_upsert("users", 1, {"active": True})
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        assert documents(mongo, "chat_history") == []
+        # The requeued upsert is merged with the newer one, which holds its own slot
+        assert buffer.snapshot()["pending"] == 6
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    assert [document["content"] for document in documents(mongo, "chat_history")] == [f"turn {index}" for index in range(5)]
+    assert documents(mongo, "users") == [{"name": "old", "active": True}]
+    assert buffer.snapshot()["pending"] == 0